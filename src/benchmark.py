@@ -0,0 +1,272 @@
+'''
+Benchmarks of the loading, pitch control, xT-added and video code on a synthetic match.
+
+A synthetic game is written in the FC_TWENTE_FOLDER layout ('Game N/Players/*.csv', 'Game N/events.csv' and
+'Game N/Metadata.csv'), so the benchmarks run without the real data. Every benchmark reports wall time, peak
+(traced) memory and throughput. Results are stored as JSON and can be compared against a saved baseline:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output bench_new.json --baseline bench.json --threshold 0.2
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_in_out as IO
+import velocities as vl
+import pitchcontrol as pc
+import ept
+
+
+def make_synthetic_match(fc_twente_folder, game_id=1, n_frames=7500, n_events=150, seed=0, first_frame=1000000, fps=25):
+    '''
+    Write a synthetic game (11 players per team, a ball and events) in the FC_TWENTE_FOLDER layout. Coordinates are
+    in the raw data convention (0..105 x 0..68 m), the first half covers the first n_frames/2 frames
+    '''
+    rng = np.random.default_rng(seed)
+    game_folder = os.path.join(fc_twente_folder, f"Game {game_id}")
+    players_folder = os.path.join(game_folder, "Players")
+    os.makedirs(players_folder, exist_ok=True)
+    frame_ids = np.arange(first_frame, first_frame + n_frames)
+    t = np.arange(n_frames) / float(fps)
+    period = np.where(np.arange(n_frames) < n_frames // 2, 1, 2)
+    minutes = (t // 60).astype(int)
+    seconds = (t % 60).astype(int)
+    # possession changes every 10 seconds
+    team_with_ball = np.where((np.arange(n_frames) // (10 * fps)) % 2 == 0, "Team_A", "Team_B")
+    ball_x = 52.5 + 30 * np.sin(t / 7.)
+    ball_y = 34. + 20 * np.cos(t / 5.)
+    pd.DataFrame({"frameID": frame_ids, "Period": period, "Time [s]": t, "Minutes": minutes, "Seconds": seconds,
+                  "X": ball_x, "Y": ball_y, "Team with the ball": team_with_ball}).to_csv(os.path.join(players_folder, "Ball.csv"), index=False)
+    for team, side in (("A", -1), ("B", 1)):
+        for p in range(1, 12):
+            if p == 1:  # goalkeeper
+                x0, y0 = 52.5 + side * 50, 34.
+            else:
+                x0, y0 = 52.5 + side * rng.uniform(5, 40), rng.uniform(5, 63)
+            x = x0 + 3 * np.sin(t / rng.uniform(2, 6) + rng.uniform(0, 6)) + np.cumsum(rng.normal(0, 0.02, n_frames))
+            y = y0 + 3 * np.cos(t / rng.uniform(2, 6) + rng.uniform(0, 6)) + np.cumsum(rng.normal(0, 0.02, n_frames))
+            speed = np.r_[0., np.hypot(np.diff(x), np.diff(y)) * fps]
+            pd.DataFrame({"frameID": frame_ids, "Period": period, "Time [s]": t, "Minutes": minutes, "Seconds": seconds,
+                          "X": x, "Y": y, "Snelheid": speed}).to_csv(os.path.join(players_folder, f"Team_{team}_Player_{p}.csv"), index=False)
+    event_frames = np.sort(rng.choice(n_frames, n_events, replace=False))
+    events = []
+    for k, f in enumerate(event_frames):
+        team = team_with_ball[f]
+        events.append({"period_id": period[f], "minute": minutes[f], "second": seconds[f], "outcome": bool(rng.integers(0, 2)),
+                       "start_x": ball_x[f], "start_y": ball_y[f], "end_x": rng.uniform(0, 105), "end_y": rng.uniform(0, 68),
+                       "type_name": "Pass" if k % 5 else "Shot", "FullName": f"{team}_Player_{rng.integers(2, 12)}",
+                       "Position": "Midfielder", "Team": team})
+    pd.DataFrame(events).to_csv(os.path.join(game_folder, "events.csv"))
+    pd.DataFrame({"key": ["home", "away"], "value": ["Team_A", "Team_B"]}).to_csv(os.path.join(game_folder, "Metadata.csv"), index=False)
+    return game_folder
+
+
+def measure(name, function, n_items=1, unit="calls", repeat=1, trace_memory=True):
+    '''
+    Run function() 'repeat' times and return the best wall time and the throughput (n_items per second, in 'unit').
+    The peak memory is measured with tracemalloc in one extra run, so that tracing does not slow down the timed runs.
+    Errors are recorded instead of raised
+    '''
+    result = {"name": name, "unit": unit, "n_items": n_items}
+    try:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        result.update({"wall_time_s": min(times), "throughput": n_items / min(times) if min(times) > 0 else float("inf")})
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                function()
+                result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1024. ** 2
+            finally:
+                tracemalloc.stop()
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    if "error" in result:
+        status = result["error"]
+    else:
+        status = "%.4f s, %.1f %s/s" % (result["wall_time_s"], result["throughput"], unit)
+        if "peak_memory_mb" in result:
+            status += ", peak %.1f MB" % result["peak_memory_mb"]
+    print("%-45s %s" % (name, status))
+    return result
+
+
+def run_benchmarks(fc_twente_folder, game_id=1, n_events=20, n_points=200, n_video_frames=50, repeat=1, xT_file=None):
+    results = []
+    # loading
+    for use_cache in (False, True):
+        suffix = " (cache)" if use_cache else " (csv)"
+        if use_cache:  # warm the cache of every file that is timed, so that the cache timings are warm reads
+            for mode in ("load-event", "load-metadata", "load-ball-data"):
+                IO.load_fc_twente_data(fc_twente_folder, game_id, mode=mode)
+            for team_id in ("A", "B"):
+                IO.load_fc_twente_data(fc_twente_folder, game_id, team_id=team_id, mode="load-team-data")
+        for mode in ("load-event", "load-metadata", "load-ball-data"):
+            results.append(measure("load_fc_twente_data %s%s" % (mode, suffix), lambda: IO.load_fc_twente_data(
+                fc_twente_folder, game_id, mode=mode, use_cache=use_cache), repeat=repeat))
+        results.append(measure("load_fc_twente_data load-team-data%s" % suffix, lambda: IO.load_fc_twente_data(
+            fc_twente_folder, game_id, team_id="A", mode="load-team-data", use_cache=use_cache), repeat=repeat))
+
+    events = IO.load_fc_twente_data(fc_twente_folder, game_id, mode="load-event")
+    results.append(measure("processing_events_data", lambda: IO.processing_events_data(
+        events.copy(), game_id, fc_twente_folder), n_items=len(events), unit="events", repeat=repeat))
+    events = IO.to_metric_coordinates(IO.processing_events_data(events, game_id, fc_twente_folder))
+    tracking_home = IO.to_metric_coordinates(IO.load_fc_twente_data(fc_twente_folder, game_id, team_id="A", mode="load-team-data"))
+    tracking_away = IO.to_metric_coordinates(IO.load_fc_twente_data(fc_twente_folder, game_id, team_id="B", mode="load-team-data"))
+    results.append(measure("calc_player_velocities", lambda: vl.calc_player_velocities(tracking_home),
+                           n_items=len(tracking_home), unit="frames", repeat=repeat))
+    tracking_home = vl.calc_player_velocities(tracking_home)
+    tracking_away = vl.calc_player_velocities(tracking_away)
+    GK_numbers = [IO.find_goalkeeper(tracking_home), IO.find_goalkeeper(tracking_away)]
+
+    # pitch control
+    params = pc.default_model_params()
+    passes = events.loc[events["type_name"] == "Pass"].index[:n_events]
+    event_id = passes[0]
+    pass_frame = events.loc[event_id]["start_frameID"]
+    ball_start_pos = np.array([events.loc[event_id]["start_x"], events.loc[event_id]["start_y"]])
+    attacking_players, defending_players = pc.initialise_event_players(
+        events.loc[event_id]["Team"], pass_frame, ball_start_pos, tracking_home, tracking_away, params, GK_numbers)
+    attacking_players, defending_players = attacking_players.players(params), defending_players.players(params)
+    rng = np.random.default_rng(1)
+    points = np.column_stack([rng.uniform(-52.5, 52.5, n_points), rng.uniform(-34, 34, n_points)])
+
+    def point_queries():
+        for point in points:
+            pc.calculate_pitch_control_at_target(point, attacking_players, defending_players, ball_start_pos, params)
+    results.append(measure("calculate_pitch_control_at_target", point_queries, n_items=n_points, unit="cells", repeat=repeat))
+
+    def surfaces():
+        for eid in passes:
+            pc.generate_pitch_control_for_event(eid, events, tracking_home, tracking_away, params, GK_numbers, verbose=False, use_cache=False)
+    n_cells = 50 * 32
+    results.append(measure("generate_pitch_control_for_event", surfaces, n_items=len(passes) * n_cells, unit="cells", repeat=repeat))
+    # the cell by cell reference implementation is slow, so it is only timed on a single event
+    results.append(measure("generate_pitch_control_for_event (reference)", lambda: pc.generate_pitch_control_for_event(
+        event_id, events, tracking_home, tracking_away, params, GK_numbers, vectorized=False, verbose=False, use_cache=False),
+        n_items=n_cells, unit="cells", repeat=1, trace_memory=False))
+    results.append(compare_surfaces(event_id, events, tracking_home, tracking_away, params, GK_numbers))
+
+    # xT added
+    xT = ept.load_xT_grid(xT_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), "xT.csv"))
+    home_attack_direction = IO.find_playing_direction(tracking_home, "Team_A")
+
+    def action_values():
+        for eid in passes:
+            ept.calculate_action_value_added(eid, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction)
+    results.append(measure("calculate_action_value_added", action_values, n_items=len(passes), unit="events", repeat=repeat))
+
+    def max_targets():
+        pc.surface_cache.clear()
+        for eid in passes:
+            ept.find_max_value_added_target(eid, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction, verbose=False)
+    results.append(measure("find_max_value_added_target", max_targets, n_items=len(passes), unit="events", repeat=repeat))
+
+    # video rendering
+    if shutil.which("ffmpeg") is None:
+        results.append({"name": "generate_video", "unit": "frames", "n_items": n_video_frames, "error": "skipped: ffmpeg not found"})
+        print("%-45s %s" % ("generate_video", results[-1]["error"]))
+    else:
+        import matplotlib
+        matplotlib.use("Agg")
+        import visualization as vis
+        ball = tracking_home[["Ball_x", "Ball_y"]].rename(columns={"Ball_x": "X", "Ball_y": "Y"})
+        video_folder = tempfile.mkdtemp()
+        try:
+            for blit, name in ((True, "generate_video"), (False, "generate_video (reference)")):
+                results.append(measure(name, lambda: vis.generate_video(
+                    tracking_home.iloc[:n_video_frames], tracking_away.iloc[:n_video_frames], ball.iloc[:n_video_frames],
+                    path=video_folder, file_name="benchmark", blit=blit), n_items=n_video_frames, unit="frames", repeat=1, trace_memory=False))
+        finally:
+            shutil.rmtree(video_folder, ignore_errors=True)
+    return results
+
+
+def compare_surfaces(event_id, events, tracking_home, tracking_away, params, GK_numbers, tolerance=1e-10):
+    '''
+    Check that the vectorized pitch control surface of an event equals the cell by cell reference implementation
+    (both computed without the surface cache). The result records the largest absolute difference, and an error if
+    it is above 'tolerance'
+    '''
+    name = "generate_pitch_control_for_event (vs reference)"
+    result = {"name": name, "unit": "max abs difference", "n_items": 1}
+    PPCF, _, _ = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, verbose=False, use_cache=False)
+    PPCFref, _, _ = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, vectorized=False, verbose=False, use_cache=False)
+    result["max_abs_difference"] = float(np.max(np.abs(PPCF - PPCFref)))
+    if not result["max_abs_difference"] <= tolerance:
+        result["error"] = "vectorized surface differs from the reference by %g" % result["max_abs_difference"]
+    print("%-45s %s" % (name, result.get("error", "max abs difference %g" % result["max_abs_difference"])))
+    return result
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    '''
+    Compare the wall times of 'results' with those of 'baseline' (both lists of benchmark results). A benchmark regresses
+    if it is more than 'threshold' (fraction) slower than the baseline. Returns a DataFrame with one row per benchmark
+    '''
+    baseline = {r["name"]: r for r in baseline if "wall_time_s" in r}
+    rows = []
+    for r in results:
+        if "wall_time_s" not in r or r["name"] not in baseline:
+            continue
+        ratio = r["wall_time_s"] / baseline[r["name"]]["wall_time_s"]
+        rows.append({"name": r["name"], "baseline_s": baseline[r["name"]]["wall_time_s"], "current_s": r["wall_time_s"],
+                     "ratio": ratio, "regression": ratio > 1 + threshold})
+    return pd.DataFrame(rows, columns=["name", "baseline_s", "current_s", "ratio", "regression"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slow down against the baseline (fraction)")
+    parser.add_argument("--data", default=None, help="folder for the synthetic FC_TWENTE_FOLDER (default: a temporary folder)")
+    parser.add_argument("--frames", type=int, default=7500, help="number of frames of the synthetic match")
+    parser.add_argument("--events", type=int, default=150, help="number of events of the synthetic match")
+    parser.add_argument("--passes", type=int, default=20, help="number of passes to evaluate in the pitch control / xT benchmarks")
+    parser.add_argument("--repeat", type=int, default=1, help="number of repeats (the best time is reported)")
+    args = parser.parse_args(argv)
+
+    data_folder = args.data or tempfile.mkdtemp()
+    fc_twente_folder = os.path.join(data_folder, "FC_TWENTE_FOLDER")
+    try:
+        make_synthetic_match(fc_twente_folder, n_frames=args.frames, n_events=args.events)
+        results = run_benchmarks(fc_twente_folder, n_events=args.passes, repeat=args.repeat)
+    finally:
+        if args.data is None:
+            shutil.rmtree(data_folder, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version.split()[0], "platform": platform.platform(), "frames": args.frames,
+                   "events": args.events, "results": results}, f, indent=2)
+    print("Results written to %s" % args.output)
+
+    status = 0
+    mismatches = [r["name"] for r in results if "max_abs_difference" in r and "error" in r]
+    if mismatches:
+        print("Output differs from the reference in: %s" % ", ".join(mismatches))
+        status = 1
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        comparison = compare_to_baseline(results, baseline, args.threshold)
+        print(comparison.to_string(index=False))
+        if comparison["regression"].any():
+            print("Performance regression in: %s" % ", ".join(comparison.loc[comparison["regression"], "name"]))
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import itertools
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import data_in_out as IO
+import ept
+import pitchcontrol as pc
+import season
+
+# parameters of default_model_params that can be calibrated. The derived parameters (lambda_def, lambda_gk and the
+# time-to-control short-cuts) are recomputed from them by model_params
+CALIBRATED_PARAMS = ('max_player_speed', 'reaction_time', 'tti_sigma', 'lambda_att', 'kappa_def', 'lambda_gk_factor', 'average_ball_speed')
+
+# positions and velocities of the players at the moment of every pass (offside attackers removed), padded to the same
+# number of players with NaN positions, with the pass start/end location and whether the passing team kept the ball.
+# None of it depends on the model parameters, so it is computed once and shared by every parameter set.
+PassStates = namedtuple('PassStates', ['event_ids', 'ball_start', 'target', 'received',
+                                       'attacking_positions', 'attacking_velocities',
+                                       'defending_positions', 'defending_velocities', 'defending_is_gk'])
+
+
+def model_params(values=None, base_params=None, time_to_control_veto=3):
+    '''
+    Model parameters (see pc.default_model_params) with the entries in 'values' changed and the derived parameters
+    recomputed. Besides the keys of the params dictionary, 'lambda_gk_factor' sets lambda_gk relative to lambda_def
+    (3 by default)
+    '''
+    params = dict(pc.default_model_params(time_to_control_veto) if base_params is None else base_params)
+    values = dict(values or {})
+    gk_factor = values.pop('lambda_gk_factor', params['lambda_gk']/params['lambda_def'])
+    params.update(values)
+    if 'lambda_def' not in values:
+        params['lambda_def'] = params['lambda_att'] * params['kappa_def']
+    if 'lambda_gk' not in values:
+        params['lambda_gk'] = params['lambda_def'] * gk_factor
+    params['time_to_control_att'] = time_to_control_veto*np.log(10) * (np.sqrt(3)*params['tti_sigma']/np.pi + 1/params['lambda_att'])
+    params['time_to_control_def'] = time_to_control_veto*np.log(10) * (np.sqrt(3)*params['tti_sigma']/np.pi + 1/params['lambda_def'])
+    return params
+
+
+def pass_states(events, tracking_home, tracking_away, GK_numbers, event_types=('Pass',)):
+    '''
+    PassStates of the passes of a game that have an outcome and a tracking frame. Passes whose players cannot be set
+    up (e.g. the defending goalkeeper is missing) are left out
+    '''
+    events = events.loc[events['type_name'].isin(event_types) & events['outcome'].notna()]
+    home_attack_direction = IO.find_playing_direction(tracking_home, 'Team_A')
+    params = pc.default_model_params()
+    rows = []
+    for event_id, event in events.iterrows():
+        if event['start_frameID'] not in tracking_home.index:
+            continue
+        pass_start_pos = np.array([event['start_x'], event['start_y']])
+        try:
+            _, attacking, defending = ept.initialise_pass_players(event.Team, event['start_frameID'], pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        except Exception:
+            continue
+        rows.append( (event_id, pass_start_pos, np.array([event['end_x'], event['end_y']]), bool(event['outcome']), attacking, defending) )
+    n_attacking = max( [len(r[4]) for r in rows], default=0 )
+    n_defending = max( [len(r[5]) for r in rows], default=0 )
+    states = PassStates(
+        event_ids = np.array([r[0] for r in rows]),
+        ball_start = np.array([r[1] for r in rows]).reshape(-1,2),
+        target = np.array([r[2] for r in rows]).reshape(-1,2),
+        received = np.array([r[3] for r in rows], dtype=bool),
+        attacking_positions = np.full( (len(rows), n_attacking, 2), np.nan ),
+        attacking_velocities = np.zeros( (len(rows), n_attacking, 2) ),
+        defending_positions = np.full( (len(rows), n_defending, 2), np.nan ),
+        defending_velocities = np.zeros( (len(rows), n_defending, 2) ),
+        defending_is_gk = np.zeros( (len(rows), n_defending), dtype=bool ),
+    )
+    for q, (_, _, _, _, attacking, defending) in enumerate(rows):
+        states.attacking_positions[q,:len(attacking)] = attacking.positions[attacking.inframe]
+        states.attacking_velocities[q,:len(attacking)] = attacking.velocities[attacking.inframe]
+        states.defending_positions[q,:len(defending)] = defending.positions[defending.inframe]
+        states.defending_velocities[q,:len(defending)] = defending.velocities[defending.inframe]
+        states.defending_is_gk[q,:len(defending)] = defending.is_gk[defending.inframe]
+    return states
+
+
+def concat_pass_states(states):
+    # PassStates of several games in one (event_ids become (game_id, event_id) tuples when 'states' is a dictionary)
+    if isinstance(states, dict):
+        states = [s._replace(event_ids=np.array([(g, e) for e in s.event_ids], dtype=object).reshape(-1,2)) for g, s in states.items()]
+    n_attacking = max( [s.attacking_positions.shape[1] for s in states], default=0 )
+    n_defending = max( [s.defending_positions.shape[1] for s in states], default=0 )
+    def pad(array, n, value):
+        width = [(0,0), (0, n-array.shape[1])] + [(0,0)]*(array.ndim-2)
+        return np.pad(array, width, constant_values=value)
+    return PassStates(
+        event_ids = np.concatenate([s.event_ids for s in states]),
+        ball_start = np.concatenate([s.ball_start for s in states]),
+        target = np.concatenate([s.target for s in states]),
+        received = np.concatenate([s.received for s in states]),
+        attacking_positions = np.concatenate([pad(s.attacking_positions, n_attacking, np.nan) for s in states]),
+        attacking_velocities = np.concatenate([pad(s.attacking_velocities, n_attacking, 0.) for s in states]),
+        defending_positions = np.concatenate([pad(s.defending_positions, n_defending, np.nan) for s in states]),
+        defending_velocities = np.concatenate([pad(s.defending_velocities, n_defending, 0.) for s in states]),
+        defending_is_gk = np.concatenate([pad(s.defending_is_gk, n_defending, False) for s in states]),
+    )
+
+
+def pass_probabilities(states, params, backend='auto'):
+    # probability that the passing team controls the ball at the end location of every pass (one batched query per pass)
+    n_passes, n_attacking = states.attacking_positions.shape[:2]
+    n_defending = states.defending_positions.shape[1]
+    attacking = pc.PlayerArrays(
+        positions = states.attacking_positions,
+        velocities = states.attacking_velocities,
+        vmax = np.full( (n_passes, n_attacking), float(params['max_player_speed']) ),
+        reaction_time = np.full( (n_passes, n_attacking), float(params['reaction_time']) ),
+        tti_sigma = np.full( (n_passes, n_attacking), float(params['tti_sigma']) ),
+        lambda_ = np.full( (n_passes, n_attacking), float(params['lambda_att']) ),
+    )
+    defending = pc.PlayerArrays(
+        positions = states.defending_positions,
+        velocities = states.defending_velocities,
+        vmax = np.full( (n_passes, n_defending), float(params['max_player_speed']) ),
+        reaction_time = np.full( (n_passes, n_defending), float(params['reaction_time']) ),
+        tti_sigma = np.full( (n_passes, n_defending), float(params['tti_sigma']) ),
+        lambda_ = np.where( states.defending_is_gk, params['lambda_gk'], params['lambda_def'] ).astype(float),
+    )
+    PPCFatt, _ = pc.calculate_pitch_control_for_queries(states.target, states.ball_start, attacking, defending, params, backend=backend)
+    return PPCFatt
+
+
+def log_likelihood(states, params, backend='auto', eps=0.01):
+    '''
+    Log-likelihood of the observed pass outcomes (passing team keeps the ball or not) under the pitch control model
+    with 'params': the sum over passes of log(PPCFatt) for completed passes and log(1-PPCFatt) for lost passes, with
+    the probabilities clipped to [eps, 1-eps] (the short-cut gives probabilities of exactly 0 and 1)
+    '''
+    p = np.clip( pass_probabilities(states, params, backend=backend), eps, 1-eps )
+    return float( np.sum( np.where(states.received, np.log(p), np.log(1-p)) ) )
+
+
+# PassStates of the worker processes, sent once when the pool starts instead of with every parameter set
+_worker_states = None
+
+def _init_worker(states):
+    global _worker_states
+    _worker_states = states
+
+def _score(params, backend='auto'):
+    return log_likelihood(_worker_states, params, backend=backend)
+
+
+def grid_search(states, grid, base_params=None, n_workers=None, backend='auto'):
+    '''
+    Score every combination of the parameter values in 'grid' (dictionary of parameter name -> list of values, see
+    CALIBRATED_PARAMS and model_params) by the log-likelihood of the pass outcomes in 'states' (PassStates, see
+    pass_states). Parameter sets are scored in a process pool of n_workers processes (default is the number of cpus);
+    the player states are sent to every worker once. Returns a DataFrame with one row per parameter set (the grid
+    values, log_likelihood and mean log_likelihood per pass), best first.
+    '''
+    names = list(grid)
+    combinations = list(itertools.product(*[grid[name] for name in names]))
+    param_sets = [model_params(dict(zip(names, values)), base_params) for values in combinations]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers<=1 or len(param_sets)<=1:
+        scores = [log_likelihood(states, params, backend=backend) for params in param_sets]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(states,)) as executor:
+            chunksize = max( 1, len(param_sets)//(4*n_workers) )
+            scores = list(executor.map(_score, param_sets, [backend]*len(param_sets), chunksize=chunksize))
+    results = pd.DataFrame(combinations, columns=names)
+    results['log_likelihood'] = scores
+    results['mean_log_likelihood'] = results['log_likelihood']/max(len(states.received), 1)
+    return results.sort_values('log_likelihood', ascending=False, ignore_index=True)
+
+
+def save_params(params, fname='calibrated_params.json'):
+    # write a params dictionary as json (numpy values converted to floats)
+    with open(fname, 'w') as f:
+        json.dump({key: float(value) for key, value in params.items()}, f, indent=2, sort_keys=True)
+
+def load_params(fname='calibrated_params.json'):
+    with open(fname) as f:
+        return json.load(f)
+
+
+def calibrate(grid, game_ids=None, fc_twente_folder=IO.FC_TWENTE_FOLDER, out_file='calibrated_params.json', base_params=None, n_workers=None, backend='auto'):
+    '''
+    Grid search of the pitch control model parameters on the passes of several games (all games in fc_twente_folder
+    by default). The games are loaded one after another (season.Season) and only their pass states are kept.
+    Writes the best params dictionary to 'out_file' (unless it is None) and returns (best params, grid search results)
+
+    e.g. calibrate({'max_player_speed': [4., 5., 6.], 'reaction_time': [0.5, 0.7, 0.9], 'tti_sigma': [0.3, 0.45, 0.6]})
+    '''
+    with season.Season(fc_twente_folder, game_ids, max_games=1, n_workers=n_workers) as games:
+        states = concat_pass_states({game.game_id: pass_states(game.events, game.tracking_home, game.tracking_away, game.GK_numbers) for game in games.load_games()})
+    results = grid_search(states, grid, base_params=base_params, n_workers=n_workers, backend=backend)
+    best = model_params(results.iloc[0][list(grid)].to_dict(), base_params)
+    if out_file is not None:
+        save_params(best, out_file)
+    return best, results
@@ -1,5 +1,10 @@
 import csv
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
 import numpy as np
 import pandas as pd
 
@@ -10,78 +15,133 @@ load_dotenv()
 
 
 FC_TWENTE_FOLDER = os.path.join(os.getcwd(), "FC_TWENTE_FOLDER")
+CACHE_FOLDER_NAME = ".cache"
 
 
-def processing_events_data(events, game_id):
-
-    fc_twente_folder = FC_TWENTE_FOLDER
-
-    start_frames = []
-
-    for index, row in events.iterrows():
-        # print(index)
-        minutes = row['minute']
-        seconds = row['second']
-        start_x = row['start_x']
-        start_y = row['start_y']
-        # end_x = row['end_x']
-        # end_y = row['end_y']
-        player_name = row['FullName']
-        team_name = row['Team']
-        csv_path = os.path.join(
-            fc_twente_folder, f"Game {game_id}", "Players", f"{player_name}.csv",)
-        player_data = pd.read_csv(csv_path)
-
-        csv_path = os.path.join(
-            fc_twente_folder, f"Game {game_id}", "Players", "Ball.csv",)
-        ball_data = pd.read_csv(csv_path)
-
-        start_frame = None
-        filter_player_frames = player_data.loc[(
-            player_data['Minutes'] == minutes) & (player_data['Seconds'] == seconds)]
-
-        filter_ball_frames = ball_data.loc[(ball_data['Minutes'] == minutes) & (
-            ball_data['Seconds'] == seconds)]
-        start_frame = filter_ball_frames.iloc[0]['frameID']
-        dframe = pd.DataFrame()
-        dframe['player_x'] = pd.to_numeric(filter_player_frames["X"])
-        dframe['player_y'] = pd.to_numeric(filter_player_frames["Y"])
-        dframe['ball_x'] = pd.to_numeric(filter_ball_frames["X"])
-        dframe['ball_y'] = pd.to_numeric(filter_ball_frames["Y"])
-        dframe['team'] = filter_ball_frames["Team with the ball"]
-        dframe['frameID'] = pd.to_numeric(
-            filter_ball_frames["frameID"], downcast="integer")
-        minDiff = 1000
-        final_frame = start_frame
-        for index, row in dframe.iterrows():
-            if ((abs(row['ball_x'] - row['player_x']) + abs(row['ball_y'] - row['player_y'])+abs(row['ball_x'] - start_x) + abs(row['ball_y'] - start_y) + abs(row['player_x'] - start_x) + abs(row['player_y'] - start_y)) < minDiff) and (row['team'] == team_name):
-                minDiff = abs(row['ball_x'] - row['player_x']) + abs(row['ball_y'] - row['player_y'])+abs(row['ball_x'] -
-                                                                                                          start_x) + abs(row['ball_y'] - start_y) + abs(row['player_x'] - start_x) + abs(row['player_y'] - start_y)
-                final_frame = row["frameID"]
-        start_frames.append(final_frame)
-    start_frames = pd.DataFrame(start_frames, columns=['start_frameID'])
+def processing_events_data(events, game_id, fc_twente_folder=FC_TWENTE_FOLDER, use_cache=True):
+    '''
+    Find the tracking frame at which each event starts (the 'start_frameID' column).
+
+    Ball.csv and every player file referenced by the events are read once per game. The ball frames are indexed by
+    (minute, second) so that the candidate frames of each event are a slice, and all events are scored in one batch:
+    the chosen frame is the one (in the possession of the event's team) where ball, player and event start location
+    are closest together. If no frame qualifies, the first frame of that second is used.
+    '''
+    players_folder = os.path.join(fc_twente_folder, f"Game {game_id}", "Players")
+
+    ball_data = read_csv_cached(os.path.join(players_folder, "Ball.csv"), use_cache=use_cache, usecols=[
+                                'frameID', 'Minutes', 'Seconds', 'X', 'Y', 'Team with the ball'])
+    ball_frames = pd.to_numeric(ball_data['frameID'], downcast="integer").to_numpy()
+    ball_x = pd.to_numeric(ball_data['X']).to_numpy(dtype=float)
+    ball_y = pd.to_numeric(ball_data['Y']).to_numpy(dtype=float)
+    ball_team = ball_data['Team with the ball'].to_numpy()
+
+    # (minute, second) -> range of ball rows, keeping the original file order within each second
+    second_index, order = build_second_index(ball_data['Minutes'], ball_data['Seconds'])
+
+    # positions of every player involved in an event, aligned with the rows of Ball.csv
+    player_names = pd.unique(events['FullName'])
+    player_x = np.full((len(player_names), len(ball_frames)), np.nan)
+    player_y = np.full((len(player_names), len(ball_frames)), np.nan)
+    for k, player_name in enumerate(player_names):
+        player_data = read_csv_cached(os.path.join(
+            players_folder, f"{player_name}.csv"), use_cache=use_cache, usecols=['frameID', 'X', 'Y'])
+        player_data = player_data.drop_duplicates('frameID').set_index('frameID')
+        player_data = player_data.reindex(ball_frames)
+        player_x[k] = pd.to_numeric(player_data['X']).to_numpy(dtype=float)
+        player_y[k] = pd.to_numeric(player_data['Y']).to_numpy(dtype=float)
+
+    # candidate ball rows for every event (events x frames in that second)
+    keys = events['minute'].to_numpy(dtype=int) * 60 + events['second'].to_numpy(dtype=int)
+    lo = np.searchsorted(second_index, keys, side='left')
+    hi = np.searchsorted(second_index, keys, side='right')
+    if np.any(hi == lo):
+        missing = events.index[hi == lo].tolist()
+        raise ValueError(f"No tracking frames found for the minute/second of events {missing}")
+    n_candidates = hi - lo
+    offsets = np.arange(n_candidates.max())
+    valid = offsets[None, :] < n_candidates[:, None]
+    rows = order[np.minimum(lo[:, None] + offsets[None, :], len(order) - 1)]
+
+    player_idx = pd.Index(player_names).get_indexer(events['FullName'])[:, None]
+    px = player_x[player_idx, rows]
+    py = player_y[player_idx, rows]
+    bx = ball_x[rows]
+    by = ball_y[rows]
+    start_x = events['start_x'].to_numpy(dtype=float)[:, None]
+    start_y = events['start_y'].to_numpy(dtype=float)[:, None]
+    diff = (np.abs(bx - px) + np.abs(by - py) + np.abs(bx - start_x) +
+            np.abs(by - start_y) + np.abs(px - start_x) + np.abs(py - start_y))
+    same_team = ball_team[rows] == events['Team'].to_numpy()[:, None]
+    diff = np.where(valid & same_team & (diff < 1000), diff, np.inf)
+    diff[np.isnan(diff)] = np.inf
+
+    best = np.argmin(diff, axis=1)
+    found = np.isfinite(diff[np.arange(len(events)), best])
+    # fall back on the first frame of the second if no frame qualifies
+    best_rows = np.where(found, rows[np.arange(len(events)), best], rows[:, 0])
+
     events['start_frameID'] = pd.to_numeric(
-        start_frames["start_frameID"], downcast="integer")
+        ball_frames[best_rows], downcast="integer")
     return events
 
 
+def build_second_index(minutes, seconds):
+    '''
+    Index tracking rows by (minute, second). Returns the sorted second keys (minute*60 + second) and the row order
+    that goes with them, so that np.searchsorted on the keys gives the range of rows in any second.
+    '''
+    keys = np.asarray(minutes, dtype=int) * 60 + np.asarray(seconds, dtype=int)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], order
+
+
 def find_playing_direction(team, teamname):
     '''
     Find the direction of play for the team (based on where the goalkeepers are at kickoff). +1 is left->right and -1 is right->left
     '''
     GK_column_x = teamname+"_"+find_goalkeeper(team)+"_x"
-    # +ve is left->right, -ve is right->left
-    return -np.sign(team.iloc[0][GK_column_x])
+    # +ve is left->right, -ve is right->left (first frame the goalkeeper is on the pitch)
+    x = team[GK_column_x].to_numpy(dtype=float)
+    return -np.sign(x[np.isfinite(x)][0])
 
 
 def find_goalkeeper(team):
     '''
-    Find the goalkeeper in team, identifying him/her as the player closest to goal at kick off
+    Find the goalkeeper in team, identifying him/her as the player in goal at kick off: the player closest to goal in
+    most frames of the first period (see goalkeeper_indices), so that missing positions in the first frames do not
+    matter. This is one player id for the whole match (GK_numbers); a keeper who comes on later is only found per
+    frame, by goalkeeper_indices or MatchTracking.goalkeepers
     '''
-    x_columns = [c for c in team.columns if c[-2:].lower() ==
-                 '_x' and c[:6] in ['Team_A', 'Team_B']]
-    GK_col = team.iloc[0][x_columns].abs().idxmax()
-    return str(GK_col.split('_')[2] + "_" + GK_col.split('_')[3])
+    schema = tracking_schema(team)
+    if 'Period' in team.columns and len(team):
+        team = team.loc[ (team['Period'] == team['Period'].iloc[0]).to_numpy() ]
+    goalkeepers = goalkeeper_indices( team.iloc[:, schema.positions('x')].to_numpy(dtype=float) )
+    return str(schema.ids[np.bincount(goalkeepers[goalkeepers >= 0]).argmax()])
+
+
+def deepest_players(x):
+    # index of the player closest to a goal line (largest |x|, metric coordinates) in every row of the (frames, players)
+    # x coordinates, -1 in frames without players on the pitch
+    x = np.abs(np.asarray(x, dtype=float))
+    onpitch = np.isfinite(x)
+    return np.where(onpitch.any(axis=1), np.argmax(np.where(onpitch, x, -1.), axis=1), -1)
+
+
+def goalkeeper_indices(x, deepest_counts=None):
+    '''
+    Goalkeeper of a team in every frame, from the (frames, players) x coordinates (metric) of its players: the player
+    closest to a goal line in most frames or, in frames where that player is not on the pitch (missing positions or a
+    substitution), the next player of that ranking who is. -1 in frames without players. deepest_counts (the number of
+    frames each player was the deepest) defaults to the counts over the frames of x
+    '''
+    x = np.asarray(x, dtype=float)
+    if deepest_counts is None:
+        deepest = deepest_players(x)
+        deepest_counts = np.bincount(deepest[deepest >= 0], minlength=x.shape[1])
+    order = np.argsort(-np.asarray(deepest_counts), kind="stable")
+    onpitch = np.isfinite(x[:, order])
+    return np.where(onpitch.any(axis=1), order[np.argmax(onpitch, axis=1)], -1)
 
 
 def load_fc_twente_data(
@@ -90,7 +150,17 @@ def load_fc_twente_data(
     team_id=None,
     player_id=None,
     mode="load-event",
+    use_cache=True,
+    players=None,
+    period=None,
+    frame_range=None,
+    columns=None,
 ):
+    '''
+    Load the data of a game. For mode="load-team-data" the tracking data can be restricted to some players, periods,
+    a range of frames and some columns (see load_team_data)
+    '''
+
     if game_id is not None:
 
         print(f"Loading Game {game_id} data...")
@@ -99,14 +169,14 @@ def load_fc_twente_data(
             print("Loading process event data")
             csv_path = os.path.join(
                 os.getcwd(), "processed_events.csv")
-            data = pd.read_csv(csv_path)
+            data = read_csv_cached(csv_path, use_cache=use_cache)
             return data
         
         if mode == "load-event":
             print(f"Loading event data of Game {game_id}...")
             csv_path = os.path.join(
                 fc_twente_folder, f"Game {game_id}", "events.csv")
-            data = pd.read_csv(csv_path)
+            data = read_csv_cached(csv_path, use_cache=use_cache)
             # processed_data = processing_events_data(data, game_id)
             # return processed_data
             return data
@@ -115,70 +185,18 @@ def load_fc_twente_data(
             print(f"Loading metadata of Game {game_id}...")
             csv_path = os.path.join(
                 fc_twente_folder, f"Game {game_id}", "Metadata.csv")
-            return pd.read_csv(csv_path)
+            return read_csv_cached(csv_path, use_cache=use_cache)
         elif mode == "load-ball-data":
             print(f"Loading ball data of Game {game_id}...")
             csv_path = os.path.join(
                 fc_twente_folder, f"Game {game_id}", "Players", "Ball.csv"
             )
-            return pd.read_csv(csv_path)
+            return read_csv_cached(csv_path, use_cache=use_cache)
 
         elif mode == "load-team-data":
             print(f"Loading team {team_id} data of Game {game_id}...")
-            # print(fc_twente_folder)
-            dir = os.path.join(fc_twente_folder, f"Game {game_id}", "Players")
-            # print(dir)
-            
-            list_frames = []
-            for root, dirs, files in os.walk(dir):
-                for file in files:
-                    if file.endswith(".csv"):
-                        if "Ball" not in str(file) and str(team_id) in str(file) and "checkpoint" not in str(file):
-                            dframe = pd.DataFrame()
-                            params = str(file).split("_")
-                            player_id_has_csv = params[3]
-                            player_id = player_id_has_csv.split(".")[0]
-                            # print(player_id)
-                            csv_path = os.path.join(
-                                fc_twente_folder,
-                                f"Game {game_id}",
-                                "Players",
-                                f"Team_{team_id}_Player_{player_id}.csv",
-                            )
-                            data = pd.read_csv(csv_path)
-                            # playername =
-                            param_x = f"Team_{team_id}_Player_{player_id}_x"
-                            param_y = f"Team_{team_id}_Player_{player_id}_y"
-                            param_speed = f"Team_{team_id}_Player_{player_id}_speedMs"
-                            dframe[param_x] = pd.to_numeric(data["X"])
-                            dframe[param_y] = pd.to_numeric(data["Y"])
-                            dframe[param_speed] = pd.to_numeric(
-                                data["Snelheid"])
-                            dframe['frameID'] = pd.to_numeric(
-                                data["frameID"], downcast="integer")
-                            dframe.set_index('frameID', inplace = True)
-                            list_frames.append(dframe)
-                            
-                        elif "Ball" in str(file):
-                            csv_path = os.path.join(
-                                fc_twente_folder,
-                                f"Game {game_id}",
-                                "Players",
-                                "Ball.csv",
-                            )
-                            data = pd.read_csv(csv_path)
-                            dframe = pd.DataFrame()
-                            dframe["Period"] = pd.to_numeric(data["Period"])
-                            dframe["Time [s]"] = pd.to_numeric(
-                                data["Time [s]"])
-                            dframe["Ball_x"] = pd.to_numeric(data["X"])
-                            dframe["Ball_y"] = pd.to_numeric(data["Y"])
-                            dframe['frameID'] = pd.to_numeric(
-                                data["frameID"], downcast="integer")
-                            dframe.set_index('frameID', inplace = True)
-                            list_frames.append(dframe)
-            result = pd.concat(list_frames, axis=1)
-            return result
+            return load_team_data(fc_twente_folder, game_id, team_id, players=players, period=period,
+                                  frame_range=frame_range, columns=columns, use_cache=use_cache)
 
         # TODO: Loading team data - read multiple csv files
         # elif mode == "load-team-data":
@@ -197,20 +215,449 @@ def load_fc_twente_data(
                     "Players",
                     f"Team_{team_id}_Player_{player_id}.csv",
                 )
-                return pd.read_csv(csv_path)
+                return read_csv_cached(csv_path, use_cache=use_cache)
             else:
                 print("Please provide team_id and player_id")
     else:
         print("Unable to load data if the game_id is not given")
         return None
 
-    return pd.read_csv(csv_path)
+    return read_csv_cached(csv_path, use_cache=use_cache)
+
+
+# tracking DataFrame columns -> csv column, for the player files and for Ball.csv
+PLAYER_COLUMNS = {"x": "X", "y": "Y", "speedMs": "Snelheid"}
+BALL_COLUMNS = {"Period": "Period", "Time [s]": "Time [s]", "Ball_x": "X", "Ball_y": "Y"}
+
+
+def load_team_data(fc_twente_folder=FC_TWENTE_FOLDER, game_id=1, team_id="A", players=None, period=None,
+                   frame_range=None, columns=None, use_cache=True):
+    '''
+    Tracking DataFrame of a team (indexed by frameID): x, y and speedMs of every player ('Team_<team_id>_Player_<n>_x',
+    ...) and Period, Time [s], Ball_x and Ball_y from Ball.csv.
+
+    players: player numbers (or ids such as 'Player_3') to load, all players of the team if None
+    period: a period or a list of periods to load, all periods if None
+    frame_range: (first frameID, last frameID) to load (inclusive), all frames if None
+    columns: the columns to load out of 'x', 'y', 'speedMs', 'Period', 'Time [s]', 'Ball_x' and 'Ball_y', all if None
+
+    Only the requested rows and columns are read (see read_csv_frames).
+    '''
+    players_folder = os.path.join(fc_twente_folder, f"Game {game_id}", "Players")
+    columns = list(PLAYER_COLUMNS) + list(BALL_COLUMNS) if columns is None else list(columns)
+    unknown = [c for c in columns if c not in PLAYER_COLUMNS and c not in BALL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown team data columns {unknown} (use {list(PLAYER_COLUMNS) + list(BALL_COLUMNS)})")
+    wanted_players = None if players is None else set(str(p).split("_")[-1] for p in players)
+
+    # frames to load: the rows of Ball.csv in the requested periods and frame range
+    ball_fields = [c for c in BALL_COLUMNS if c in columns]
+    ball = read_csv_frames(os.path.join(players_folder, "Ball.csv"), frame_range=frame_range, period=period,
+                           usecols=list(dict.fromkeys(["frameID"] + [BALL_COLUMNS[c] for c in ball_fields])), use_cache=use_cache)
+    frames = pd.to_numeric(ball["frameID"], downcast="integer")
+    player_range = frame_range if period is None else (frames.min(), frames.max())
+
+    list_frames = []
+    player_fields = [c for c in PLAYER_COLUMNS if c in columns]
+    for file in os.listdir(players_folder):
+        name, extension = os.path.splitext(file)
+        parts = name.split("_")
+        if extension == ".csv" and name == "Ball":
+            dframe = pd.DataFrame({c: pd.to_numeric(ball[BALL_COLUMNS[c]]) for c in ball_fields})
+            dframe["frameID"] = frames
+        elif (extension == ".csv" and len(parts) == 4 and parts[0] == "Team" and parts[1] == str(team_id)
+                and parts[2] == "Player" and (wanted_players is None or parts[3] in wanted_players)):
+            if not player_fields:
+                continue
+            usecols = ["frameID"] + [PLAYER_COLUMNS[c] for c in player_fields]
+            if len(frames) == 0:
+                # no frame in the requested periods and frame range: nothing to read
+                data = pd.DataFrame({c: pd.Series(dtype=frames.dtype if c == "frameID" else float) for c in usecols})
+            else:
+                data = read_csv_frames(os.path.join(players_folder, file), frame_range=player_range, usecols=usecols, use_cache=use_cache)
+            if period is not None:
+                data = data.loc[data["frameID"].isin(frames)]
+            dframe = pd.DataFrame({f"{name}_{c}": pd.to_numeric(data[PLAYER_COLUMNS[c]]) for c in player_fields})
+            dframe["frameID"] = pd.to_numeric(data["frameID"], downcast="integer")
+        else:
+            continue
+        dframe.set_index("frameID", inplace=True)
+        list_frames.append(dframe)
+    return pd.concat(list_frames, axis=1)
 
 
 def to_metric_coordinates(data, field_dimen=(105.0, 68.0)):
-    x_columns = [c for c in data.columns if c[-1].lower() == "x"]
-    y_columns = [c for c in data.columns if c[-1].lower() == "y"]
+    schema = tracking_schema(data)
+    x_columns = data.columns[schema.coordinate_x]
+    y_columns = data.columns[schema.coordinate_y]
     data[x_columns] = (data[x_columns]) - 0.5 * field_dimen[0]
     data[y_columns] = (data[y_columns]) - 0.5 * field_dimen[1]
 
     return data
+
+
+# name of the DataFrame attribute (DataFrame.attrs) that holds the TrackingSchema of the data
+SCHEMA_ATTR = "tracking_schema"
+
+
+class TrackingSchema(object):
+    '''
+    Column layout of a tracking DataFrame (or of its rows), parsed once.
+
+    Players are the columns '<team>_<player id>_<field>' with team 'Team_A' or 'Team_B'. player_names holds the
+    column prefix of every player (e.g. 'Team_A_Player_1', sorted like np.unique), teams their team, ids their player
+    id ('Player_1', as used for GK_numbers) and labels the number shown on plots. positions(field) gives the integer
+    column position of a field ('x', 'y', 'vx', 'vy', 'ax', 'ay', 'speed', 'acceleration') for every player (KeyError
+    if a player does not have that column).
+
+    Use tracking_schema(data) to get the schema of a DataFrame: it is stored in data.attrs, which pandas passes on to
+    rows and copies of the DataFrame, and rebuilt only when the columns change.
+    '''
+    FIELDS = ("x", "y", "vx", "vy", "ax", "ay", "speed", "acceleration")
+    VELOCITY_FIELDS = ("vx", "vy", "ax", "ay", "speed", "acceleration")
+
+    def __init__(self, columns):
+        self.columns = pd.Index(columns)
+        names = [str(c) for c in self.columns]
+        position = {c: i for i, c in enumerate(names)}
+        self.player_names = np.unique([c[:-2] for c in names if c[:6] in ("Team_A", "Team_B") and c[-2:] == "_x"])
+        self.teams = np.array([p[:6] for p in self.player_names])
+        self.ids = np.array([p[7:] for p in self.player_names])
+        self.labels = np.array([p.split("_")[-1] for p in self.player_names])
+        self._positions = {field: np.array([position.get(p + "_" + field, -1) for p in self.player_names], dtype=int)
+                           for field in self.FIELDS}
+        # columns treated as x/y coordinates by to_metric_coordinates, and derived columns dropped by remove_player_velocities
+        self.coordinate_x = np.array([i for i, c in enumerate(names) if c[-1:].lower() == "x"], dtype=int)
+        self.coordinate_y = np.array([i for i, c in enumerate(names) if c[-1:].lower() == "y"], dtype=int)
+        self.velocity_columns = np.array([i for i, c in enumerate(names) if c.split("_")[-1] in self.VELOCITY_FIELDS], dtype=int)
+        self.ball_x = position.get("Ball_x", -1)
+        self.ball_y = position.get("Ball_y", -1)
+        self.period = position.get("Period", -1)
+        self.time = position.get("Time [s]", -1)
+
+    def __deepcopy__(self, memo):
+        # the schema is never modified, so the copies of DataFrame.attrs made by pandas can share it
+        return self
+
+    def players(self, teamname=None):
+        # indices (into player_names/ids/...) of the players of a team, or of all players
+        if teamname is None:
+            return np.arange(len(self.player_names))
+        return np.flatnonzero(self.teams == teamname)
+
+    def positions(self, field, teamname=None):
+        # integer column positions of 'field' for the players of a team (or all players)
+        positions = self._positions[field][self.players(teamname)]
+        if np.any(positions < 0):
+            raise KeyError([name for name, p in zip(self.names(field, teamname), positions) if p < 0])
+        return positions
+
+    def names(self, field, teamname=None):
+        # column names of 'field' for the players of a team (or all players)
+        return [p + "_" + field for p in self.player_names[self.players(teamname)]]
+
+
+def tracking_schema(data):
+    '''
+    TrackingSchema of a DataFrame, a row of it (Series) or any mapping with keys(), cached in data.attrs
+    '''
+    if isinstance(data, pd.DataFrame):
+        columns = data.columns
+    elif isinstance(data, pd.Series):
+        columns = data.index
+    else:
+        return TrackingSchema(list(data.keys()))
+    schema = data.attrs.get(SCHEMA_ATTR)
+    if schema is None or not (schema.columns is columns or schema.columns.equals(columns)):
+        schema = TrackingSchema(columns)
+        data.attrs[SCHEMA_ATTR] = schema
+    return schema
+
+
+def csv_cache_path(csv_path):
+    '''
+    Folder holding the binary cache of a csv file: '<folder>/.cache/<file name>/' next to the csv file
+    '''
+    folder, file_name = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(folder, CACHE_FOLDER_NAME, os.path.splitext(file_name)[0])
+
+
+def csv_source_key(csv_path):
+    # the cache of a csv file is valid as long as the file's modification time and size are unchanged
+    stat = os.stat(csv_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def read_csv_cached(csv_path, use_cache=True, usecols=None, mmap_mode=None):
+    '''
+    Read a csv file through its columnar binary cache.
+
+    The first read parses the csv and stores every column as a .npy file (plus a manifest.json with the column names
+    and the mtime/size of the source file). Later reads load the .npy files directly, and the cache is rebuilt
+    automatically when the csv file changes. With use_cache=False this is a plain pd.read_csv.
+    '''
+    if not use_cache:
+        return pd.read_csv(csv_path, usecols=usecols)
+    manifest, data = csv_cache_manifest(csv_path)
+    if manifest is None:
+        return data if usecols is None else data[list(usecols)]
+    try:
+        return load_csv_cache(csv_cache_path(csv_path), manifest, usecols=usecols, mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        # another process is replacing the cache right now
+        return pd.read_csv(csv_path, usecols=usecols)
+
+
+# one lock per cache folder, so that threads reading the same csv file (or opening the same MatchTracking store) build
+# its cache once
+_cache_locks = {}
+_cache_locks_lock = threading.Lock()
+
+def cache_lock(cache_path):
+    with _cache_locks_lock:
+        return _cache_locks.setdefault(cache_path, threading.Lock())
+
+
+def csv_cache_manifest(csv_path, check_sorted=False):
+    '''
+    Manifest of the binary cache of csv_path, building the cache first when it is missing or out of date. Builds of
+    the same file are serialized: a thread that finds the cache being built waits for it instead of parsing the csv
+    again. Returns (manifest, None), or (None, data) with the parsed csv when it can't be cached. With check_sorted,
+    caches written before the 'sorted' flag of the columns existed are rebuilt
+    '''
+    cache_path = csv_cache_path(csv_path)
+    def valid(manifest):
+        return (manifest is not None and manifest["source"] == csv_source_key(csv_path)
+                and not (check_sorted and any("sorted" not in c for c in manifest["columns"])))
+    manifest = read_cache_manifest(cache_path)
+    if valid(manifest):
+        return manifest, None
+    with cache_lock(cache_path):
+        manifest = read_cache_manifest(cache_path)
+        if valid(manifest):
+            return manifest, None
+        data = pd.read_csv(csv_path)
+        if not write_csv_cache(data, csv_path):
+            return None, data
+        manifest = read_cache_manifest(cache_path)
+        # None if another process is replacing the cache right now
+        return (manifest, None) if manifest is not None else (None, data)
+
+
+def csv_cache_valid(csv_path):
+    # True if the binary cache of csv_path exists and was built from the current version of the file
+    manifest = read_cache_manifest(csv_cache_path(csv_path))
+    return manifest is not None and manifest["source"] == csv_source_key(csv_path)
+
+
+def read_cache_manifest(cache_path):
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_csv_cache(data, csv_path):
+    '''
+    Store the columns of 'data' (read from csv_path) in the binary cache of csv_path. Returns False if a column can't
+    be stored as a plain numpy array (the data is then simply not cached).
+    '''
+    cache_path = csv_cache_path(csv_path)
+    source = csv_source_key(csv_path)
+    columns = []
+    arrays = {}
+    for i, column in enumerate(data.columns):
+        values = data[column]
+        entry = {"name": column, "file": f"{i}.npy", "null_file": None, "sorted": False}
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            # text columns are stored as fixed width unicode, with a separate mask for the missing values
+            null = values.isna().to_numpy()
+            if not values[~null].map(lambda v: isinstance(v, str)).all():
+                return False
+            arrays[entry["file"]] = values.fillna("").to_numpy(dtype=str)
+            if null.any():
+                entry["null_file"] = f"{i}_null.npy"
+                arrays[entry["null_file"]] = null
+        else:
+            arrays[entry["file"]] = values.to_numpy()
+            if arrays[entry["file"]].dtype == object:
+                return False
+            # sorted columns (e.g. frameID) let read_csv_frames find a range of rows with a binary search
+            entry["sorted"] = bool(values.dtype.kind in "iuf" and np.all(np.diff(arrays[entry["file"]]) >= 0))
+        columns.append(entry)
+
+    # write into a temporary folder first, so that readers never see a half written cache. The folder is unique per
+    # call, so that threads and processes building the same cache at the same time do not write into each other's files.
+    # It replaces the old cache by rename (see replace_folder); a reader that loses the cache in between falls back to
+    # the csv file
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(cache_path) + ".tmp-", dir=os.path.dirname(cache_path))
+    for file_name, array in arrays.items():
+        np.save(os.path.join(tmp_path, file_name), array, allow_pickle=False)
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump({"source": source, "n_rows": len(data), "columns": columns}, f)
+    replace_folder(tmp_path, cache_path)
+    return True
+
+
+def replace_folder(tmp_path, path):
+    '''
+    Put the complete folder tmp_path in the place of 'path'. An existing folder is first renamed aside and only removed
+    once the new one is in place, so readers never find it half deleted. Returns False (and removes tmp_path) if another
+    writer put its folder in place first.
+    '''
+    aside = None
+    if os.path.exists(path):
+        aside = tempfile.mkdtemp(prefix=os.path.basename(path) + ".old-", dir=os.path.dirname(path))
+        try:
+            os.replace(path, os.path.join(aside, "old"))
+        except FileNotFoundError:
+            # another writer has moved it aside already
+            pass
+    try:
+        os.replace(tmp_path, path)
+        replaced = True
+    except OSError:
+        # another writer has put its (complete) folder in place in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        replaced = False
+    if aside is not None:
+        shutil.rmtree(aside, ignore_errors=True)
+    return replaced
+
+
+def load_csv_cache(cache_path, manifest, usecols=None, mmap_mode=None, rows=None):
+    # 'rows' (a slice or an array of row numbers) reads only those rows, through np.memmap
+    if rows is not None and mmap_mode is None:
+        mmap_mode = "r"
+    columns = manifest["columns"]
+    if usecols is not None:
+        wanted = set(usecols)
+        columns = [c for c in columns if c["name"] in wanted]
+        missing = wanted - set(c["name"] for c in columns)
+        if missing:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {sorted(missing)}")
+    data = {}
+    for entry in columns:
+        values = np.load(os.path.join(cache_path, entry["file"]), mmap_mode=mmap_mode, allow_pickle=False)
+        if rows is not None:
+            values = np.array(values[rows])
+        if values.dtype.kind == "U":
+            values = values.astype(object)
+            if entry["null_file"] is not None:
+                null = np.load(os.path.join(cache_path, entry["null_file"]), mmap_mode=mmap_mode, allow_pickle=False)
+                values[null if rows is None else np.array(null[rows])] = np.nan
+        data[entry["name"]] = values
+    return pd.DataFrame(data, columns=[c["name"] for c in columns])
+
+
+def read_csv_frames(csv_path, frame_range=None, period=None, usecols=None, use_cache=True, chunksize=25000):
+    '''
+    Read the rows of a tracking csv file (with frameID and Period columns) with frameID in frame_range=(first, last)
+    (inclusive) and Period in 'period' (a period or a list of periods). None means no restriction.
+
+    Through the binary cache, frameID and Period are memory-mapped to find the rows (a binary search when the column
+    is sorted) and only those rows of the 'usecols' columns are read. Without the cache, the csv file is read in chunks
+    of 'chunksize' rows and reading stops after the first chunk that is past the requested frames and periods (frames
+    and periods are stored in increasing order).
+    '''
+    periods = None if period is None else np.atleast_1d(period)
+    if not use_cache:
+        return read_csv_chunks(csv_path, frame_range, periods, usecols, chunksize)
+    cache_path = csv_cache_path(csv_path)
+    manifest, _ = csv_cache_manifest(csv_path, check_sorted=True)
+    if manifest is None:
+        return read_csv_chunks(csv_path, frame_range, periods, usecols, chunksize)
+    entries = {c["name"]: c for c in manifest["columns"]}
+    rows = slice(0, manifest["n_rows"])
+    try:
+        if frame_range is not None:
+            rows = _select_rows(cache_path, entries["frameID"], rows, frame_range[0], frame_range[1])
+        if periods is not None:
+            rows = _select_rows(cache_path, entries["Period"], rows, periods.min(), periods.max(), members=periods)
+        return load_csv_cache(cache_path, manifest, usecols=usecols, rows=rows)
+    except FileNotFoundError:
+        # another process is replacing the cache right now
+        return read_csv_chunks(csv_path, frame_range, periods, usecols, chunksize)
+
+
+def _select_rows(cache_path, entry, rows, low, high, members=None):
+    # narrow 'rows' (a slice or row numbers) down to the rows where a cached column lies within [low, high] (and is
+    # one of 'members'), with a binary search when the column is sorted
+    values = np.load(os.path.join(cache_path, entry["file"]), mmap_mode="r")
+    if members is not None and np.array_equal(np.unique(members), np.arange(low, high + 1)):
+        members = None # consecutive values: the bounds are enough
+    if isinstance(rows, slice) and entry.get("sorted"):
+        column = values[rows]
+        rows = slice(rows.start + int(np.searchsorted(column, low, side="left")),
+                     rows.start + int(np.searchsorted(column, high, side="right")))
+        if members is None:
+            return rows
+    if isinstance(rows, slice):
+        rows = np.arange(rows.start, rows.stop)
+    selected = np.array(values[rows])
+    keep = (selected >= low) & (selected <= high)
+    if members is not None:
+        keep &= np.isin(selected, members)
+    return rows[keep]
+
+
+def read_csv_chunks(csv_path, frame_range=None, periods=None, usecols=None, chunksize=25000):
+    # read_csv_frames without the binary cache: stream the csv file and stop once past the requested rows
+    needed = None if usecols is None else list(dict.fromkeys(list(usecols) + ["frameID"] + ([] if periods is None else ["Period"])))
+    chunks = []
+    for chunk in pd.read_csv(csv_path, usecols=needed, chunksize=chunksize):
+        keep = np.ones(len(chunk), dtype=bool)
+        if frame_range is not None:
+            keep &= chunk["frameID"].between(frame_range[0], frame_range[1]).to_numpy()
+        if periods is not None:
+            keep &= chunk["Period"].isin(periods).to_numpy()
+        chunks.append(chunk.loc[keep])
+        if (frame_range is not None and chunk["frameID"].iloc[-1] > frame_range[1]) or (periods is not None and chunk["Period"].iloc[-1] > periods.max()):
+            break
+    data = pd.concat(chunks, ignore_index=True) if chunks else pd.read_csv(csv_path, usecols=needed, nrows=0)
+    return data if usecols is None else data[list(usecols)]
+
+
+def clear_csv_cache(fc_twente_folder=FC_TWENTE_FOLDER, game_id=1):
+    '''
+    Remove every binary cache folder of a game
+    '''
+    game_folder = os.path.join(fc_twente_folder, f"Game {game_id}")
+    for root, dirs, files in os.walk(game_folder):
+        if os.path.basename(root) == CACHE_FOLDER_NAME:
+            shutil.rmtree(root, ignore_errors=True)
+            dirs[:] = []
+
+
+def compare_cache_load_times(
+    fc_twente_folder=FC_TWENTE_FOLDER,
+    game_id=1,
+    team_ids=("A", "B"),
+    modes=("load-event", "load-metadata", "load-ball-data", "load-team-data"),
+):
+    '''
+    Time every load_fc_twente_data mode straight from the csv files (cold) and from the binary cache (warm), and
+    return the timings side by side as a DataFrame.
+    '''
+    results = []
+    for mode in modes:
+        for team_id in (team_ids if mode == "load-team-data" else (None,)):
+            start = time.perf_counter()
+            cold = load_fc_twente_data(fc_twente_folder, game_id, team_id=team_id, mode=mode, use_cache=False)
+            cold_time = time.perf_counter() - start
+            # make sure the cache exists, then time the warm read
+            load_fc_twente_data(fc_twente_folder, game_id, team_id=team_id, mode=mode, use_cache=True)
+            start = time.perf_counter()
+            warm = load_fc_twente_data(fc_twente_folder, game_id, team_id=team_id, mode=mode, use_cache=True)
+            warm_time = time.perf_counter() - start
+            assert cold.shape == warm.shape, "Cached data does not match the csv data for mode %s" % mode
+            results.append({"mode": mode, "team_id": team_id, "csv_s": cold_time, "cache_s": warm_time,
+                            "speedup": cold_time / warm_time if warm_time > 0 else np.nan})
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
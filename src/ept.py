@@ -1,6 +1,10 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pandas as pd
 import pitchcontrol as pc
 import data_in_out as io
+import velocities as vl
 
 def load_xT_grid(fname='xT_grid.csv'):
     """ load_xT_grid(fname='xT.csv')
@@ -19,6 +23,89 @@ def load_xT_grid(fname='xT_grid.csv'):
     xT = np.loadtxt(fname, delimiter=',')
     return xT
     
+class XTSurface(object):
+    """ XTSurface
+    
+    An xT grid with both orientations precomputed, for repeated (vectorized) lookups. The object only holds NumPy arrays,
+    so it can be pickled and sent to worker processes instead of re-reading the grid file.
+    
+    Parameters
+    -----------
+        xT: xT grid (loaded using load_xT_grid() ), for attack_direction=1 (left->right)
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (105,68)
+    """
+    
+    def __init__(self, xT, field_dimen=(105.,68.)):
+        grid = np.array(xT, dtype=float)
+        # grids[0]: attack direction 1 (left->right), grids[1]: attack direction -1 (right->left)
+        self.grids = np.stack( [grid, np.fliplr(grid)] )
+        self.grids.flags.writeable = False
+        self.field_dimen = tuple(field_dimen)
+        self.shape = grid.shape
+        self.dx = field_dimen[0]/float(grid.shape[1])
+        self.dy = field_dimen[1]/float(grid.shape[0])
+    
+    @classmethod
+    def from_file(cls, fname='xT_grid.csv', field_dimen=(105.,68.)):
+        return cls(load_xT_grid(fname), field_dimen)
+    
+    def oriented(self, attack_direction):
+        # xT grid as seen by a team attacking in 'attack_direction' (1: left->right, -1: right->left)
+        return self.grids[1 if attack_direction==-1 else 0]
+    
+    def value_at(self, position, attack_direction):
+        # xT at a single (x,y) position (same as get_xT_at_location)
+        return float( self.values_at(np.asarray(position, dtype=float)[None,:], attack_direction)[0] )
+    
+    def values_at(self, positions, attack_direction, interpolate=False):
+        """ values_at
+        
+        xT at N positions at once
+        
+        Parameters
+        -----------
+            positions: (N,2) array of (x,y) pitch positions
+            attack_direction: attack direction (1: left->right, -1: right->left), one for all positions or one per position
+            interpolate: bilinear interpolation between the cell centres instead of the value of the cell
+            
+        Returrns
+        -----------
+            (N,) xT values: 0 for positions off the field, NaN for missing (NaN) positions
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1,2)
+        x, y = positions[:,0], positions[:,1]
+        grid_index = np.broadcast_to( np.asarray(attack_direction)==-1, x.shape ).astype(int)
+        ny, nx = self.shape
+        with np.errstate(invalid='ignore'):
+            off_field = (np.abs(x)>self.field_dimen[0]/2.) | (np.abs(y)>self.field_dimen[1]/2.)
+        x = np.nan_to_num(x)
+        y = np.nan_to_num(y)
+        if interpolate:
+            # position in units of cells, relative to the centre of the first cell (clamped at the outer cell centres)
+            fx = np.clip( (x+self.field_dimen[0]/2.)/self.dx - 0.5, 0, nx-1 )
+            fy = np.clip( (y+self.field_dimen[1]/2.)/self.dy - 0.5, 0, ny-1 )
+            ix0 = np.minimum( fx.astype(int), nx-2 ) if nx>1 else np.zeros(x.shape, dtype=int)
+            iy0 = np.minimum( fy.astype(int), ny-2 ) if ny>1 else np.zeros(y.shape, dtype=int)
+            ix1 = np.minimum( ix0+1, nx-1 )
+            iy1 = np.minimum( iy0+1, ny-1 )
+            wx = fx-ix0
+            wy = fy-iy0
+            g = self.grids
+            values = ( (1-wy)*((1-wx)*g[grid_index,iy0,ix0] + wx*g[grid_index,iy0,ix1])
+                       + wy*((1-wx)*g[grid_index,iy1,ix0] + wx*g[grid_index,iy1,ix1]) )
+        else:
+            # same cell as get_xT_at_location (int() truncates towards zero)
+            ix = np.clip( np.trunc( (x+self.field_dimen[0]/2.-0.0001)/self.dx ).astype(int), 0, nx-1 )
+            iy = np.clip( np.trunc( (y+self.field_dimen[1]/2.-0.0001)/self.dy ).astype(int), 0, ny-1 )
+            values = self.grids[grid_index,iy,ix]
+        values = np.where( off_field, 0.0, values )
+        values[ np.isnan(positions).any(axis=1) ] = np.nan
+        return values
+
+def as_xt_surface(xT, field_dimen=(105.,68.)):
+    # XTSurface of an xT grid (or the XTSurface itself)
+    return xT if isinstance(xT, XTSurface) else XTSurface(xT, field_dimen)
+
 def get_xT_at_location(position,xT,attack_direction,field_dimen=(105.,68.)):
     """ get_xT_at_location
     
@@ -27,7 +114,7 @@ def get_xT_at_location(position,xT,attack_direction,field_dimen=(105.,68.)):
     Parameters
     -----------
         position: Tuple containing the (x,y) pitch position
-        xT: tuple expected threat value grid (loaded using load_xT_grid() )
+        xT: tuple expected threat value grid (loaded using load_xT_grid() ) or XTSurface
         attack_direction: Sets the attack direction (1: left->right, -1: right->left)
         field_dimen: tuple containing the length and width of the pitch in meters. Default is (105,68)
             
@@ -36,6 +123,8 @@ def get_xT_at_location(position,xT,attack_direction,field_dimen=(105.,68.)):
         xT value at input position
         
     """
+    if isinstance(xT, XTSurface):
+        return xT.value_at(position, attack_direction)
     
     x,y = position
     if abs(x)>field_dimen[0]/2. or abs(y)>field_dimen[1]/2.:
@@ -50,7 +139,33 @@ def get_xT_at_location(position,xT,attack_direction,field_dimen=(105.,68.)):
         iy = (y+field_dimen[1]/2.-0.0001)/dy
         return xT[int(iy),int(ix)]
     
-def calculate_action_value_added(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params):
+def initialise_pass_players(pass_team, pass_frame, pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction=None):
+    """ initialise_pass_players
+    
+    Direction of play of the team making a pass and the attacking/defending players at the moment of the pass (offside attackers removed)
+    
+    Returrns
+    -----------
+        attack_direction: direction of play of the attacking team (1: left->right, -1: right->left)
+        attacking_players, defending_players: pitch control TeamStates (pc.TeamState)
+    """
+    if home_attack_direction is None:
+        home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
+    if pass_team=='Team_A':
+        attack_direction = home_attack_direction
+        attacking_players = pc.initialise_team_state(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
+        defending_players = pc.initialise_team_state(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
+    elif pass_team=='Team_B':
+        attack_direction = home_attack_direction*-1
+        defending_players = pc.initialise_team_state(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
+        attacking_players = pc.initialise_team_state(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
+    else:
+        assert False, "Team in possession must be either home or away"
+    # flag any players that are offside
+    attacking_players = pc.check_offsides( attacking_players, defending_players, pass_start_pos, GK_numbers)
+    return attack_direction, attacking_players, defending_players
+
+def calculate_action_value_added(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=None):
     """ calculate_xT_added
     
     Calculates the expected threat value added by a pass
@@ -62,8 +177,9 @@ def calculate_action_value_added(event_id, events, tracking_home, tracking_away,
         tracking_home: tracking DataFrame for the Home team
         tracking_away: tracking DataFrame for the Away team
         GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
-        xT: tuple expected threat value grid (loaded using load_xT_grid() )
+        xT: tuple expected threat value grid (loaded using load_xT_grid() ) or XTSurface
         params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        home_attack_direction: direction of play of the home team (find_playing_direction). Computed from tracking_home if not given
         
     Returrns
     -----------
@@ -76,29 +192,13 @@ def calculate_action_value_added(event_id, events, tracking_home, tracking_away,
     pass_frame = events.loc[event_id]['start_frameID'] 
     pass_team = events.loc[event_id].Team
     
-    # direction of play for atacking team (so we know whether to flip the xT grid)
-    home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
-    if pass_team=='Team_A':
-        attack_direction = home_attack_direction
-        attacking_players = pc.initialise_players(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
-        defending_players = pc.initialise_players(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
-    elif pass_team=='Team_B':
-        attack_direction = home_attack_direction*-1
-        defending_players = pc.initialise_players(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
-        attacking_players = pc.initialise_players(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])    
-    # flag any players that are offside
-    attacking_players = pc.check_offsides( attacking_players, defending_players, pass_start_pos, GK_numbers)
-    # pitch control grid at pass start location
-    pitchcontrol_start,_ = pc.calculate_pitch_control_at_target(pass_start_pos, attacking_players, defending_players, pass_start_pos, params)
+    # direction of play for atacking team (so we know whether to flip the xT grid) and the players at the moment of the pass
+    attack_direction, attacking_players, defending_players = initialise_pass_players(pass_team, pass_frame, pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+    # pitch control at pass start and end location
+    (pitchcontrol_start, pitchcontrol_target),_ = pc.calculate_pitch_control_at_targets(np.array([pass_start_pos, pass_target_pos]), attacking_players, defending_players, pass_start_pos, params)
 
-    # pitch control grid at pass end location
-    pitchcontrol_target,_ = pc.calculate_pitch_control_at_target(pass_target_pos, attacking_players, defending_players, pass_start_pos, params)
-
-    # xT at start location
-    xT_start = get_xT_at_location(pass_start_pos, xT, attack_direction=attack_direction)
-
-    # xT at end location
-    xT_target   = get_xT_at_location(pass_target_pos,xT,attack_direction=attack_direction)
+    # xT at start and end location
+    xT_start, xT_target = as_xt_surface(xT).values_at(np.array([pass_start_pos, pass_target_pos]), attack_direction)
 
     # 'Expected' xT at target and start location
     action_value_target = pitchcontrol_target*xT_target
@@ -121,7 +221,56 @@ def calculate_action_value_added(event_id, events, tracking_home, tracking_away,
 
     return action_value_added, xT_difference
 
-def find_max_value_added_target( event_id, events, tracking_home, tracking_away, GK_numbers, xT, params ):
+def calculate_action_values_added(event_ids, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=None, backend='auto'):
+    """ calculate_action_values_added
+    
+    calculate_action_value_added for many passes at once: the pitch control at the start and end location of every pass
+    is evaluated in a single pc.calculate_pitch_control_for_queries call. A pass whose players cannot be set up (e.g. the
+    defending goalkeeper is missing) gets NaN values and the error message.
+    
+    Parameters
+    -----------
+        event_ids: Indices (not rows) of the pass events
+        events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction: see calculate_action_value_added
+        backend: pitch control kernel ('numpy', 'numba' or 'auto', see pc.calculate_pitch_control_for_queries)
+        
+    Returrns
+    -----------
+        values: DataFrame indexed by event id with columns action_value_added, xT_difference and error
+    """
+    if home_attack_direction is None:
+        home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
+    xT = as_xt_surface(xT)
+    values = pd.DataFrame({'action_value_added': np.nan, 'xT_difference': np.nan, 'error': None}, index=pd.Index(event_ids, name='event_id'))
+    passes, targets, ball_starts, attacking, defending = [], [], [], [], []
+    for event_id in event_ids:
+        event = events.loc[event_id]
+        pass_start_pos = np.array([event['start_x'],event['start_y']])
+        pass_target_pos = np.array([event['end_x'],event['end_y']])
+        try:
+            attack_direction, attacking_players, defending_players = initialise_pass_players(event.Team, event['start_frameID'], pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        except Exception as e:
+            values.loc[event_id, 'error'] = "%s: %s" % (type(e).__name__, e)
+            continue
+        attacking_arrays = pc.players_to_arrays(attacking_players, attacking=True)
+        defending_arrays = pc.players_to_arrays(defending_players, attacking=False)
+        # two queries per pass (start and end location), both with the ball played from the start location
+        passes.append( (event_id, attack_direction, pass_start_pos, pass_target_pos) )
+        targets += [pass_start_pos, pass_target_pos]
+        ball_starts += [pass_start_pos, pass_start_pos]
+        attacking += [attacking_arrays, attacking_arrays]
+        defending += [defending_arrays, defending_arrays]
+    if not passes:
+        return values
+    PPCFatt,_ = pc.calculate_pitch_control_for_queries(np.array(targets), np.array(ball_starts), attacking, defending, params, backend=backend)
+    # xT at the start and end of every pass (same query order as the pitch control)
+    xT_values = xT.values_at(np.array(targets), np.repeat([p[1] for p in passes], 2))
+    event_ids = [p[0] for p in passes]
+    values.loc[event_ids, 'action_value_added'] = PPCFatt[1::2]*xT_values[1::2] - PPCFatt[0::2]*xT_values[0::2]
+    values.loc[event_ids, 'xT_difference'] = xT_values[1::2] - xT_values[0::2]
+    return values
+
+def find_max_value_added_target( event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=None, verbose=True, adaptive=False ):
     """ find_max_value_added_target
     
     Finds the *maximum* expected threat value that could have been achieved for a pass (defined by the event_id) by searching the entire field for the best target.
@@ -133,47 +282,40 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
         tracking_home: tracking DataFrame for the Home team
         tracking_away: tracking DataFrame for the Away team
         GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
-        xT: tuple expected threat value grid (loaded using load_xT_grid() )
+        xT: tuple expected threat value grid (loaded using load_xT_grid() ) or XTSurface
         params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        home_attack_direction: direction of play of the home team (find_playing_direction). Computed from tracking_home if not given
+        verbose: print the details of the pitch control calculation
+        adaptive: use the adaptive pitch control grid (generate_adaptive_pitch_control_for_event), resampled to the xT grid
         
     Returrns
     -----------
         maxxT_added: maximum xT value-added that could be achieved at the current instant
         max_target_location: (x,y) location of the position of the maxxT_added
     """
+    xT = as_xt_surface(xT)
     # pull out pass details from the event data
     pass_start_pos = np.array([events.loc[event_id]['start_x'],events.loc[event_id]['start_y']])
     pass_frame = events.loc[event_id]['start_frameID']
     pass_team = events.loc[event_id].Team
     
-    # direction of play for atacking team (so we know whether to flip the xT grid)
-    home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
-    if pass_team=='Team_A':
-        attack_direction = home_attack_direction
-        attacking_players = pc.initialise_players(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
-        defending_players = pc.initialise_players(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
-    elif pass_team=='Team_B':
-        attack_direction = home_attack_direction*-1
-        defending_players = pc.initialise_players(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
-        attacking_players = pc.initialise_players(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])   
-        
-    # flag any players that are offside
-    attacking_players = pc.check_offsides( attacking_players, defending_players, pass_start_pos, GK_numbers)
+    # direction of play for atacking team (so we know whether to flip the xT grid) and the players at the moment of the pass
+    attack_direction, attacking_players, defending_players = initialise_pass_players(pass_team, pass_frame, pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
     
     # pitch control grid at pass start location
-    pitchcontrol_start,_ = pc.calculate_pitch_control_at_target(pass_start_pos, attacking_players, defending_players, pass_start_pos, params)
+    (pitchcontrol_start,),_ = pc.calculate_pitch_control_at_targets(pass_start_pos, attacking_players, defending_players, pass_start_pos, params)
     
     # xT at start location
-    xT_start = get_xT_at_location(pass_start_pos, xT, attack_direction=attack_direction)
+    xT_start = xT.value_at(pass_start_pos, attack_direction)
 
-    # calculate pitch control surface at moment of the pass
-    PPCF,xgrid,ygrid = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 50, offsides=True)
+    # calculate pitch control surface at moment of the pass, on the same grid as the xT surface
+    if adaptive:
+        PPCF,xgrid,ygrid = pc.generate_adaptive_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), output_shape = xT.shape, offsides=True)
+    else:
+        PPCF,xgrid,ygrid = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = xT.shape[1], n_grid_cells_y = xT.shape[0], offsides=True, verbose=verbose)
     
     # xT surface at instance of the pass
-    if attack_direction == -1:
-        action_value = np.fliplr(xT)*PPCF
-    else:
-        action_value = xT*PPCF
+    action_value = xT.oriented(attack_direction)*PPCF
         
     # find indices of the maxxT
     maxxT_idx = np.unravel_index(action_value.argmax(),action_value.shape)
@@ -187,4 +329,269 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
     # location of maximum
     max_target_location = (xgrid[maxxT_idx[1]], ygrid[maxxT_idx[0]])
 
-    return maxxT_added, max_target_location
\ No newline at end of file
+    return maxxT_added, max_target_location
+
+def pass_options(attacking_players, pass_start_pos, passer=None, run_on_seconds=None, field_dimen=(105.,68.)):
+    """ pass_options
+    
+    Pass targets of a pass: the position of every teammate of the passer on the pitch (offside players have been removed
+    from attacking_players by initialise_pass_players) and, with run_on_seconds, the point each teammate reaches after
+    running on at their current velocity for run_on_seconds (kept on the field).
+    
+    Parameters
+    -----------
+        attacking_players: pitch control TeamState of the attacking team
+        pass_start_pos: (x,y) position of the ball
+        passer: player id of the passer (e.g. 'Player_6'). Default is the attacking player nearest to the ball
+        run_on_seconds: also add the projected run-on point of every teammate
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (105,68)
+        
+    Returrns
+    -----------
+        options: DataFrame with columns player, option ('position' or 'run_on'), target_x and target_y
+    """
+    ids = attacking_players.ids[attacking_players.inframe]
+    positions = attacking_players.positions[attacking_players.inframe]
+    velocities = attacking_players.velocities[attacking_players.inframe]
+    if passer is None and len(ids):
+        passer = ids[ np.argmin( np.linalg.norm(positions-np.asarray(pass_start_pos, dtype=float), axis=1) ) ]
+    receivers = ids != passer
+    options = [ pd.DataFrame({'player': ids[receivers], 'option': 'position', 'target_x': positions[receivers,0], 'target_y': positions[receivers,1]}) ]
+    if run_on_seconds is not None:
+        run_on = positions[receivers] + velocities[receivers]*run_on_seconds
+        run_on = np.clip( run_on, -np.array(field_dimen)/2., np.array(field_dimen)/2. )
+        options.append( pd.DataFrame({'player': ids[receivers], 'option': 'run_on', 'target_x': run_on[:,0], 'target_y': run_on[:,1]}) )
+    return pd.concat(options, ignore_index=True)
+
+def evaluate_pass_options_for_events(events, tracking_home, tracking_away, GK_numbers, xT, params, event_types=('Pass',), home_attack_direction=None, run_on_seconds=None, n_path_points=10, backend='auto'):
+    """ evaluate_pass_options_for_events
+    
+    Scores every teammate of the passer as a receiver (see pass_options), for every pass in 'events'. For each target the
+    pitch control of the attacking team, the xT, their product (value) and value_added (value - value at the ball, as in
+    calculate_action_value_added) are given, together with the interception risk: the largest control of the defending
+    team at n_path_points points evenly spread along the ball path. All targets and path points of all passes are
+    evaluated in a single pc.calculate_pitch_control_for_queries call.
+    
+    Parameters
+    -----------
+        events: Dataframe containing the event data (with 'start_frameID', see io.processing_events_data)
+        tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction: see calculate_action_value_added
+        event_types: event types ('type_name') to score. None scores every event
+        run_on_seconds: also score the projected run-on point of every teammate
+        n_path_points: number of points along the ball path where the interception risk is evaluated
+        backend: pitch control kernel ('numpy', 'numba' or 'auto', see pc.calculate_pitch_control_for_queries)
+        
+    Returrns
+    -----------
+        options: DataFrame with one row per (event_id, target): player, option, target_x, target_y, pitch_control, xT,
+            value, value_added and interception_risk. A pass whose players cannot be set up gets a single row with the error message
+    """
+    if event_types is not None:
+        events = events.loc[events['type_name'].isin(event_types)]
+    if home_attack_direction is None:
+        home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
+    passes, errors = [], []
+    for event_id, event in events.iterrows():
+        pass_start_pos = np.array([event['start_x'],event['start_y']])
+        # the passer's id without the team name (e.g. 'Team_A_Player_6' -> 'Player_6')
+        passer = event['FullName'][len(event.Team)+1:] if isinstance(event['FullName'], str) else None
+        try:
+            attack_direction, attacking_players, defending_players = initialise_pass_players(event.Team, event['start_frameID'], pass_start_pos, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        except Exception as e:
+            errors.append( (event_id, "%s: %s" % (type(e).__name__, e)) )
+            continue
+        options = pass_options(attacking_players, pass_start_pos, passer=passer, run_on_seconds=run_on_seconds)
+        passes.append( (event_id, attack_direction, pass_start_pos, attacking_players, defending_players, options) )
+    options = _evaluate_pass_options(passes, xT, params, n_path_points, backend)
+    if errors:
+        options = pd.concat( [options, pd.DataFrame({'event_id': [e[0] for e in errors], 'error': [e[1] for e in errors]})], ignore_index=True )
+    return options.set_index('event_id')
+
+def evaluate_pass_options(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=None, run_on_seconds=None, n_path_points=10, backend='auto'):
+    """ evaluate_pass_options
+    
+    evaluate_pass_options_for_events for a single pass event: scores every teammate of the passer as a receiver
+    
+    Returrns
+    -----------
+        options: DataFrame with one row per target (see evaluate_pass_options_for_events), best value_added first
+    """
+    options = evaluate_pass_options_for_events(events.loc[[event_id]], tracking_home, tracking_away, GK_numbers, xT, params, event_types=None, home_attack_direction=home_attack_direction,
+                                               run_on_seconds=run_on_seconds, n_path_points=n_path_points, backend=backend)
+    if 'error' in options.columns and options['error'].notna().any():
+        raise ValueError(options['error'].dropna().iloc[0])
+    return options.sort_values('value_added', ascending=False)
+
+def evaluate_pass_options_for_frame(frame, team_in_possession, ball_position, tracking_home, tracking_away, GK_numbers, xT, params, passer=None, home_attack_direction=None, run_on_seconds=None, n_path_points=10, backend='auto'):
+    """ evaluate_pass_options_for_frame
+    
+    Pass options (see evaluate_pass_options_for_events) at any frame: every player of team_in_possession ('Team_A' or
+    'Team_B') except the passer (default: the player nearest to ball_position) is scored as a receiver of a pass
+    played from ball_position
+    
+    Returrns
+    -----------
+        options: DataFrame with one row per target, best value_added first
+    """
+    if home_attack_direction is None:
+        home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
+    ball_position = np.asarray(ball_position, dtype=float)
+    attack_direction, attacking_players, defending_players = initialise_pass_players(team_in_possession, frame, ball_position, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+    options = pass_options(attacking_players, ball_position, passer=passer, run_on_seconds=run_on_seconds)
+    options = _evaluate_pass_options([(frame, attack_direction, ball_position, attacking_players, defending_players, options)], xT, params, n_path_points, backend)
+    return options.drop(columns='event_id').sort_values('value_added', ascending=False, ignore_index=True)
+
+def _evaluate_pass_options(passes, xT, params, n_path_points, backend):
+    # pitch control at the ball, at every target and along every ball path of the passes (event_id, attack_direction,
+    # pass_start_pos, attacking_players, defending_players, options), evaluated as one batch of queries
+    xT = as_xt_surface(xT)
+    columns = ['event_id','player','option','target_x','target_y','pitch_control','xT','value','value_added','interception_risk']
+    if not passes:
+        return pd.DataFrame(columns=columns)
+    fractions = np.arange(1, n_path_points+1)/(n_path_points+1.)
+    targets, query_pass, n_options = [], [], []
+    for k, (_, _, pass_start_pos, _, _, options) in enumerate(passes):
+        option_targets = options[['target_x','target_y']].to_numpy(dtype=float)
+        # the ball position, the targets and the points along the path to each target (target-major)
+        path = pass_start_pos + (option_targets[:,None,:]-pass_start_pos)*fractions[None,:,None]
+        pass_targets = np.vstack( [pass_start_pos[None,:], option_targets, path.reshape(-1,2)] )
+        targets.append(pass_targets)
+        query_pass.append( np.full(len(pass_targets), k) )
+        n_options.append( len(option_targets) )
+    targets = np.vstack(targets)
+    query_pass = np.concatenate(query_pass)
+    ball_starts = np.array( [p[2] for p in passes] )[query_pass]
+    # players of every pass stacked once, then repeated for each of its queries
+    attacking = pc.stack_player_arrays( [pc.players_to_arrays(p[3], attacking=True) for p in passes] )
+    defending = pc.stack_player_arrays( [pc.players_to_arrays(p[4], attacking=False) for p in passes] )
+    attacking = pc.PlayerArrays( *[field[query_pass] for field in attacking] )
+    defending = pc.PlayerArrays( *[field[query_pass] for field in defending] )
+    PPCFatt, PPCFdef = pc.calculate_pitch_control_for_queries(targets, ball_starts, attacking, defending, params, backend=backend)
+
+    results = []
+    offset = 0
+    for (event_id, attack_direction, pass_start_pos, _, _, options), n in zip(passes, n_options):
+        value_start = PPCFatt[offset]*xT.value_at(pass_start_pos, attack_direction)
+        option_targets = targets[offset+1:offset+1+n]
+        options = options.copy()
+        options.insert(0, 'event_id', event_id)
+        options['pitch_control'] = PPCFatt[offset+1:offset+1+n]
+        options['xT'] = xT.values_at(option_targets, attack_direction)
+        options['value'] = options['pitch_control']*options['xT']
+        options['value_added'] = options['value'] - value_start
+        path_control = PPCFdef[offset+1+n:offset+1+n+n*n_path_points].reshape(n, n_path_points)
+        options['interception_risk'] = path_control.max(axis=1) if n_path_points>0 else 0.
+        results.append(options)
+        offset += 1 + n + n*n_path_points
+    return pd.concat(results, ignore_index=True)[columns]
+
+def calculate_action_values_for_events(events, tracking_home, tracking_away, GK_numbers, xT, params, event_types=('Pass',), include_max_target=True, n_workers=None, chunksize=16):
+    """ calculate_action_values_for_events
+    
+    Scores every pass of a match in one call. The events are split into chunks that are evaluated in a process pool; each chunk
+    only carries the tracking frames it needs. An event that raises an error gets NaN values and the error message instead of
+    stopping the run.
+    
+    Parameters
+    -----------
+        events: Dataframe containing the event data (with 'start_frameID', see io.processing_events_data)
+        tracking_home: tracking DataFrame for the Home team
+        tracking_away: tracking DataFrame for the Away team
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        xT: tuple expected threat value grid (loaded using load_xT_grid() ) or XTSurface
+        params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        event_types: event types ('type_name') to score. None scores every event
+        include_max_target: also compute maxxT_added and the max target location (find_max_value_added_target)
+        n_workers: number of worker processes (default is the number of cpus). 1 runs everything in the current process
+        chunksize: number of events per task sent to a worker
+        
+    Returrns
+    -----------
+        values: DataFrame indexed by event id with columns action_value_added, xT_difference, maxxT_added, max_target_x, max_target_y and error
+    """
+    if event_types is not None:
+        events = events.loc[events['type_name'].isin(event_types)]
+    home_attack_direction = io.find_playing_direction(tracking_home,'Team_A')
+    # the xT surface (both orientations) is built once and sent to the workers with each chunk
+    xT = as_xt_surface(xT)
+    chunks = []
+    for start in range(0, len(events), chunksize):
+        chunk = events.iloc[start:start+chunksize]
+        frames = pd.unique(chunk['start_frameID'].dropna())
+        frames = [f for f in frames if f in tracking_home.index]
+        chunks.append( (chunk, tracking_home.loc[frames], tracking_away.loc[frames], GK_numbers, xT, params, home_attack_direction, include_max_target) )
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers<=1 or len(chunks)<=1:
+        results = [_action_values_for_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_action_values_for_chunk, *zip(*chunks)))
+    columns = ['action_value_added','xT_difference','maxxT_added','max_target_x','max_target_y','error']
+    values = pd.DataFrame([row for result in results for row in result], columns=['event_id']+columns)
+    return values.set_index('event_id')
+
+def _action_values_for_chunk(events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction, include_max_target):
+    # worker task of calculate_action_values_for_events: evaluates a chunk of events, catching the errors of each event
+    rows = []
+    try:
+        added = calculate_action_values_added(events.index, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction)
+    except Exception:
+        # an error outside the per-event checks of the batch: evaluate the events one at a time, so that it only
+        # costs the event that causes it
+        added = pd.concat([_action_values_added_or_error(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction) for event_id in events.index])
+    for event_id in events.index:
+        row = [event_id] + [np.nan]*5 + [added.loc[event_id, 'error']]
+        if row[6] is not None:
+            rows.append(row)
+            continue
+        row[1], row[2] = added.loc[event_id, 'action_value_added'], added.loc[event_id, 'xT_difference']
+        try:
+            if include_max_target:
+                row[3], (row[4], row[5]) = find_max_value_added_target(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction, verbose=False)
+        except Exception as e:
+            row[6] = "%s: %s" % (type(e).__name__, e)
+        rows.append(row)
+    return rows
+
+def _action_values_added_or_error(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction):
+    # calculate_action_values_added for a single event, with the error message in place of the values if it fails
+    try:
+        return calculate_action_values_added([event_id], events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction)
+    except Exception as e:
+        return pd.DataFrame({'action_value_added': np.nan, 'xT_difference': np.nan, 'error': pd.Series(["%s: %s" % (type(e).__name__, e)], dtype=object)}).set_axis(pd.Index([event_id], name='event_id'))
+
+def load_game_for_action_values(game_id, fc_twente_folder=io.FC_TWENTE_FOLDER):
+    """ load_game_for_action_values
+    
+    Loads and prepares the events and tracking data of a game the way Project.ipynb does (frame synchronisation, metric
+    coordinates, player velocities and goalkeepers)
+    
+    Returrns
+    -----------
+        events, tracking_home, tracking_away, GK_numbers
+    """
+    events = io.load_fc_twente_data(fc_twente_folder, game_id, mode="load-event")
+    events = io.processing_events_data(events, game_id, fc_twente_folder)
+    tracking_home = io.load_fc_twente_data(fc_twente_folder, game_id, team_id="A", mode="load-team-data")
+    tracking_away = io.load_fc_twente_data(fc_twente_folder, game_id, team_id="B", mode="load-team-data")
+    events = io.to_metric_coordinates(events)
+    tracking_home = vl.calc_player_velocities(io.to_metric_coordinates(tracking_home))
+    tracking_away = vl.calc_player_velocities(io.to_metric_coordinates(tracking_away))
+    GK_numbers = [io.find_goalkeeper(tracking_home),io.find_goalkeeper(tracking_away)]
+    return events, tracking_home, tracking_away, GK_numbers
+
+def calculate_action_values_for_games(game_ids, xT, params, fc_twente_folder=io.FC_TWENTE_FOLDER, **kwargs):
+    """ calculate_action_values_for_games
+    
+    Runs calculate_action_values_for_events for each game in game_ids (keyword arguments are passed on) and returns
+    a single DataFrame indexed by (game_id, event_id)
+    """
+    xT = as_xt_surface(xT)
+    values = []
+    for game_id in game_ids:
+        events, tracking_home, tracking_away, GK_numbers = load_game_for_action_values(game_id, fc_twente_folder)
+        game_values = calculate_action_values_for_events(events, tracking_home, tracking_away, GK_numbers, xT, params, **kwargs)
+        values.append( pd.concat({game_id: game_values}, names=['game_id']) )
+    return pd.concat(values)
@@ -1,55 +1,317 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
 import numpy as np
+import pandas as pd
+import data_in_out as IO
+try:
+    import numba # optional: compiles the pitch control query kernel (calculate_pitch_control_for_queries)
+except ImportError:
+    numba = None
 
-def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 50, offsides=True):
-    print("Event id = " + str(event_id))
+def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 50, offsides=True, vectorized=True, verbose=True, use_cache=True, game_id=None, n_grid_cells_y = None):
+    # n_grid_cells_y defaults to the number of cells that keeps the cells (about) square; give it to evaluate the
+    # model on a grid of another shape (e.g. the xT grid)
+    if verbose:
+        print("Event id = " + str(event_id))
 
     pass_frame = events.loc[event_id]['start_frameID'] 
 
-    print("Frame id = " + str(pass_frame))
+    if verbose:
+        print("Frame id = " + str(pass_frame))
 
     pass_team = events.loc[event_id]['Team']
     
-    print("Pass team" + str(pass_team))
+    if verbose:
+        print("Pass team" + str(pass_team))
 
     ball_start_pos = np.array([events.loc[event_id]['start_x'],events.loc[event_id]['start_y']])
     
-    print("Ball pos = " + str(ball_start_pos))
+    if verbose:
+        print("Ball pos = " + str(ball_start_pos))
     
     # break the pitch down into a grid
-    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
-    dx = field_dimen[0]/n_grid_cells_x
-    dy = field_dimen[1]/n_grid_cells_y
-    xgrid = np.arange(n_grid_cells_x)*dx - field_dimen[0]/2. + dx/2.
-    ygrid = np.arange(n_grid_cells_y)*dy - field_dimen[1]/2. + dy/2.
+    grid = n_grid_cells_x if n_grid_cells_y is None else (n_grid_cells_x, n_grid_cells_y)
+    if n_grid_cells_y is None:
+        n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    xgrid, ygrid = grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
     
     # initialise pitch control grids for attacking and defending teams
     PPCFa = np.zeros( shape = (len(ygrid), len(xgrid)))
     PPCFd = np.zeros( shape = (len(ygrid), len(xgrid)))
     
     #initialise player positions and velocities for pitch control calc (so that we're not repeating this at each grid cell position)
+    attacking_players, defending_players = initialise_event_players(pass_team, pass_frame, ball_start_pos, tracking_home, tracking_away, params, GK_numbers, offsides)
+
+    # look the surface up in the pitch control cache (see PitchControlCache). The reference implementation is never
+    # cached, so that it can always be compared with the vectorized one
+    use_cache = use_cache and vectorized
+    if use_cache:
+        cache_key = surface_cache.key(game_id, pass_frame, pass_team, ball_start_pos, attacking_players, defending_players, params, field_dimen, grid, offsides)
+        cached = surface_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if vectorized:
+        # calculate pitch control model at every location on the pitch in one go
+        xx, yy = np.meshgrid(xgrid, ygrid)
+        target_positions = np.column_stack( [xx.ravel(), yy.ravel()] )
+        PPCFatt, PPCFdef = calculate_pitch_control_at_targets(target_positions, attacking_players, defending_players, ball_start_pos, params)
+        PPCFa = PPCFatt.reshape( PPCFa.shape )
+        PPCFd = PPCFdef.reshape( PPCFd.shape )
+    else:
+        # reference implementation: calculate pitch control model at each location on the pitch, one cell at a time
+        attacking_players, defending_players = attacking_players.players(params), defending_players.players(params)
+        for i in range( len(ygrid) ):
+            for j in range( len(xgrid) ):
+                target_position = np.array( [xgrid[j], ygrid[i]] )
+                PPCFa[i,j],PPCFd[i,j] = calculate_pitch_control_at_target(target_position, attacking_players, defending_players, ball_start_pos, params)
+    # check probabilitiy sums within convergence
+    checksum = np.sum( PPCFa + PPCFd ) / float(n_grid_cells_y*n_grid_cells_x ) 
+    assert 1-checksum < params['model_converge_tol'], "Checksum failed: %1.3f" % (1-checksum)
+    if use_cache:
+        surface_cache.put(cache_key, (PPCFa,xgrid,ygrid))
+    return PPCFa,xgrid,ygrid
+
+
+def generate_pitch_control_for_frame(home_frame, away_frame, ball_position, attacking_team, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 50, use_cache=True):
+    # pitch control surface of 'attacking_team' ('Team_A' or 'Team_B') at a single tracking frame (rows of the home and
+    # away tracking data, e.g. tracking_home.loc[frame]), with the ball played from 'ball_position'. No offside check.
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    xgrid, ygrid = grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+    home_players = initialise_team_state(home_frame,'Team_A',params,GK_numbers[0])
+    away_players = initialise_team_state(away_frame,'Team_B',params,GK_numbers[1])
+    attacking_players, defending_players = (home_players, away_players) if attacking_team=='Team_A' else (away_players, home_players)
+    ball_position = np.asarray(ball_position, dtype=float)
+    if use_cache:
+        cache_key = surface_cache.key(None, 'frame', attacking_team, ball_position, attacking_players, defending_players, params, field_dimen, n_grid_cells_x, False)
+        cached = surface_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    PPCFa = calculate_pitch_control_at_targets(np.column_stack([xx.ravel(), yy.ravel()]), attacking_players, defending_players, ball_position, params)[0].reshape(xx.shape)
+    if use_cache:
+        surface_cache.put(cache_key, (PPCFa,xgrid,ygrid))
+    return PPCFa,xgrid,ygrid
+
+
+def initialise_event_players(pass_team, pass_frame, ball_start_pos, tracking_home, tracking_away, params, GK_numbers, offsides=True):
+    # attacking and defending TeamStates at the frame of an event (offside attackers removed if 'offsides')
     if pass_team=='Team_A':
-        attacking_players = initialise_players(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
-        defending_players = initialise_players(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
+        attacking_players = initialise_team_state(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
+        defending_players = initialise_team_state(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
     elif pass_team=='Team_B':
-        defending_players = initialise_players(tracking_home.loc[pass_frame],'Team_B',params,GK_numbers[0])
-        attacking_players = initialise_players(tracking_away.loc[pass_frame],'Team_A',params,GK_numbers[1])
+        defending_players = initialise_team_state(tracking_home.loc[pass_frame],'Team_A',params,GK_numbers[0])
+        attacking_players = initialise_team_state(tracking_away.loc[pass_frame],'Team_B',params,GK_numbers[1])
     else:
         assert False, "Team in possession must be either home or away"
 
     if offsides:
         attacking_players = check_offsides( attacking_players, defending_players, ball_start_pos, GK_numbers)
+    return attacking_players, defending_players
 
-    # calculate pitch pitch control model at each location on the pitch
-    for i in range( len(ygrid) ):
-        for j in range( len(xgrid) ):
-            target_position = np.array( [xgrid[j], ygrid[i]] )
-            PPCFa[i,j],PPCFd[i,j] = calculate_pitch_control_at_target(target_position, attacking_players, defending_players, ball_start_pos, params)
-    # check probabilitiy sums within convergence
-    checksum = np.sum( PPCFa + PPCFd ) / float(n_grid_cells_y*n_grid_cells_x ) 
-    assert 1-checksum < params['model_converge_tol'], "Checksum failed: %1.3f" % (1-checksum)
+
+def generate_adaptive_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 25, refine_factor = 4, refine_bounds = (0.01,0.99), output_shape = None, offsides=True, use_cache=True, game_id=None, return_stats=False):
+    # adaptive version of generate_pitch_control_for_event. The model is evaluated on a coarse grid of 'n_grid_cells_x'
+    # cells first; coarse cells whose control lies between 'refine_bounds' (and their neighbours, and cells next to an
+    # abrupt change of control) are split into refine_factor x refine_factor cells that are evaluated again. All other
+    # cells are almost certainly controlled by one team and keep their coarse value. The result has the resolution
+    # of the refined grid (n_grid_cells_x*refine_factor cells along x) or, if given, is resampled to
+    # output_shape = (n_grid_cells_y, n_grid_cells_x), e.g. the shape of the xT grid.
+    # With return_stats=True a dictionary with the number of cells evaluated is also returned.
+    pass_frame = events.loc[event_id]['start_frameID']
+    pass_team = events.loc[event_id]['Team']
+    ball_start_pos = np.array([events.loc[event_id]['start_x'],events.loc[event_id]['start_y']])
+    attacking_players, defending_players = initialise_event_players(pass_team, pass_frame, ball_start_pos, tracking_home, tracking_away, params, GK_numbers, offsides)
+    attacking = players_to_arrays(attacking_players, attacking=True)
+    defending = players_to_arrays(defending_players, attacking=False)
+
+    grid = ('adaptive', n_grid_cells_x, refine_factor, list(refine_bounds), output_shape)
+    if use_cache:
+        cache_key = surface_cache.key(game_id, pass_frame, pass_team, ball_start_pos, attacking_players, defending_players, params, field_dimen, grid, offsides)
+        cached = surface_cache.get(cache_key)
+        if cached is not None:
+            return (cached + (None,)) if return_stats else cached
+
+    # coarse grid
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    xgrid, ygrid = grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    PPCFcoarse = calculate_pitch_control_from_arrays(np.column_stack([xx.ravel(), yy.ravel()]), attacking, defending, ball_start_pos, params)[0].reshape(xx.shape)
+
+    # coarse cells to refine: contested cells, their neighbours and cells where control jumps between neighbours
+    refine = (PPCFcoarse > refine_bounds[0]) & (PPCFcoarse < refine_bounds[1])
+    padded = np.pad(PPCFcoarse, 1, mode='edge')
+    jump = np.zeros_like(refine)
+    for di, dj in ((0,1),(2,1),(1,0),(1,2)):
+        jump |= np.abs( padded[di:di+n_grid_cells_y, dj:dj+n_grid_cells_x] - PPCFcoarse ) > 0.5
+    padded = np.pad(refine, 1)
+    refine = jump.copy()
+    for di in range(3):
+        for dj in range(3):
+            refine |= padded[di:di+n_grid_cells_y, dj:dj+n_grid_cells_x]
+
+    # fine grid: coarse values everywhere, re-evaluated under the refined coarse cells
+    fine_xgrid, fine_ygrid = grid_cell_centres(field_dimen, n_grid_cells_x*refine_factor, n_grid_cells_y*refine_factor)
+    block = np.ones( (refine_factor, refine_factor) )
+    PPCFa = np.kron( PPCFcoarse, block )
+    fine_refine = np.kron( refine, block ).astype(bool)
+    fine_iy, fine_ix = np.nonzero( fine_refine )
+    if fine_iy.size>0:
+        targets = np.column_stack( [fine_xgrid[fine_ix], fine_ygrid[fine_iy]] )
+        PPCFa[fine_iy, fine_ix] = calculate_pitch_control_from_arrays(targets, attacking, defending, ball_start_pos, params)[0]
+    xgrid, ygrid = fine_xgrid, fine_ygrid
+    if output_shape is not None and tuple(output_shape)!=PPCFa.shape:
+        PPCFa, xgrid, ygrid = resample_surface(PPCFa, output_shape, field_dimen)
+
+    if use_cache:
+        surface_cache.put(cache_key, (PPCFa,xgrid,ygrid))
+    if return_stats:
+        stats = {'coarse_cells': int(PPCFcoarse.size), 'refined_cells': int(fine_iy.size),
+                 'cells_evaluated': int(PPCFcoarse.size+fine_iy.size), 'uniform_cells': int(fine_refine.size)}
+        return PPCFa, xgrid, ygrid, stats
     return PPCFa,xgrid,ygrid
 
 
+def grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y):
+    # x and y coordinates of the centres of a grid of cells covering the pitch
+    dx = field_dimen[0]/n_grid_cells_x
+    dy = field_dimen[1]/n_grid_cells_y
+    xgrid = np.arange(n_grid_cells_x)*dx - field_dimen[0]/2. + dx/2.
+    ygrid = np.arange(n_grid_cells_y)*dy - field_dimen[1]/2. + dy/2.
+    return xgrid, ygrid
+
+
+def resample_surface(PPCF, output_shape, field_dimen = (105.,68.,)):
+    # resample a pitch control surface covering the pitch to a grid of output_shape = (n_grid_cells_y, n_grid_cells_x)
+    # cells (e.g. the shape of the xT grid). Each output cell takes the value of the input cell containing its centre.
+    n_y, n_x = PPCF.shape
+    xgrid, ygrid = grid_cell_centres(field_dimen, output_shape[1], output_shape[0])
+    ix = np.clip( ((xgrid+field_dimen[0]/2.)/field_dimen[0]*n_x).astype(int), 0, n_x-1 )
+    iy = np.clip( ((ygrid+field_dimen[1]/2.)/field_dimen[1]*n_y).astype(int), 0, n_y-1 )
+    return PPCF[np.ix_(iy, ix)], xgrid, ygrid
+
+
+def compare_adaptive_to_uniform(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (105.,68.,), n_grid_cells_x = 25, refine_factor = 4, refine_bounds = (0.01,0.99), offsides=True):
+    # accuracy vs cost of generate_adaptive_pitch_control_for_event against the uniform grid of the same resolution
+    start = time.perf_counter()
+    PPCFuniform,_,_ = generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = field_dimen, n_grid_cells_x = n_grid_cells_x*refine_factor, offsides=offsides, verbose=False, use_cache=False)
+    uniform_time = time.perf_counter()-start
+    start = time.perf_counter()
+    PPCFadaptive,_,_,stats = generate_adaptive_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = field_dimen, n_grid_cells_x = n_grid_cells_x, refine_factor = refine_factor, refine_bounds = refine_bounds, output_shape = None, offsides=offsides, use_cache=False, return_stats=True)
+    adaptive_time = time.perf_counter()-start
+    if PPCFadaptive.shape!=PPCFuniform.shape:
+        # the uniform grid has int(n_x*68/105) rows, which need not be a multiple of refine_factor
+        PPCFadaptive,_,_ = resample_surface(PPCFadaptive, PPCFuniform.shape, field_dimen)
+    error = np.abs( PPCFadaptive-PPCFuniform )
+    stats.update( {'uniform_time': uniform_time, 'adaptive_time': adaptive_time, 'max_abs_error': float(error.max()), 'mean_abs_error': float(error.mean())} )
+    return stats
+
+
+class PitchControlCache(object):
+    # cache of pitch control surfaces (PPCFa, xgrid, ygrid). Surfaces are keyed on a hash of everything they depend on:
+    # game, frame, attacking team, ball position, the positions and velocities of the players, the model parameters,
+    # the grid and the offsides flag. There are two tiers: an in-memory LRU bounded to 'max_memory_bytes', and an optional
+    # on-disk tier of .npz files in 'disk_folder' bounded to 'max_disk_files' (least recently used files are removed first)
+    def __init__(self, max_memory_bytes=256*1024**2, disk_folder=None, max_disk_files=10000):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_folder = disk_folder
+        self.max_disk_files = max_disk_files
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def key(self, game_id, frame, attacking_team, ball_start_pos, attacking_players, defending_players, params, field_dimen, n_grid_cells_x, offsides):
+        h = hashlib.sha1()
+        h.update( json.dumps( [str(game_id), str(frame), str(attacking_team), [float(v) for v in field_dimen], n_grid_cells_x, bool(offsides)], default=str ).encode() )
+        h.update( json.dumps( params_hash(params) ).encode() )
+        h.update( np.asarray(ball_start_pos, dtype=float).tobytes() )
+        for players in (attacking_players, defending_players):
+            if isinstance(players, TeamState):
+                h.update( json.dumps( players.ids[players.inframe].tolist() ).encode() )
+                h.update( np.column_stack( [players.positions[players.inframe], players.velocities[players.inframe]] ).tobytes() )
+            else:
+                h.update( json.dumps( [p.id for p in players] ).encode() )
+                h.update( np.array( [np.r_[p.position, p.velocity] for p in players], dtype=float ).tobytes() )
+        return h.hexdigest()
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits_memory += 1
+            return tuple(a.copy() for a in self.memory[key])
+        if self.disk_folder is not None:
+            fname = os.path.join(self.disk_folder, key + '.npz')
+            if os.path.exists(fname):
+                with np.load(fname) as f:
+                    surface = (f['PPCFa'], f['xgrid'], f['ygrid'])
+                os.utime(fname) # mark as recently used for the eviction of the disk tier
+                self.hits_disk += 1
+                self._put_memory(key, surface)
+                return tuple(a.copy() for a in surface)
+        self.misses += 1
+        return None
+
+    def put(self, key, surface):
+        surface = tuple(np.array(a, copy=True) for a in surface)
+        self._put_memory(key, surface)
+        if self.disk_folder is not None:
+            os.makedirs(self.disk_folder, exist_ok=True)
+            fname = os.path.join(self.disk_folder, key + '.npz')
+            tmp_fname = fname[:-4] + '.tmp-%d.npz' % os.getpid()
+            np.savez(tmp_fname, PPCFa=surface[0], xgrid=surface[1], ygrid=surface[2])
+            os.replace(tmp_fname, fname)
+            self._evict_disk()
+
+    def _put_memory(self, key, surface):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = surface
+        self.memory_bytes += sum(a.nbytes for a in surface)
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= sum(a.nbytes for a in evicted)
+
+    def _evict_disk(self):
+        files = [os.path.join(self.disk_folder, f) for f in os.listdir(self.disk_folder) if f.endswith('.npz')]
+        if len(files) <= self.max_disk_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for fname in files[:len(files)-self.max_disk_files]:
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+
+    def clear(self, disk=False):
+        self.memory.clear()
+        self.memory_bytes = 0
+        if disk and self.disk_folder is not None and os.path.isdir(self.disk_folder):
+            for f in os.listdir(self.disk_folder):
+                if f.endswith('.npz'):
+                    os.remove(os.path.join(self.disk_folder, f))
+
+    def stats(self):
+        hits = self.hits_memory + self.hits_disk
+        requests = hits + self.misses
+        return {'hits_memory': self.hits_memory, 'hits_disk': self.hits_disk, 'misses': self.misses,
+                'hit_rate': hits/requests if requests else 0., 'memory_entries': len(self.memory), 'memory_bytes': self.memory_bytes}
+
+
+def params_hash(params):
+    # stable hash of a model parameter dictionary
+    return hashlib.sha1( json.dumps( {k: float(v) for k,v in params.items()}, sort_keys=True ).encode() ).hexdigest()
+
+
+# pitch control surface cache shared by all entry points (set surface_cache.disk_folder to also keep surfaces on disk)
+surface_cache = PitchControlCache()
+
+
 class player(object):
     # player object holds position, velocity, time-to-intercept and pitch control contributions for each player
     def __init__(self,pid,team,teamname,params,GKid):
@@ -94,7 +356,8 @@ class player(object):
 
 def initialise_players(team,teamname,params,GKid):
     # get player  ids
-    player_ids = np.unique( [ str(c.split('_')[2] + "_" + c.split('_')[3]) for c in team.keys() if teamname in c] )
+    schema = IO.tracking_schema(team)
+    player_ids = schema.ids[ schema.players(teamname) ]
     # create list
     team_players = []
     for p in player_ids:
@@ -104,6 +367,102 @@ def initialise_players(team,teamname,params,GKid):
             team_players.append(team_player)
     return team_players
         
+class TeamState(object):
+    '''
+    The players of one team at one frame, held as contiguous read-only arrays (one row per player) instead of a list
+    of player objects: ids, positions, velocities (NaN velocities set to zero), vmax, reaction_time, tti_sigma,
+    lambda_att, lambda_def, is_gk and inframe. Players that are not on the pitch are kept with inframe=False.
+    The arrays are never modified, so a TeamState can be shared between any number of pitch control calculations.
+
+    Build it with initialise_team_state() from a row of the team tracking DataFrame, or straight from position and
+    velocity arrays (e.g. MatchTracking.team_state). players() returns the equivalent list of player objects for code
+    that still expects initialise_players output.
+    '''
+    __slots__ = ('teamname', 'ids', 'positions', 'velocities', 'vmax', 'reaction_time', 'tti_sigma', 'lambda_att', 'lambda_def', 'is_gk', 'inframe')
+
+    def __init__(self, teamname, ids, positions, velocities, params, GKid, inframe=None):
+        self.teamname = teamname
+        self.ids = np.asarray(ids, dtype=str)
+        self.positions = np.array(positions, dtype=float).reshape(-1,2)
+        self.velocities = np.array(velocities, dtype=float).reshape(-1,2)
+        self.velocities[ np.any( np.isnan(self.velocities), axis=1 ) ] = 0.
+        n = len(self.ids)
+        self.is_gk = self.ids == GKid
+        self.inframe = ~np.any( np.isnan(self.positions), axis=1 )
+        if inframe is not None:
+            self.inframe &= inframe
+        self.vmax = np.full( n, float(params['max_player_speed']) )
+        self.reaction_time = np.full( n, float(params['reaction_time']) )
+        self.tti_sigma = np.full( n, float(params['tti_sigma']) )
+        self.lambda_att = np.full( n, float(params['lambda_att']) )
+        self.lambda_def = np.where( self.is_gk, params['lambda_gk'], params['lambda_def'] ).astype(float)
+        for name in self.__slots__[1:]:
+            getattr(self, name).flags.writeable = False
+
+    def __len__(self):
+        # number of players on the pitch
+        return int(self.inframe.sum())
+
+    def restrict(self, keep):
+        # copy of the team state with only the players in boolean array 'keep' still on the pitch
+        state = object.__new__(TeamState)
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        state.inframe = self.inframe & keep
+        state.inframe.flags.writeable = False
+        return state
+
+    def arrays(self, attacking=True):
+        # PlayerArrays of the players on the pitch, with lambda_att (attacking) or lambda_def (defending)
+        return PlayerArrays(
+            positions = self.positions[self.inframe],
+            velocities = self.velocities[self.inframe],
+            vmax = self.vmax[self.inframe],
+            reaction_time = self.reaction_time[self.inframe],
+            tti_sigma = self.tti_sigma[self.inframe],
+            lambda_ = (self.lambda_att if attacking else self.lambda_def)[self.inframe],
+        )
+
+    def players(self, params):
+        # list of player objects of the players on the pitch (what initialise_players returns for the same frame)
+        row = {}
+        for pid, position, velocity in zip(self.ids[self.inframe], self.positions[self.inframe], self.velocities[self.inframe]):
+            name = "%s_%s_" % (self.teamname, pid)
+            row.update( {name+'x': position[0], name+'y': position[1], name+'vx': velocity[0], name+'vy': velocity[1]} )
+        GKid = self.ids[self.is_gk][0] if self.is_gk.any() else None
+        return [ player(pid, row, self.teamname, params, GKid) for pid in self.ids[self.inframe] ]
+
+    def remove_offside(self, defending, ball_position, GK_numbers, verbose=False, tol=0.2):
+        # check_offsides for team states: this (attacking) team state without the players that are offside
+        defending_GK_id = GK_numbers[1] if self.teamname=='Team_A' else GK_numbers[0]
+        on_pitch = defending.ids[defending.inframe]
+        assert defending_GK_id in on_pitch, "Defending goalkeeper jersey number not found in defending players"
+        # use defending goalkeeper x position to figure out which half he is defending (-1: left goal, +1: right goal)
+        defending_half = np.sign( defending.positions[defending.inframe][on_pitch==defending_GK_id][0,0] )
+        # offside line: maximum of the second-deepest defending player (including GK), ball position and half-way line
+        second_deepest_defender_x = np.sort( defending_half*defending.positions[defending.inframe,0] )[::-1][1]
+        offside_line = max(second_deepest_defender_x,defending_half*ball_position[0],0.0)+tol
+        # NaN positions (players not on the pitch) compare False and stay off the pitch
+        onside = ~( self.positions[:,0]*defending_half > offside_line )
+        if verbose:
+            for pid in self.ids[self.inframe & ~onside]:
+                print("player %s in %s team is offside" % (pid, "%s_%s_" % (self.teamname, pid)) )
+        return self.restrict(onside)
+
+
+def initialise_team_state(team, teamname, params, GKid):
+    # TeamState of 'teamname' from a row of the team tracking DataFrame (the array version of initialise_players).
+    # x, y, vx and vy of all players are read with a single lookup of their column positions (see IO.TrackingSchema)
+    schema = IO.tracking_schema(team)
+    player_ids = schema.ids[ schema.players(teamname) ]
+    if isinstance(team, pd.Series):
+        values = team.to_numpy()[ np.concatenate( [ schema.positions(c, teamname) for c in ('x','y','vx','vy') ] ) ]
+    else:
+        values = team[ [ name for c in ('x','y','vx','vy') for name in schema.names(c, teamname) ] ]
+    x, y, vx, vy = np.asarray(values, dtype=float).reshape(4,-1)
+    return TeamState(teamname, player_ids, np.column_stack([x,y]), np.column_stack([vx,vy]), params, GKid)
+
+
 def default_model_params(time_to_control_veto=3):
     # key parameters for the model, as described in Spearman 2018
     params = {}
@@ -128,6 +487,8 @@ def default_model_params(time_to_control_veto=3):
     return params
 
 def check_offsides( attacking_players, defending_players, ball_position, GK_numbers, verbose=False, tol=0.2):
+    if isinstance(attacking_players, TeamState):
+        return attacking_players.remove_offside(defending_players, ball_position, GK_numbers, verbose=verbose, tol=tol)
     # find jersey number of defending goalkeeper (just to establish attack direction)
     defending_GK_id = GK_numbers[1] if attacking_players[0].teamname=='Team_A' else GK_numbers[0]
     # make sure defending goalkeeper is actually on the field!
@@ -200,4 +561,246 @@ def calculate_pitch_control_at_target(target_position, attacking_players, defend
             i += 1
         if i>=dT_array.size:
             print("Integration failed to converge: %1.3f" % (ptot) )
-        return PPCFatt[i-1], PPCFdef[i-1]
\ No newline at end of file
+        return PPCFatt[i-1], PPCFdef[i-1]
+
+
+# attributes of a set of players stacked into arrays (one row per player), as used by the vectorized model
+PlayerArrays = namedtuple('PlayerArrays', ['positions', 'velocities', 'vmax', 'reaction_time', 'tti_sigma', 'lambda_'])
+
+
+def players_to_arrays(players, attacking=True):
+    # stack the attributes of a list of player objects (or a TeamState) into a PlayerArrays for the vectorized model.
+    # The ball control parameter is lambda_att for the attacking team and lambda_def for the defending team
+    if isinstance(players, TeamState):
+        return players.arrays(attacking)
+    return PlayerArrays(
+        positions = np.array( [p.position for p in players], dtype=float ).reshape(-1,2),
+        velocities = np.array( [p.velocity for p in players], dtype=float ).reshape(-1,2),
+        vmax = np.array( [p.vmax for p in players], dtype=float ),
+        reaction_time = np.array( [p.reaction_time for p in players], dtype=float ),
+        tti_sigma = np.array( [p.tti_sigma for p in players], dtype=float ),
+        lambda_ = np.array( [p.lambda_att if attacking else p.lambda_def for p in players], dtype=float ),
+    )
+
+
+def simple_time_to_intercept_array(positions, velocities, vmax, reaction_time, target_positions):
+    # vectorized version of player.simple_time_to_intercept: returns a (players x targets) array of arrival times
+    r_reaction = positions + velocities*reaction_time[:,None]
+    distance = np.linalg.norm( target_positions[None,:,:] - r_reaction[:,None,:], axis=2 )
+    return reaction_time[:,None] + distance/vmax[:,None]
+
+
+def calculate_pitch_control_at_targets(target_positions, attacking_players, defending_players, ball_start_pos, params):
+    # vectorized version of calculate_pitch_control_at_target: evaluates the model at every row of 'target_positions' (N x 2)
+    # at once. Equation 3 of Spearman 2018 is integrated for all contested targets simultaneously, and targets drop out
+    # of the integration as soon as they have converged.
+    return calculate_pitch_control_from_arrays(target_positions, players_to_arrays(attacking_players, attacking=True), players_to_arrays(defending_players, attacking=False), ball_start_pos, params)
+
+
+def calculate_pitch_control_from_arrays(target_positions, attacking, defending, ball_start_pos, params, return_margin=False):
+    # calculate_pitch_control_at_targets for players given as PlayerArrays. With return_margin=True the time-to-control
+    # margin of each target is also returned: targets with margin>=0 are decided by the short-cut (one team arrives
+    # significantly earlier), and the margin is how much (in seconds) arrival times can change before that is no longer true.
+    target_positions = np.asarray(target_positions, dtype=float).reshape(-1,2)
+    n_targets = target_positions.shape[0]
+    PPCFatt = np.zeros(n_targets)
+    PPCFdef = np.zeros(n_targets)
+    margin = np.full(n_targets, -np.inf)
+    if n_targets==0:
+        return (PPCFatt, PPCFdef, margin) if return_margin else (PPCFatt, PPCFdef)
+    # ball travel time from start position to each target position
+    if ball_start_pos is None or any(np.isnan(ball_start_pos)): # assume that ball is already at location
+        ball_travel_time = np.zeros(n_targets)
+    else:
+        ball_travel_time = np.linalg.norm( target_positions - np.asarray(ball_start_pos, dtype=float), axis=1 )/params['average_ball_speed']
+
+    # arrival time of every player at every target (players x targets)
+    tti_att = simple_time_to_intercept_array(attacking.positions, attacking.velocities, attacking.vmax, attacking.reaction_time, target_positions)
+    tti_def = simple_time_to_intercept_array(defending.positions, defending.velocities, defending.vmax, defending.reaction_time, target_positions)
+    PPCFatt, PPCFdef, margin = integrate_pitch_control(tti_att, tti_def, ball_travel_time, attacking.tti_sigma[:,None], defending.tti_sigma[:,None], attacking.lambda_[:,None], defending.lambda_[:,None], params)
+    return (PPCFatt, PPCFdef, margin) if return_margin else (PPCFatt, PPCFdef)
+
+
+def integrate_pitch_control(tti_att, tti_def, ball_travel_time, att_sigma, def_sigma, att_lambda, def_lambda, params):
+    # short-cut and integration of equation 3 of Spearman 2018 for N independent targets, given the (players x N) arrival
+    # times of the attacking and defending players. tti_sigma and lambda of the players are (players x 1) or (players x N)
+    # arrays. Arrival times may be inf (or NaN) for players that do not take part at a target. Returns PPCFatt, PPCFdef
+    # and the time-to-control margin (see calculate_pitch_control_from_arrays) of every target.
+    tti_att = np.where( np.isnan(tti_att), np.inf, tti_att )
+    tti_def = np.where( np.isnan(tti_def), np.inf, tti_def )
+    n_targets = tti_att.shape[1]
+    PPCFatt = np.zeros(n_targets)
+    PPCFdef = np.zeros(n_targets)
+    tau_min_att = np.min( tti_att, axis=0, initial=np.inf )
+    tau_min_def = np.min( tti_def, axis=0, initial=np.inf )
+
+    # targets where one team arrives significantly before the other do not need equation 3 to be solved
+    defence_margin = tau_min_att-np.maximum(ball_travel_time,tau_min_def) - params['time_to_control_def']
+    attack_margin = tau_min_def-np.maximum(ball_travel_time,tau_min_att) - params['time_to_control_att']
+    margin = np.maximum( defence_margin, attack_margin )
+    defence_wins = defence_margin >= 0
+    attack_wins = ~defence_wins & ( attack_margin >= 0 )
+    PPCFdef[defence_wins] = 1.
+    PPCFatt[attack_wins] = 1.
+    contested = np.flatnonzero( ~(defence_wins | attack_wins) )
+    if contested.size==0:
+        return PPCFatt, PPCFdef, margin
+
+    # only consider players that are not far (in time) from each contested target
+    tti_att = tti_att[:,contested]
+    tti_def = tti_def[:,contested]
+    att_mask = (tti_att-tau_min_att[contested]) < params['time_to_control_att']
+    def_mask = (tti_def-tau_min_def[contested]) < params['time_to_control_def']
+    # fold the per-player constants into a single factor so that the inner loop is a handful of array operations
+    att_scale = np.pi/np.sqrt(3.0)/_target_columns(att_sigma, contested)
+    def_scale = np.pi/np.sqrt(3.0)/_target_columns(def_sigma, contested)
+    att_gain = np.where( att_mask, _target_columns(att_lambda, contested), 0. )*params['int_dt']
+    def_gain = np.where( def_mask, _target_columns(def_lambda, contested), 0. )*params['int_dt']
+
+    # set up integration (same time steps as the dT_array of calculate_pitch_control_at_target)
+    n_steps = np.arange(-params['int_dt'],params['max_int_time'],params['int_dt']).size
+    T0 = ball_travel_time[contested]-params['int_dt']
+    att_player_PPCF = np.zeros_like( tti_att )
+    def_player_PPCF = np.zeros_like( tti_def )
+    att_total = np.zeros( contested.size )
+    def_total = np.zeros( contested.size )
+    active = np.arange( contested.size ) # targets that have not yet converged
+    i = 1
+    while active.size>0 and i<n_steps:
+        T = T0[active] + i*params['int_dt']
+        remaining = 1-att_total[active]-def_total[active]
+        # ball control probability for each player in time interval T+dt (Eq 3 in Spearman 2018)
+        f_att = 1/(1. + np.exp( -_target_columns(att_scale, active)*(T-tti_att[:,active]) ) )
+        f_def = 1/(1. + np.exp( -_target_columns(def_scale, active)*(T-tti_def[:,active]) ) )
+        att_player_PPCF[:,active] += remaining*f_att*att_gain[:,active]
+        def_player_PPCF[:,active] += remaining*f_def*def_gain[:,active]
+        att_total[active] = att_player_PPCF[:,active].sum(axis=0)
+        def_total[active] = def_player_PPCF[:,active].sum(axis=0)
+        # drop targets that have converged
+        active = active[ 1-att_total[active]-def_total[active] > params['model_converge_tol'] ]
+        i += 1
+    if active.size>0:
+        print("Integration failed to converge at %d target(s): min ptot = %1.3f" % (active.size, np.min(att_total[active]+def_total[active])) )
+    PPCFatt[contested] = att_total
+    PPCFdef[contested] = def_total
+    return PPCFatt, PPCFdef, margin
+
+
+def _target_columns(values, columns):
+    # select target columns of a (players x 1) or (players x N) parameter array
+    return values if values.shape[1]==1 else values[:,columns]
+
+
+def stack_player_arrays(player_arrays):
+    # stack the PlayerArrays of several independent queries (e.g. the players at the moment of every pass) into one
+    # PlayerArrays with a leading query axis: positions/velocities are (queries x players x 2) and the other fields
+    # (queries x players). Queries with fewer players are padded with players at NaN positions, which take no part.
+    n_players = max( [len(p.vmax) for p in player_arrays], default=0 )
+    stacked = PlayerArrays(
+        positions = np.full( (len(player_arrays), n_players, 2), np.nan ),
+        velocities = np.zeros( (len(player_arrays), n_players, 2) ),
+        vmax = np.ones( (len(player_arrays), n_players) ),
+        reaction_time = np.zeros( (len(player_arrays), n_players) ),
+        tti_sigma = np.ones( (len(player_arrays), n_players) ),
+        lambda_ = np.zeros( (len(player_arrays), n_players) ),
+    )
+    for q, players in enumerate(player_arrays):
+        n = len(players.vmax)
+        for field in PlayerArrays._fields:
+            getattr(stacked, field)[q,:n] = getattr(players, field)
+    return stacked
+
+
+def calculate_pitch_control_for_queries(target_positions, ball_start_positions, attacking, defending, params, backend='auto'):
+    # pitch control at many independent single points in one call: query q is the target target_positions[q] for a ball
+    # played from ball_start_positions[q] (NaN: ball already at the target) with its own players attacking[q] and
+    # defending[q]. The players are given as a list of PlayerArrays (one per query) or as stacked PlayerArrays
+    # (stack_player_arrays). Returns PPCFatt, PPCFdef arrays that agree with calculate_pitch_control_at_target within
+    # the integration tolerance. backend is 'numpy', 'numba' (requires numba) or 'auto' (numba when it is installed).
+    target_positions = np.asarray(target_positions, dtype=float).reshape(-1,2)
+    ball_start_positions = np.broadcast_to( np.asarray(ball_start_positions, dtype=float), target_positions.shape )
+    if not isinstance(attacking, PlayerArrays):
+        attacking = stack_player_arrays(attacking)
+    if not isinstance(defending, PlayerArrays):
+        defending = stack_player_arrays(defending)
+    if backend=='auto':
+        backend = 'numpy' if numba is None else 'numba'
+    # ball travel time and arrival time of every player of every query (queries x players)
+    ball_travel_time = np.linalg.norm( target_positions - ball_start_positions, axis=1 )/params['average_ball_speed']
+    ball_travel_time[ np.isnan(ball_travel_time) ] = 0.
+    tti_att = query_time_to_intercept(attacking, target_positions)
+    tti_def = query_time_to_intercept(defending, target_positions)
+    if backend=='numpy':
+        PPCFatt, PPCFdef, _ = integrate_pitch_control(tti_att.T, tti_def.T, ball_travel_time, attacking.tti_sigma.T, defending.tti_sigma.T, attacking.lambda_.T, defending.lambda_.T, params)
+    elif backend=='numba':
+        assert numba is not None, "backend 'numba' requires the numba package"
+        n_steps = np.arange(-params['int_dt'],params['max_int_time'],params['int_dt']).size
+        PPCFatt, PPCFdef = _integrate_pitch_control_queries(tti_att, tti_def, ball_travel_time, attacking.tti_sigma, defending.tti_sigma, attacking.lambda_, defending.lambda_,
+                                                            float(params['int_dt']), n_steps, float(params['model_converge_tol']), float(params['time_to_control_att']), float(params['time_to_control_def']))
+        failed = 1-PPCFatt-PPCFdef > params['model_converge_tol']
+        if failed.any():
+            print("Integration failed to converge at %d target(s): min ptot = %1.3f" % (failed.sum(), np.min(PPCFatt[failed]+PPCFdef[failed])) )
+    else:
+        assert False, "Unknown backend '%s' (use 'numpy', 'numba' or 'auto')" % backend
+    return PPCFatt, PPCFdef
+
+
+def query_time_to_intercept(players, target_positions):
+    # (queries x players) arrival times of stacked PlayerArrays at one target per query (NaN for padded players)
+    r_reaction = players.positions + players.velocities*players.reaction_time[:,:,None]
+    distance = np.linalg.norm( target_positions[:,None,:] - r_reaction, axis=2 )
+    return players.reaction_time + distance/players.vmax
+
+
+def _integrate_pitch_control_queries(tti_att, tti_def, ball_travel_time, att_sigma, def_sigma, att_lambda, def_lambda, int_dt, n_steps, converge_tol, time_to_control_att, time_to_control_def):
+    # scalar version of integrate_pitch_control over (queries x players) arrays, the loops of
+    # calculate_pitch_control_at_target without player objects. Compiled with numba.njit when numba is installed.
+    n_queries = tti_att.shape[0]
+    PPCFatt = np.zeros(n_queries)
+    PPCFdef = np.zeros(n_queries)
+    att_player_PPCF = np.zeros(tti_att.shape[1])
+    def_player_PPCF = np.zeros(tti_def.shape[1])
+    factor = np.pi/np.sqrt(3.0)
+    for q in range(n_queries):
+        # arrival time of the 'nearest' player of each team (NaN arrival times never compare smaller)
+        tau_min_att = np.inf
+        for p in range(tti_att.shape[1]):
+            if tti_att[q,p] < tau_min_att:
+                tau_min_att = tti_att[q,p]
+        tau_min_def = np.inf
+        for p in range(tti_def.shape[1]):
+            if tti_def[q,p] < tau_min_def:
+                tau_min_def = tti_def[q,p]
+        if tau_min_att-max(ball_travel_time[q],tau_min_def) >= time_to_control_def:
+            PPCFdef[q] = 1.
+            continue
+        elif tau_min_def-max(ball_travel_time[q],tau_min_att) >= time_to_control_att:
+            PPCFatt[q] = 1.
+            continue
+        att_player_PPCF[:] = 0.
+        def_player_PPCF[:] = 0.
+        att_total = 0.
+        def_total = 0.
+        i = 1
+        while 1-att_total-def_total > converge_tol and i < n_steps:
+            T = ball_travel_time[q] - int_dt + i*int_dt
+            remaining = 1-att_total-def_total
+            att_total = 0.
+            for p in range(tti_att.shape[1]):
+                if tti_att[q,p]-tau_min_att < time_to_control_att:
+                    att_player_PPCF[p] += remaining/(1. + np.exp( -factor/att_sigma[q,p]*(T-tti_att[q,p]) ))*att_lambda[q,p]*int_dt
+                    att_total += att_player_PPCF[p]
+            def_total = 0.
+            for p in range(tti_def.shape[1]):
+                if tti_def[q,p]-tau_min_def < time_to_control_def:
+                    def_player_PPCF[p] += remaining/(1. + np.exp( -factor/def_sigma[q,p]*(T-tti_def[q,p]) ))*def_lambda[q,p]*int_dt
+                    def_total += def_player_PPCF[p]
+            i += 1
+        PPCFatt[q] = att_total
+        PPCFdef[q] = def_total
+    return PPCFatt, PPCFdef
+
+
+if numba is not None:
+    # the compiled kernel is only cached on disk when NUMBA_CACHE_DIR is set, so nothing is written next to the sources
+    _integrate_pitch_control_queries = numba.njit(cache=bool(os.environ.get('NUMBA_CACHE_DIR')))(_integrate_pitch_control_queries)
@@ -0,0 +1,154 @@
+import os
+import numpy as np
+import pandas as pd
+import pitchcontrol as pc
+
+
+def generate_pitch_control_series(store, params, attacking_team='Team_A', step=1, frame_range=None, field_dimen=(105.,68.,), n_grid_cells_x=50, warm_start=True):
+    '''
+    Pitch control surface of every 'step'th frame of a match (MatchTracking store), generated one frame at a time.
+
+    Yields (frame_id, PPCFa, stats) where PPCFa is the (n_grid_cells_y, n_grid_cells_x) pitch control surface of
+    'attacking_team' and stats a dictionary of summary statistics (area controlled by each team, area controlled in the
+    final third, number of cells that were evaluated). The ball is assumed to be played from its current position.
+
+    With warm_start=True, a cell that was decided by the time-to-control short-cut in the previous sampled frame is not
+    evaluated again if no player (or the ball) has moved enough since to change the short-cut decision.
+    '''
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    xgrid, ygrid = pc.grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    target_positions = np.column_stack( [xx.ravel(), yy.ravel()] )
+    cell_area = (field_dimen[0]/n_grid_cells_x) * (field_dimen[1]/n_grid_cells_y)
+
+    defending_team = 'Team_B' if attacking_team=='Team_A' else 'Team_A'
+    attacking_players = store.team_players(attacking_team)
+    defending_players = store.team_players(defending_team)
+    # goalkeepers of every frame (see MatchTracking.goalkeepers) and direction of play of the attacking team in each period
+    attacking_gk = store.goalkeepers(attacking_team)
+    defending_gk = store.goalkeepers(defending_team)
+    period_direction = {}
+
+    start, stop = (0, store.n_frames) if frame_range is None else (store.row(frame_range[0]), store.row(frame_range[1])+1)
+    previous = None
+    for row in range(start, stop, step):
+        period = store.period[row].item()
+        if period not in period_direction and attacking_gk[row] >= 0:
+            # +1 if the attacking team plays left->right in this period (see io.find_playing_direction)
+            period_direction[period] = -np.sign( store.positions[row, attacking_gk[row], 0] )
+        attack_ids, attack = frame_player_arrays(store, row, attacking_players, attacking_gk[row], params, attacking=True)
+        defend_ids, defend = frame_player_arrays(store, row, defending_players, defending_gk[row], params, attacking=False)
+        ball = np.asarray( store.ball[row], dtype=float )
+
+        PPCFa, PPCFd, _, n_computed, previous = warm_start_step(previous if warm_start else None, attack_ids, attack, defend_ids, defend, ball, target_positions, params)
+        stats = frame_stats(PPCFa, PPCFd, target_positions, cell_area, period_direction.get(period, 1.), field_dimen,
+                            store.frame_ids[row], period, store.time[row], n_computed)
+        yield stats['frameID'], PPCFa.reshape( len(ygrid), len(xgrid) ), stats
+
+
+def warm_start_step(previous, attack_ids, attack, defend_ids, defend, ball, target_positions, params):
+    '''
+    Pitch control at 'target_positions' for one frame, warm-started from the state of the previous frame ('previous',
+    None for a cold start): a target that was decided by the time-to-control short-cut in the previous frame keeps its
+    value if no player (or the ball) has moved enough since to change the short-cut decision, every other target is
+    evaluated. The players of both frames must be the same (attack_ids, defend_ids), otherwise all targets are
+    evaluated. Returns (PPCFa, PPCFd, margin, n_computed, state), where state is the 'previous' of the next frame
+    '''
+    n_targets = len(target_positions)
+    reuse = np.zeros( n_targets, dtype=bool )
+    if previous is not None and np.array_equal(attack_ids, previous['attack_ids']) and np.array_equal(defend_ids, previous['defend_ids']):
+        # largest possible change in time-to-control margin since the previous frame
+        bound = ( max_arrival_time_change(previous['attack'], attack) + max_arrival_time_change(previous['defend'], defend)
+                 + np.linalg.norm(ball-previous['ball'])/params['average_ball_speed'] )
+        if np.isfinite(bound):
+            reuse = previous['margin'] >= bound
+    PPCFa = np.empty( n_targets )
+    PPCFd = np.empty( n_targets )
+    margin = np.empty( n_targets )
+    if reuse.any():
+        PPCFa[reuse] = previous['PPCFa'][reuse]
+        PPCFd[reuse] = previous['PPCFd'][reuse]
+        margin[reuse] = previous['margin'][reuse] - bound
+    compute = ~reuse
+    PPCFa[compute], PPCFd[compute], margin[compute] = pc.calculate_pitch_control_from_arrays(target_positions[compute], attack, defend, ball, params, return_margin=True)
+    state = {'attack_ids': attack_ids, 'defend_ids': defend_ids, 'attack': attack, 'defend': defend, 'ball': ball,
+             'PPCFa': PPCFa, 'PPCFd': PPCFd, 'margin': margin}
+    return PPCFa, PPCFd, margin, int(compute.sum()), state
+
+
+def frame_stats(PPCFa, PPCFd, target_positions, cell_area, direction, field_dimen, frame_id, period, time, n_computed):
+    # summary statistics of the pitch control of one frame: area controlled by each team and in the final third of
+    # the attacking team ('direction' +1 if it plays left->right) and number of cells that were evaluated
+    final_third = target_positions[:,0]*direction > field_dimen[0]/6.
+    own_third = target_positions[:,0]*direction < -field_dimen[0]/6.
+    return {
+        'frameID': int(frame_id),
+        'Period': period,
+        'Time [s]': float(time),
+        'attacking_area': float(PPCFa.sum()*cell_area),
+        'defending_area': float(PPCFd.sum()*cell_area),
+        'attacking_final_third_area': float(PPCFa[final_third].sum()*cell_area),
+        'defending_final_third_area': float(PPCFd[own_third].sum()*cell_area),
+        'cells_computed': int(n_computed),
+    }
+
+
+def frame_player_arrays(store, row, players, gk, params, attacking):
+    # ids and PlayerArrays of the players of one team that are on the pitch in a frame, read straight from the store
+    positions = np.asarray( store.positions[row, players], dtype=float )
+    velocities = np.asarray( store.velocities[row, players], dtype=float )
+    inframe = ~np.any( np.isnan(positions), axis=1 )
+    velocities[ np.any( np.isnan(velocities), axis=1 ) ] = 0.
+    ids = players[inframe]
+    n = len(ids)
+    if attacking:
+        lambda_ = np.full( n, params['lambda_att'] )
+    else:
+        lambda_ = np.where( ids==gk, params['lambda_gk'], params['lambda_def'] )
+    return ids, pc.PlayerArrays(
+        positions = positions[inframe],
+        velocities = velocities[inframe],
+        vmax = np.full( n, params['max_player_speed'] ),
+        reaction_time = np.full( n, params['reaction_time'] ),
+        tti_sigma = np.full( n, params['tti_sigma'] ),
+        lambda_ = lambda_,
+    )
+
+
+def max_arrival_time_change(previous, current):
+    # upper bound on the change of any player's time to intercept (at any target) between two frames: the arrival time
+    # depends on the target only through the distance to the player's position after 'reaction_time' seconds
+    r_previous = previous.positions + previous.velocities*previous.reaction_time[:,None]
+    r_current = current.positions + current.velocities*current.reaction_time[:,None]
+    if len(r_current)==0:
+        return 0.
+    return np.max( np.linalg.norm(r_current-r_previous, axis=1)/current.vmax )
+
+
+def write_pitch_control_series(store, out_folder, params, attacking_team='Team_A', step=1, frame_range=None, field_dimen=(105.,68.,), n_grid_cells_x=50, warm_start=True, flush_every=250):
+    '''
+    Write the pitch control series of a match to 'out_folder': PPCFa.npy is a (frames, n_grid_cells_y, n_grid_cells_x)
+    float32 array written one frame at a time through np.memmap (and flushed every 'flush_every' frames), frame_ids.npy,
+    xgrid.npy and ygrid.npy describe its axes and summary.csv holds the per frame statistics, which are also returned.
+    '''
+    os.makedirs(out_folder, exist_ok=True)
+    start, stop = (0, store.n_frames) if frame_range is None else (store.row(frame_range[0]), store.row(frame_range[1])+1)
+    n_out = len(range(start, stop, step))
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    surfaces = np.lib.format.open_memmap(os.path.join(out_folder, 'PPCFa.npy'), mode='w+', dtype=np.float32, shape=(n_out, n_grid_cells_y, n_grid_cells_x))
+    summary = []
+    series = generate_pitch_control_series(store, params, attacking_team=attacking_team, step=step, frame_range=frame_range, field_dimen=field_dimen, n_grid_cells_x=n_grid_cells_x, warm_start=warm_start)
+    for i, (frame_id, PPCFa, stats) in enumerate(series):
+        surfaces[i] = PPCFa
+        summary.append(stats)
+        if (i+1) % flush_every == 0:
+            surfaces.flush()
+    surfaces.flush()
+    del surfaces
+    summary = pd.DataFrame(summary)
+    np.save(os.path.join(out_folder, 'frame_ids.npy'), summary['frameID'].to_numpy() if len(summary) else np.zeros(0, dtype=int))
+    xgrid, ygrid = pc.grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+    np.save(os.path.join(out_folder, 'xgrid.npy'), xgrid)
+    np.save(os.path.join(out_folder, 'ygrid.npy'), ygrid)
+    summary.to_csv(os.path.join(out_folder, 'summary.csv'), index=False)
+    return summary
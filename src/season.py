@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+import data_in_out as IO
+import velocities as vl
+
+# one game, prepared the way Project.ipynb does (frame synchronised events, metric coordinates, player velocities)
+Game = namedtuple("Game", ["game_id", "events", "metadata", "tracking_home", "tracking_away", "GK_numbers"])
+
+
+def find_games(fc_twente_folder=IO.FC_TWENTE_FOLDER):
+    '''
+    Ids of all 'Game <id>' folders in fc_twente_folder, sorted
+    '''
+    game_ids = []
+    for name in os.listdir(fc_twente_folder):
+        match = re.fullmatch(r"Game (\d+)", name)
+        if match and os.path.isdir(os.path.join(fc_twente_folder, name)):
+            game_ids.append(int(match.group(1)))
+    return sorted(game_ids)
+
+
+def game_csv_files(fc_twente_folder, game_id):
+    # every csv file of a game that load_game reads
+    game_folder = os.path.join(fc_twente_folder, f"Game {game_id}")
+    players_folder = os.path.join(game_folder, "Players")
+    files = [os.path.join(game_folder, f) for f in ("events.csv", "Metadata.csv") if os.path.exists(os.path.join(game_folder, f))]
+    files += [os.path.join(players_folder, f) for f in sorted(os.listdir(players_folder)) if f.endswith(".csv") and "checkpoint" not in f]
+    return files
+
+
+def load_game(fc_twente_folder, game_id, executor=None, use_cache=True):
+    '''
+    Load and prepare one game. Events, metadata and the tracking data of both teams are read concurrently when an
+    executor (thread pool) is given
+    '''
+    metadata_path = os.path.join(fc_twente_folder, f"Game {game_id}", "Metadata.csv")
+    loads = {
+        "events": lambda: IO.load_fc_twente_data(fc_twente_folder, game_id, mode="load-event", use_cache=use_cache),
+        "metadata": lambda: IO.load_fc_twente_data(fc_twente_folder, game_id, mode="load-metadata", use_cache=use_cache) if os.path.exists(metadata_path) else None,
+        "home": lambda: IO.load_fc_twente_data(fc_twente_folder, game_id, team_id="A", mode="load-team-data", use_cache=use_cache),
+        "away": lambda: IO.load_fc_twente_data(fc_twente_folder, game_id, team_id="B", mode="load-team-data", use_cache=use_cache),
+    }
+    if executor is None:
+        data = {key: load() for key, load in loads.items()}
+    else:
+        futures = {key: executor.submit(load) for key, load in loads.items()}
+        data = {key: future.result() for key, future in futures.items()}
+    events = IO.processing_events_data(data["events"], game_id, fc_twente_folder, use_cache=use_cache)
+    events = IO.to_metric_coordinates(events)
+    tracking_home = vl.calc_player_velocities(IO.to_metric_coordinates(data["home"]))
+    tracking_away = vl.calc_player_velocities(IO.to_metric_coordinates(data["away"]))
+    GK_numbers = [IO.find_goalkeeper(tracking_home), IO.find_goalkeeper(tracking_away)]
+    return Game(game_id, events, data["metadata"], tracking_home, tracking_away, GK_numbers)
+
+
+def _build_csv_cache(csv_path):
+    # process pool task of Season.build_caches: parse a csv file into its binary cache (the data is not sent back)
+    IO.read_csv_cached(csv_path)
+    return csv_path
+
+
+class Season(object):
+    '''
+    All games in an FC Twente folder ('Game <id>' folders), loaded on demand.
+
+    Games are loaded when they are first used and kept in a least-recently-used cache of at most 'max_games' games,
+    so memory stays bounded however many games the season has. Csv files without an up to date binary cache are
+    parsed in a process pool (build_caches), and the files of a game are then read concurrently in a thread pool.
+    load_games() iterates over games while the next game is already being loaded.
+
+    season[game_id] returns the Game, season[game_id, frameID] the (home, away) tracking rows of a frame, and
+    frame_index() the (game_id, frameID) index of every frame of the season.
+    '''
+
+    def __init__(self, fc_twente_folder=IO.FC_TWENTE_FOLDER, game_ids=None, max_games=2, n_threads=8, n_workers=None, use_cache=True):
+        self.fc_twente_folder = fc_twente_folder
+        self.game_ids = find_games(fc_twente_folder) if game_ids is None else list(game_ids)
+        self.max_games = max_games
+        self.n_workers = n_workers
+        self.use_cache = use_cache
+        self._games = OrderedDict()
+        # games being loaded, so that threads asking for the same game wait for one load
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._io = ThreadPoolExecutor(max_workers=n_threads)
+        self._frame_index = None
+
+    def close(self):
+        self._io.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def build_caches(self, game_ids=None):
+        '''
+        Parse every csv file of the games (all games by default) whose binary cache is missing or out of date, in a
+        process pool. Returns the files that were parsed
+        '''
+        game_ids = self.game_ids if game_ids is None else game_ids
+        stale = [f for g in game_ids for f in game_csv_files(self.fc_twente_folder, g) if not IO.csv_cache_valid(f)]
+        n_workers = (os.cpu_count() or 1) if self.n_workers is None else self.n_workers
+        if n_workers <= 1 or len(stale) <= 1:
+            return [_build_csv_cache(f) for f in stale]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(_build_csv_cache, stale))
+
+    def game(self, game_id):
+        '''
+        The Game of game_id, from the cache or loaded. A game is loaded once however many threads ask for it at the
+        same time: the others wait for its load
+        '''
+        with self._lock:
+            if game_id in self._games:
+                self._games.move_to_end(game_id)
+                return self._games[game_id]
+            loading = self._loading.get(game_id)
+            if loading is None:
+                loading = self._loading[game_id] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return loading.result()
+        try:
+            if self.use_cache:
+                self.build_caches([game_id])
+            game = load_game(self.fc_twente_folder, game_id, executor=self._io, use_cache=self.use_cache)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[game_id]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            self._games[game_id] = game
+            self._games.move_to_end(game_id)
+            while len(self._games) > self.max_games:
+                self._games.popitem(last=False)
+            del self._loading[game_id]
+        loading.set_result(game)
+        return game
+
+    def load_games(self, game_ids=None):
+        '''
+        Iterate over the games (all games by default), loading the next game in the background
+        '''
+        game_ids = self.game_ids if game_ids is None else list(game_ids)
+        if self.use_cache:
+            self.build_caches(game_ids)
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            next_game = prefetch.submit(self.game, game_ids[0]) if game_ids else None
+            for i in range(len(game_ids)):
+                game = next_game.result()
+                if i + 1 < len(game_ids):
+                    next_game = prefetch.submit(self.game, game_ids[i + 1])
+                yield game
+
+    def frame_index(self):
+        '''
+        (game_id, frameID) MultiIndex of every frame of the season, read from the frameID column of each Ball.csv
+        '''
+        if self._frame_index is None:
+            paths = [os.path.join(self.fc_twente_folder, f"Game {g}", "Players", "Ball.csv") for g in self.game_ids]
+            frames = list(self._io.map(lambda path: IO.read_csv_cached(path, use_cache=self.use_cache, usecols=["frameID"])["frameID"], paths))
+            self._frame_index = pd.MultiIndex.from_arrays(
+                [pd.Index([g for g, f in zip(self.game_ids, frames) for _ in range(len(f))], dtype=int),
+                 pd.Index(pd.concat(frames, ignore_index=True) if frames else [], dtype=int)],
+                names=["game_id", "frameID"])
+        return self._frame_index
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            game_id, frame_id = key
+            game = self.game(game_id)
+            return game.tracking_home.loc[frame_id], game.tracking_away.loc[frame_id]
+        return self.game(key)
+
+    def tracking(self, teamname="Team_A", game_ids=None):
+        '''
+        Tracking data of a team ('Team_A' or 'Team_B') for several games (all games by default) in one DataFrame
+        indexed by (game_id, frameID). All these games are held in memory at once
+        '''
+        game_ids = self.game_ids if game_ids is None else list(game_ids)
+        tracking = {}
+        for game in self.load_games(game_ids):
+            tracking[game.game_id] = game.tracking_home if teamname == "Team_A" else game.tracking_away
+        return pd.concat(tracking, names=["game_id", "frameID"])
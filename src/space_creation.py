@@ -0,0 +1,186 @@
+import os
+import numpy as np
+import pandas as pd
+import ept
+import pitchcontrol as pc
+import pitchcontrol_series as pcs
+
+
+def possessions(events):
+    '''
+    Possessions of a match from the event data (with 'start_frameID', see io.processing_events_data): a possession is a
+    run of consecutive events of the same team within a period. It lasts from the frame of its first event to the frame
+    of the first event of the next possession. Returns a DataFrame indexed by possession_id with the columns Team,
+    Period, start_frameID and end_frameID (exclusive; None for the last possession of a period)
+    '''
+    events = events.dropna(subset=['start_frameID']).sort_values('start_frameID')
+    new_possession = (events['Team'] != events['Team'].shift()) | (events['period_id'] != events['period_id'].shift())
+    starts = events.loc[new_possession, ['Team', 'period_id', 'start_frameID']]
+    end = starts['start_frameID'].shift(-1).where( starts['period_id'].shift(-1) == starts['period_id'] )
+    table = pd.DataFrame({'Team': starts['Team'].to_numpy(), 'Period': starts['period_id'].to_numpy(),
+                          'start_frameID': starts['start_frameID'].to_numpy().astype(int), 'end_frameID': end.to_numpy()})
+    table.index.name = 'possession_id'
+    return table
+
+
+def leave_one_out_control(tti_att, tti_def, ball_travel_time, attacking, defending, params, PPCFatt=None, PPCFdef=None, att_replacement=None, def_replacement=None):
+    '''
+    Contribution of every player to the control of their own team at N targets: PPCF - PPCF without the player
+    (or, when replacement arrival times are given, with the player's arrival times replaced, e.g. by those of the player
+    frozen at an earlier position). 'tti_att' and 'tti_def' are the (players x N) arrival times of the frame, which are
+    reused for every player.
+
+    The counterfactual is only evaluated where it can differ: a player whose arrival time is at least time_to_control
+    later than the fastest of the other players of their team neither sets the team's arrival time nor takes part in
+    the integration there (see pc.integrate_pitch_control), so the control of both teams is unchanged at those targets.
+    The counterfactuals of all players of a team are integrated together in one call. Returns the (attacking players x N) and (defending players x N) contributions
+    '''
+    if PPCFatt is None or PPCFdef is None:
+        PPCFatt, PPCFdef, _ = pc.integrate_pitch_control(tti_att, tti_def, ball_travel_time, attacking.tti_sigma[:,None], defending.tti_sigma[:,None], attacking.lambda_[:,None], defending.lambda_[:,None], params)
+    tti_att = np.where( np.isnan(tti_att), np.inf, tti_att )
+    tti_def = np.where( np.isnan(tti_def), np.inf, tti_def )
+    contributions = []
+    for team, own, other, replacement, time_to_control in ( ('att', tti_att, tti_def, att_replacement, params['time_to_control_att']),
+                                                          ('def', tti_def, tti_att, def_replacement, params['time_to_control_def']) ):
+        players, targets = own.shape
+        contribution = np.zeros( (players, targets) )
+        if players==0:
+            contributions.append(contribution)
+            continue
+        # fastest arrival time of the other players of the team at every target: the smallest arrival time, or the second
+        # smallest for the player that is the fastest
+        order = np.argsort( own, axis=0 )
+        first = np.take_along_axis( own, order[:1], axis=0 )[0]
+        second = np.take_along_axis( own, order[1:2], axis=0 )[0] if players>1 else np.full( targets, np.inf )
+        # the affected targets of all players are evaluated in a single integration: one column per (player, target)
+        columns, column_player, column_values = [], [], []
+        for i in range(players):
+            others_min = np.where( order[0]==i, second, first )
+            new_row = np.full( targets, np.inf ) if replacement is None else np.where( np.isnan(replacement[i]), np.inf, replacement[i] )
+            affected = np.flatnonzero( (own[i] < others_min + time_to_control) | (new_row < others_min + time_to_control) )
+            columns.append(affected)
+            column_player.append(np.full( affected.size, i ))
+            column_values.append(new_row[affected])
+        columns = np.concatenate(columns)
+        column_player = np.concatenate(column_player)
+        if columns.size:
+            counterfactual = own[:,columns]
+            counterfactual[column_player, np.arange(columns.size)] = np.concatenate(column_values)
+            if team=='att':
+                PPCFatt_cf, _, _ = pc.integrate_pitch_control(counterfactual, other[:,columns], ball_travel_time[columns], attacking.tti_sigma[:,None], defending.tti_sigma[:,None], attacking.lambda_[:,None], defending.lambda_[:,None], params)
+                contribution[column_player, columns] = PPCFatt[columns] - PPCFatt_cf
+            else:
+                _, PPCFdef_cf, _ = pc.integrate_pitch_control(other[:,columns], counterfactual, ball_travel_time[columns], attacking.tti_sigma[:,None], defending.tti_sigma[:,None], attacking.lambda_[:,None], defending.lambda_[:,None], params)
+                contribution[column_player, columns] = PPCFdef[columns] - PPCFdef_cf
+        contributions.append(contribution)
+    return contributions[0], contributions[1]
+
+
+def space_creation_series(store, events, params, xT=None, step=5, mode='remove', freeze_seconds=1., field_dimen=(105.,68.,), n_grid_cells_x=50, GK_numbers=None, fps=25):
+    '''
+    Space each player controls for their team in every 'step'th frame of the possessions of a match (MatchTracking
+    store and events with 'start_frameID'), one frame at a time. The team in possession is the attacking team and the
+    ball is played from its current position.
+
+    mode='remove': contribution of a player = pitch control of the team - pitch control of the team without the player.
+    mode='freeze': the counterfactual player stands still at their position 'freeze_seconds' earlier, so the
+    contribution is what the player's movement over that window gained for the team.
+
+    Yields a DataFrame per frame with one row per player on the pitch: possession_id, frameID, Team, player, in_possession,
+    space (m^2 of pitch control gained) and xT_space (gain weighted by the xT of the cells, for the team in possession
+    only, NaN without xT).
+    '''
+    assert mode in ('remove', 'freeze'), "Unknown mode '%s' (use 'remove' or 'freeze')" % mode
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    xgrid, ygrid = pc.grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    target_positions = np.column_stack( [xx.ravel(), yy.ravel()] )
+    cell_area = (field_dimen[0]/n_grid_cells_x) * (field_dimen[1]/n_grid_cells_y)
+    xT = None if xT is None else ept.as_xt_surface(xT, field_dimen)
+    xT_cells = None if xT is None else {d: xT.values_at(target_positions, d) for d in (1, -1)}
+    freeze_frames = int(round(freeze_seconds*fps))
+
+    players = {team: store.team_players(team) for team in ('Team_A', 'Team_B')}
+    if GK_numbers is None:
+        # goalkeepers of every frame (see MatchTracking.goalkeepers)
+        gk = {team: store.goalkeepers(team) for team in players}
+    else:
+        gk = {team: np.full( store.n_frames, players[team][ list(store.player_ids[players[team]]).index('%s_%s' % (team, GK_numbers[k])) ] ) for k, team in enumerate(('Team_A', 'Team_B'))}
+    period_direction = {}
+
+    for possession_id, possession in possessions(events).iterrows():
+        attacking_team = possession['Team']
+        defending_team = 'Team_B' if attacking_team=='Team_A' else 'Team_A'
+        try:
+            start = store.row(possession['start_frameID'])
+            stop = store.row(possession['end_frameID']) if pd.notna(possession['end_frameID']) else store.n_frames
+        except KeyError:
+            continue
+        for row in range(start, stop, step):
+            period = store.period[row].item()
+            if period != possession['Period']:
+                break
+            if period not in period_direction and gk['Team_A'][row] >= 0:
+                # +1 if Team_A plays left->right in this period (see io.find_playing_direction)
+                period_direction[period] = -np.sign( store.positions[row, gk['Team_A'][row], 0] )
+            direction = period_direction.get(period, 1.) if attacking_team=='Team_A' else -period_direction.get(period, 1.)
+            attack_ids, attack = pcs.frame_player_arrays(store, row, players[attacking_team], gk[attacking_team][row], params, attacking=True)
+            defend_ids, defend = pcs.frame_player_arrays(store, row, players[defending_team], gk[defending_team][row], params, attacking=False)
+            ball = np.asarray( store.ball[row], dtype=float )
+            if np.any( np.isnan(ball) ):
+                ball_travel_time = np.zeros( len(target_positions) )
+            else:
+                ball_travel_time = np.linalg.norm( target_positions - ball, axis=1 )/params['average_ball_speed']
+            # arrival times of the frame, shared by the full surface and every counterfactual
+            tti_att = pc.simple_time_to_intercept_array(attack.positions, attack.velocities, attack.vmax, attack.reaction_time, target_positions)
+            tti_def = pc.simple_time_to_intercept_array(defend.positions, defend.velocities, defend.vmax, defend.reaction_time, target_positions)
+            PPCFatt, PPCFdef, _ = pc.integrate_pitch_control(tti_att, tti_def, ball_travel_time, attack.tti_sigma[:,None], defend.tti_sigma[:,None], attack.lambda_[:,None], defend.lambda_[:,None], params)
+            att_replacement = def_replacement = None
+            if mode=='freeze':
+                # arrival times of the players standing still where they were 'freeze_seconds' earlier (where they are if they were not on the pitch then)
+                earlier = max( row-freeze_frames, start )
+                att_replacement = frozen_time_to_intercept(store, earlier, attack_ids, attack, target_positions)
+                def_replacement = frozen_time_to_intercept(store, earlier, defend_ids, defend, target_positions)
+            att_contribution, def_contribution = leave_one_out_control(tti_att, tti_def, ball_travel_time, attack, defend, params, PPCFatt, PPCFdef, att_replacement, def_replacement)
+            xT_space = np.full( len(attack_ids), np.nan ) if xT is None else att_contribution @ xT_cells[direction]
+            yield pd.DataFrame({
+                'possession_id': possession_id,
+                'frameID': int(store.frame_ids[row]),
+                'Team': [attacking_team]*len(attack_ids) + [defending_team]*len(defend_ids),
+                'player': np.concatenate( [store.player_ids[attack_ids], store.player_ids[defend_ids]] ),
+                'in_possession': np.r_[ np.ones(len(attack_ids), dtype=bool), np.zeros(len(defend_ids), dtype=bool) ],
+                'space': np.r_[ att_contribution.sum(axis=1), def_contribution.sum(axis=1) ]*cell_area,
+                'xT_space': np.r_[ xT_space, np.full(len(defend_ids), np.nan) ],
+            })
+
+
+def frozen_time_to_intercept(store, row, ids, players, target_positions):
+    # (players x targets) arrival times of the players 'ids' standing still at their positions of 'row'
+    positions = np.asarray( store.positions[row, ids], dtype=float )
+    missing = np.any( np.isnan(positions), axis=1 )
+    positions[missing] = players.positions[missing]
+    return pc.simple_time_to_intercept_array(positions, np.zeros_like(positions), players.vmax, players.reaction_time, target_positions)
+
+
+def space_creation_tables(store, events, params, xT=None, step=5, mode='remove', freeze_seconds=1., out_folder=None, fps=25, **kwargs):
+    '''
+    Per player per possession space creation of a full match (see space_creation_series for the arguments): the mean
+    'space' and 'xT_space' per sampled frame of every player in every possession, the number of frames and
+    'space_seconds' (space integrated over the possession time, m^2 s). Also returns the totals per player over the
+    match. With out_folder the tables are written to player_possessions.csv and players.csv.
+    '''
+    frames = list(space_creation_series(store, events, params, xT=xT, step=step, mode=mode, freeze_seconds=freeze_seconds, fps=fps, **kwargs))
+    columns = ['possession_id', 'frameID', 'Team', 'player', 'in_possession', 'space', 'xT_space']
+    frames = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    seconds_per_frame = step/float(fps)
+    grouped = frames.groupby(['possession_id', 'player'], sort=True)
+    per_possession = grouped.agg(Team=('Team', 'first'), in_possession=('in_possession', 'first'), frames=('frameID', 'size'),
+                                 space=('space', 'mean'), xT_space=('xT_space', 'mean'))
+    per_possession['space_seconds'] = grouped['space'].sum()*seconds_per_frame
+    per_player = frames.groupby(['player', 'in_possession'], sort=True).agg(frames=('frameID', 'size'), space=('space', 'mean'), xT_space=('xT_space', 'mean'))
+    per_player['space_seconds'] = frames.groupby(['player', 'in_possession'], sort=True)['space'].sum()*seconds_per_frame
+    if out_folder is not None:
+        os.makedirs(out_folder, exist_ok=True)
+        per_possession.to_csv(os.path.join(out_folder, 'player_possessions.csv'))
+        per_player.to_csv(os.path.join(out_folder, 'players.csv'))
+    return per_possession, per_player
@@ -0,0 +1,258 @@
+import asyncio
+import time
+from collections import namedtuple
+import numpy as np
+import data_in_out as IO
+import ept
+import pitchcontrol as pc
+import pitchcontrol_series as pcs
+import tracking
+import velocities as vl
+
+# one frame of a live tracking feed. positions: (players, 2) metric positions of the players in 'player_ids' (NaN when a
+# player is not on the pitch), ball: (x, y), received: time.perf_counter() when the frame arrived (latency is measured from it)
+Frame = namedtuple('Frame', ['frame_id', 'period', 'time', 'player_ids', 'positions', 'ball', 'received'])
+
+# result of one frame. PPCFa is the pitch control surface of the attacking team (None when the frame was skipped)
+StreamResult = namedtuple('StreamResult', ['frame_id', 'PPCFa', 'stats', 'latency'])
+
+
+class ReplaySource(object):
+    '''
+    Plays back the tracking data of a 'Game N' folder as if it was a live feed, for testing the streaming model
+    without one. Frames are emitted at 'fps' frames per second times 'speed' (speed=None: as fast as possible), one at
+    a time or in lists of 'batch_size' frames. Iterate over the source, or use feed() to put the frames on an asyncio
+    queue. Only positions are sent: velocities have to be computed from the stream, as for a real feed.
+    '''
+
+    def __init__(self, fc_twente_folder=IO.FC_TWENTE_FOLDER, game_id=1, frame_range=None, speed=1.0, fps=25, batch_size=1):
+        self.store = tracking.MatchTracking.from_game(fc_twente_folder, game_id)
+        self.start, self.stop = (0, self.store.n_frames) if frame_range is None else (self.store.row(frame_range[0]), self.store.row(frame_range[1])+1)
+        self.speed = speed
+        self.fps = fps
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def frame(self, row):
+        store = self.store
+        return Frame(int(store.frame_ids[row]), store.period[row].item(), float(store.time[row]), store.player_ids,
+                     np.asarray(store.positions[row], dtype=float), np.asarray(store.ball[row], dtype=float), time.perf_counter())
+
+    def _schedule(self):
+        # (delay until the batch is due, rows of the batch)
+        t0 = time.perf_counter()
+        for start in range(self.start, self.stop, self.batch_size):
+            rows = range(start, min(start+self.batch_size, self.stop))
+            due = 0. if self.speed is None else (rows[-1]-self.start)/(self.fps*self.speed)
+            yield t0 + due - time.perf_counter(), rows
+
+    def _emit(self, rows):
+        frames = [self.frame(row) for row in rows]
+        return frames if self.batch_size > 1 else frames[0]
+
+    def __iter__(self):
+        for delay, rows in self._schedule():
+            if delay > 0:
+                time.sleep(delay)
+            yield self._emit(rows)
+
+    async def feed(self, queue):
+        # put the frames on 'queue' in real time, followed by None at the end of the replay
+        for delay, rows in self._schedule():
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await queue.put(self._emit(rows))
+        await queue.put(None)
+
+
+class LatencyStats(object):
+    '''
+    Latency (from frame arrival to result) of every processed frame and the number of frames skipped to stay within
+    the latency budget
+    '''
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.latencies = []
+        self.skipped = 0
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        latencies = np.array(self.latencies)
+        summary = {'frames': len(latencies), 'skipped': self.skipped}
+        if len(latencies):
+            for q, value in zip(percentiles, np.percentile(latencies, percentiles)):
+                summary['p%d_ms' % q] = float(1000*value)
+            summary['max_ms'] = float(1000*latencies.max())
+            summary['over_budget'] = float(np.mean(latencies > self.budget))
+        return summary
+
+
+class StreamingPitchControl(object):
+    '''
+    Pitch control of a live feed, updated one frame at a time (see update() and the run_stream / run_queue loops).
+
+    Player velocities are computed incrementally from a short rolling window (vl.RollingVelocities), and the pitch
+    control surface of 'attacking_team' is updated with the warm start of pitchcontrol_series: a cell that was decided
+    by the time-to-control short-cut in the previous frame is not evaluated again while no player (or the ball) moved
+    enough to change that. The ball is assumed to be played from its current position and offsides are ignored.
+
+    Next to the controlled area (as in pitchcontrol_series) the stats of every frame hold xT based summaries when an xT
+    grid (or ept.XTSurface) is given: 'xT_controlled' (sum of xT*PPCF over the grid), 'max_xT_target' (largest xT*PPCF
+    of any cell) and 'ball_xT' (xT at the ball). Frames that are already older than 'latency_budget' seconds when a
+    newer frame is waiting are skipped (only their positions are added to the velocity window).
+    '''
+
+    def __init__(self, params, GK_numbers=None, xT=None, attacking_team='Team_A', field_dimen=(105.,68.,), n_grid_cells_x=50,
+                 latency_budget=0.04, warm_start=True, velocity_window=7, maxspeed=12):
+        self.params = params
+        self.GK_numbers = GK_numbers
+        self.attacking_team = attacking_team
+        self.defending_team = 'Team_B' if attacking_team=='Team_A' else 'Team_A'
+        self.field_dimen = field_dimen
+        self.latency_budget = latency_budget
+        self.warm_start = warm_start
+        self.latency = LatencyStats(latency_budget)
+        self.velocities = vl.RollingVelocities(window=velocity_window, maxspeed=maxspeed)
+
+        n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+        self.xgrid, self.ygrid = pc.grid_cell_centres(field_dimen, n_grid_cells_x, n_grid_cells_y)
+        xx, yy = np.meshgrid(self.xgrid, self.ygrid)
+        self.target_positions = np.column_stack( [xx.ravel(), yy.ravel()] )
+        self.cell_area = (field_dimen[0]/n_grid_cells_x) * (field_dimen[1]/n_grid_cells_y)
+        # xT of every grid cell for both directions of play, looked up once
+        self.xT = None if xT is None else ept.as_xt_surface(xT, field_dimen)
+        self.xT_cells = None if xT is None else {d: self.xT.values_at(self.target_positions, d) for d in (1, -1)}
+
+        self.player_ids = None
+        self.period_direction = {}
+        self.previous = None
+
+    def _set_players(self, player_ids):
+        # team of every player and the player ids as used in GK_numbers (column prefix without the team name)
+        self.player_ids = np.asarray(player_ids)
+        self.teams = np.array([p[:6] for p in self.player_ids])
+        self.ids = np.array([p[7:] for p in self.player_ids])
+        # number of frames each player was the deepest of their team, for the goalkeepers (see IO.goalkeeper_indices)
+        self.deepest_counts = {teamname: np.zeros( np.sum(self.teams == teamname), dtype=int ) for teamname in ('Team_A', 'Team_B')}
+        self.previous = None
+
+    def _goalkeepers(self, positions):
+        # goalkeeper ids of (Team_A, Team_B) in a new frame: given, or IO.goalkeeper_indices over the frames seen so far
+        if self.GK_numbers is not None:
+            return self.GK_numbers
+        GK_numbers = []
+        for teamname in ('Team_A', 'Team_B'):
+            players = np.flatnonzero(self.teams == teamname)
+            x = positions[players, 0][None]
+            deepest = IO.deepest_players(x)[0]
+            if deepest >= 0:
+                self.deepest_counts[teamname][deepest] += 1
+            gk = IO.goalkeeper_indices(x, self.deepest_counts[teamname])[0]
+            GK_numbers.append( self.ids[players[gk]] if gk >= 0 else None )
+        return tuple(GK_numbers)
+
+    def team_state(self, teamname, positions, velocities, GK_numbers):
+        players = self.teams == teamname
+        GKid = GK_numbers[0 if teamname=='Team_A' else 1]
+        return pc.TeamState(teamname, self.ids[players], positions[players], velocities[players], self.params, GKid)
+
+    def update(self, frame, compute=True):
+        '''
+        Add a frame to the stream: returns its StreamResult, or None if compute=False (the frame only updates the
+        velocity window and is counted as skipped)
+        '''
+        if self.player_ids is None or not np.array_equal(self.player_ids, frame.player_ids):
+            self._set_players(frame.player_ids)
+        positions = np.asarray(frame.positions, dtype=float)
+        velocities = self.velocities.update(frame.time, frame.period, positions)
+        if not compute:
+            self.latency.skipped += 1
+            return None
+
+        GK_numbers = self._goalkeepers(positions)
+        attacking = self.team_state(self.attacking_team, positions, velocities, GK_numbers)
+        defending = self.team_state(self.defending_team, positions, velocities, GK_numbers)
+        if frame.period not in self.period_direction:
+            # +1 if the attacking team plays left->right in this period (see io.find_playing_direction)
+            gk_x = attacking.positions[attacking.is_gk, 0]
+            self.period_direction[frame.period] = -np.sign(gk_x[0]) if len(gk_x) and np.isfinite(gk_x[0]) else 1.
+        direction = self.period_direction[frame.period]
+        attack_ids, attack = attacking.ids[attacking.inframe], attacking.arrays(attacking=True)
+        defend_ids, defend = defending.ids[defending.inframe], defending.arrays(attacking=False)
+        PPCFa, PPCFd, _, n_computed, self.previous = pcs.warm_start_step(self.previous if self.warm_start else None, attack_ids, attack, defend_ids, defend,
+                                                                        np.asarray(frame.ball, dtype=float), self.target_positions, self.params)
+        stats = pcs.frame_stats(PPCFa, PPCFd, self.target_positions, self.cell_area, direction, self.field_dimen, frame.frame_id, frame.period, frame.time, n_computed)
+        if self.xT is not None:
+            xT_PPCF = PPCFa*self.xT_cells[direction]
+            stats['xT_controlled'] = float(xT_PPCF.sum())
+            stats['max_xT_target'] = float(xT_PPCF.max())
+            stats['ball_xT'] = self.xT.value_at(frame.ball, direction)
+        latency = time.perf_counter() - frame.received
+        self.latency.add(latency)
+        return StreamResult(stats['frameID'], PPCFa.reshape( len(self.ygrid), len(self.xgrid) ), stats, latency)
+
+    def _is_stale(self, frame, newer_waiting):
+        # skip a frame that is already over the latency budget if a newer frame is waiting
+        return newer_waiting and time.perf_counter() - frame.received > self.latency_budget
+
+
+def run_stream(frames, model):
+    '''
+    Run 'model' (StreamingPitchControl) over an iterator of frames or lists of frames (e.g. a ReplaySource),
+    yielding the StreamResult of every frame that was not skipped
+    '''
+    for item in frames:
+        batch = item if isinstance(item, list) else [item]
+        for i, frame in enumerate(batch):
+            result = model.update(frame, compute=not model._is_stale(frame, i < len(batch)-1))
+            if result is not None:
+                yield result
+
+
+async def run_queue(queue, model, on_result=None):
+    '''
+    Run 'model' (StreamingPitchControl) on the frames (or lists of frames) put on an asyncio queue until None is
+    received. All frames waiting on the queue are taken at once, so that stale frames can be skipped when the model
+    falls behind. The model runs in a worker thread to keep the event loop (and the feed) responsive.
+    on_result(result) is called with every StreamResult. Returns the latency summary of the model.
+    '''
+    loop = asyncio.get_running_loop()
+    done = False
+    while not done:
+        items = [await queue.get()]
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        if None in items:
+            items = items[:items.index(None)]
+            done = True
+        batch = [frame for item in items for frame in (item if isinstance(item, list) else [item])]
+        for i, frame in enumerate(batch):
+            compute = not model._is_stale(frame, i < len(batch)-1)
+            result = await loop.run_in_executor(None, model.update, frame, compute)
+            if result is not None and on_result is not None:
+                on_result(result)
+    return model.latency.summary()
+
+
+def replay_game(fc_twente_folder=IO.FC_TWENTE_FOLDER, game_id=1, params=None, xT=None, attacking_team='Team_A', frame_range=None,
+                speed=1.0, latency_budget=0.04, n_grid_cells_x=50, on_result=None):
+    '''
+    Replay a game through the streaming pitch control model in real time (asyncio feed and consumer) and return the
+    latency summary, e.g. replay_game(folder, 1, xT=ept.load_xT_grid('xT.csv'), frame_range=(f0, f0+250))
+    '''
+    params = pc.default_model_params() if params is None else params
+    source = ReplaySource(fc_twente_folder, game_id, frame_range=frame_range, speed=speed)
+    model = StreamingPitchControl(params, xT=xT, attacking_team=attacking_team, latency_budget=latency_budget, n_grid_cells_x=n_grid_cells_x)
+
+    async def replay():
+        queue = asyncio.Queue()
+        feed = asyncio.ensure_future(source.feed(queue))
+        summary = await run_queue(queue, model, on_result)
+        await feed
+        return summary
+    return asyncio.run(replay())
@@ -0,0 +1,42 @@
+import os
+import sys
+import matplotlib
+matplotlib.use("Agg")
+import pytest
+
+# the modules import each other by their plain names, as when they are run next to the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import data_in_out as IO
+import tracking
+import velocities as vl
+
+
+GAME_ID = 1
+
+
+@pytest.fixture(scope="session")
+def fc_twente_folder(tmp_path_factory):
+    # a small synthetic game in the FC_TWENTE_FOLDER layout (see benchmark.make_synthetic_match)
+    folder = str(tmp_path_factory.mktemp("FC_TWENTE_FOLDER"))
+    benchmark.make_synthetic_match(folder, GAME_ID, n_frames=1500, n_events=30)
+    return folder
+
+
+@pytest.fixture(scope="session")
+def game(fc_twente_folder):
+    # events and tracking data in metric coordinates with velocities, as prepared in Project.ipynb
+    events = IO.to_metric_coordinates(IO.processing_events_data(
+        IO.load_fc_twente_data(fc_twente_folder, GAME_ID, mode="load-event"), GAME_ID, fc_twente_folder))
+    tracking_home = vl.calc_player_velocities(IO.to_metric_coordinates(
+        IO.load_fc_twente_data(fc_twente_folder, GAME_ID, team_id="A", mode="load-team-data")))
+    tracking_away = vl.calc_player_velocities(IO.to_metric_coordinates(
+        IO.load_fc_twente_data(fc_twente_folder, GAME_ID, team_id="B", mode="load-team-data")))
+    GK_numbers = [IO.find_goalkeeper(tracking_home), IO.find_goalkeeper(tracking_away)]
+    return events, tracking_home, tracking_away, GK_numbers
+
+
+@pytest.fixture(scope="session")
+def store(fc_twente_folder):
+    return tracking.MatchTracking.from_game(fc_twente_folder, GAME_ID)
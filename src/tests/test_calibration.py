@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import data_in_out as IO
+import calibration as cal
+import ept
+import pitchcontrol as pc
+
+
+@pytest.fixture(scope='module')
+def states(game):
+    events, tracking_home, tracking_away, GK_numbers = game
+    return cal.pass_states(events, tracking_home, tracking_away, GK_numbers)
+
+
+def test_model_params_recomputes_the_derived_parameters():
+    assert cal.model_params() == pytest.approx(pc.default_model_params())
+    params = cal.model_params({'lambda_att': 5., 'kappa_def': 2., 'lambda_gk_factor': 2.})
+    assert params['lambda_def'] == 10. and params['lambda_gk'] == 20.
+    reference = pc.default_model_params()
+    reference.update(lambda_att=5., kappa_def=2., lambda_def=10., lambda_gk=20.)
+    reference['time_to_control_att'] = 3*np.log(10) * (np.sqrt(3)*reference['tti_sigma']/np.pi + 1/5.)
+    reference['time_to_control_def'] = 3*np.log(10) * (np.sqrt(3)*reference['tti_sigma']/np.pi + 1/10.)
+    assert params == pytest.approx(reference)
+
+
+def test_pass_probabilities_equal_the_point_model(game, states):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = cal.model_params({'max_player_speed': 4., 'reaction_time': 0.5, 'lambda_gk_factor': 2.})
+    home_attack_direction = IO.find_playing_direction(tracking_home, 'Team_A')
+    probabilities = cal.pass_probabilities(states, params, backend='numpy')
+    assert len(states.event_ids) > 0
+    for event_id, start, target, received, p in zip(states.event_ids, states.ball_start, states.target, states.received, probabilities):
+        event = events.loc[event_id]
+        assert received == bool(event['outcome'])
+        _, attacking, defending = ept.initialise_pass_players(event.Team, event['start_frameID'], start, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        PPCFatt, _ = pc.calculate_pitch_control_at_target(target, attacking.players(params), defending.players(params), start, params)
+        assert p == pytest.approx(PPCFatt, abs=1e-9)
+
+
+def test_grid_search_scores_every_parameter_set(states):
+    grid = {'max_player_speed': [4., 5.], 'reaction_time': [0.5, 0.7]}
+    results = cal.grid_search(states, grid, n_workers=1, backend='numpy')
+    assert len(results) == 4
+    assert results['log_likelihood'].is_monotonic_decreasing
+    for _, row in results.iterrows():
+        params = cal.model_params({'max_player_speed': row['max_player_speed'], 'reaction_time': row['reaction_time']})
+        assert row['log_likelihood'] == pytest.approx(cal.log_likelihood(states, params, backend='numpy'))
+    assert np.allclose(results['mean_log_likelihood'], results['log_likelihood']/len(states.received))
+    # the process pool scores the same parameter sets the same way
+    pooled = cal.grid_search(states, grid, n_workers=2, backend='numpy')
+    assert np.allclose(pooled['log_likelihood'], results['log_likelihood'])
+    assert (pooled[list(grid)] == results[list(grid)]).all().all()
+
+
+def test_calibrate_writes_the_best_params(fc_twente_folder, tmp_path):
+    grid = {'max_player_speed': [4., 5.], 'tti_sigma': [0.45]}
+    out_file = str(tmp_path / 'params.json')
+    best, results = cal.calibrate(grid, game_ids=[1], fc_twente_folder=fc_twente_folder, out_file=out_file, n_workers=1, backend='numpy')
+    assert best == pytest.approx(cal.model_params(results.iloc[0][list(grid)].to_dict()))
+    assert cal.load_params(out_file) == pytest.approx(best)
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+import pandas as pd
+import benchmark
+import data_in_out as IO
+
+
+def test_goalkeeper_ignores_missing_positions_in_the_first_frame():
+    x = np.array([[np.nan, 10., 20.],
+                  [-50., 10., 20.],
+                  [-51., 12., 22.],
+                  [-49., 15., 25.]])
+    assert list(IO.goalkeeper_indices(x)) == [2, 0, 0, 0]
+
+
+def test_goalkeeper_follows_a_substitution():
+    # player 0 is replaced in goal by player 3, who comes on in frame 3
+    x = np.array([[-50., 10., 20., np.nan],
+                  [-50., 10., 20., np.nan],
+                  [-50., 10., 20., np.nan],
+                  [np.nan, 10., 20., -50.],
+                  [np.nan, 10., 20., -50.]])
+    assert list(IO.goalkeeper_indices(x)) == [0, 0, 0, 3, 3]
+    assert list(IO.goalkeeper_indices(np.full((2, 3), np.nan))) == [-1, -1]
+
+
+def test_find_goalkeeper_and_store_agree(game, store):
+    _, tracking_home, tracking_away, GK_numbers = game
+    for teamname, GK in zip(('Team_A', 'Team_B'), GK_numbers):
+        goalkeepers = store.goalkeepers(teamname)
+        assert set(store.player_ids[goalkeepers]) == {'%s_%s' % (teamname, GK)}
+
+
+def test_find_goalkeeper_is_the_keeper_at_kick_off():
+    # player 1 starts in goal (missing in the very first frame) and is replaced by player 4 for the second period, who
+    # then is the deepest player in most frames of the match
+    x = np.array([[np.nan, 10., 20., np.nan],
+                  [-50., 10., 20., np.nan],
+                  [-50., 10., 20., np.nan],
+                  [np.nan, 10., 20., -50.],
+                  [np.nan, 10., 20., -50.],
+                  [np.nan, 10., 20., -50.]])
+    team = pd.DataFrame({'Period': [1, 1, 1, 2, 2, 2]})
+    for p in range(4):
+        team['Team_A_Player_%d_x' % (p+1)] = x[:, p]
+        team['Team_A_Player_%d_y' % (p+1)] = 0.
+    assert IO.find_goalkeeper(team) == 'Player_1'
+    assert list(IO.goalkeeper_indices(x)) == [2, 0, 0, 3, 3, 3]
+
+
+def test_cache_read_equals_csv_read(tmp_path):
+    # a new match, so that the first cached read builds the cache
+    fc_twente_folder = str(tmp_path)
+    benchmark.make_synthetic_match(fc_twente_folder, 1, n_frames=300, n_events=10)
+    for mode, team_id in (('load-event', None), ('load-metadata', None), ('load-ball-data', None), ('load-team-data', 'A')):
+        csv = IO.load_fc_twente_data(fc_twente_folder, 1, team_id=team_id, mode=mode, use_cache=False)
+        cold = IO.load_fc_twente_data(fc_twente_folder, 1, team_id=team_id, mode=mode)
+        warm = IO.load_fc_twente_data(fc_twente_folder, 1, team_id=team_id, mode=mode)
+        pd.testing.assert_frame_equal(cold, csv)
+        pd.testing.assert_frame_equal(warm, csv)
+
+
+def test_team_data_without_matching_frames_is_empty(fc_twente_folder, monkeypatch):
+    full = IO.load_team_data(fc_twente_folder, 1, 'A', frame_range=(1000000, 1000010))
+    reads = []
+    read_csv_frames = IO.read_csv_frames
+    monkeypatch.setattr(IO, 'read_csv_frames', lambda path, *args, **kwargs: reads.append(path) or read_csv_frames(path, *args, **kwargs))
+    for kwargs in ({'period': 7}, {'frame_range': (1, 5)}, {'period': 1, 'frame_range': (1, 5)}):
+        reads.clear()
+        empty = IO.load_team_data(fc_twente_folder, 1, 'A', **kwargs)
+        assert len(empty) == 0
+        assert list(empty.columns) == list(full.columns)
+        pd.testing.assert_series_equal(empty.dtypes, full.dtypes)
+        assert empty.index.dtype == full.index.dtype
+        # only Ball.csv is read to find the frames
+        assert [os.path.basename(p) for p in reads] == ['Ball.csv']
+
+
+def test_reads_fall_back_to_the_csv_while_the_cache_is_replaced(tmp_path, monkeypatch):
+    benchmark.make_synthetic_match(str(tmp_path), 1, n_frames=300, n_events=10)
+    csv_path = os.path.join(str(tmp_path), 'Game 1', 'Players', 'Team_A_Player_1.csv')
+    expected = pd.read_csv(csv_path)
+    frames = IO.read_csv_frames(csv_path, frame_range=(1000010, 1000020), use_cache=False)
+    IO.read_csv_cached(csv_path)
+    cache_path = IO.csv_cache_path(csv_path)
+    # a reader that found the manifest of the old cache, which another process then moved aside
+    manifest = IO.read_cache_manifest(cache_path)
+    (tmp_path / 'new').mkdir()
+    assert IO.replace_folder(str(tmp_path / 'new'), cache_path)
+    with monkeypatch.context() as patch:
+        patch.setattr(IO, 'csv_cache_manifest', lambda *args, **kwargs: (manifest, None))
+        pd.testing.assert_frame_equal(IO.read_csv_cached(csv_path), expected)
+        pd.testing.assert_frame_equal(IO.read_csv_frames(csv_path, frame_range=(1000010, 1000020)), frames)
+    # rebuilding the cache swaps the folder in one piece and leaves nothing else behind
+    IO.write_csv_cache(expected, csv_path)
+    pd.testing.assert_frame_equal(IO.read_csv_cached(csv_path), expected, check_dtype=False)
+    assert os.listdir(os.path.dirname(cache_path)) == [os.path.basename(cache_path)]
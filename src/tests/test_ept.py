@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pytest
+import data_in_out as IO
+import ept
+import pitchcontrol as pc
+
+XT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'xT.csv')
+
+
+@pytest.fixture(scope='module')
+def xT():
+    return ept.load_xT_grid(XT_FILE)
+
+
+def test_max_value_added_target_is_evaluated_on_the_xT_grid(game, xT):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    home_attack_direction = IO.find_playing_direction(tracking_home, 'Team_A')
+    surface = ept.as_xt_surface(xT)
+    xgrid, ygrid = pc.grid_cell_centres((105., 68.), xT.shape[1], xT.shape[0])
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    for event_id in events.loc[events['type_name'] == 'Pass'].index:
+        max_added, target = ept.find_max_value_added_target(event_id, events, tracking_home, tracking_away, GK_numbers, xT, params, home_attack_direction=home_attack_direction, verbose=False)
+        # brute force: pitch control at the centre of every xT cell
+        event = events.loc[event_id]
+        start = np.array([event['start_x'], event['start_y']])
+        attack_direction, attacking, defending = ept.initialise_pass_players(event.Team, event['start_frameID'], start, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        PPCF = pc.calculate_pitch_control_at_targets(np.column_stack([xx.ravel(), yy.ravel()]), attacking, defending, start, params)[0].reshape(xx.shape)
+        action_value = surface.oriented(attack_direction)*PPCF
+        best = np.unravel_index(action_value.argmax(), action_value.shape)
+        assert target == pytest.approx((xgrid[best[1]], ygrid[best[0]]))
+        start_value = pc.calculate_pitch_control_at_targets(start, attacking, defending, start, params)[0][0]*surface.value_at(start, attack_direction)
+        assert max_added == pytest.approx(action_value.max() - start_value)
+
+
+def test_xt_surface_equals_grid_lookup(xT):
+    surface = ept.as_xt_surface(xT)
+    rng = np.random.default_rng(0)
+    # points on and off the pitch, including the cell edges
+    positions = np.vstack([np.column_stack([rng.uniform(-56, 56, 500), rng.uniform(-37, 37, 500)]),
+                           [[-52.5, -34.], [52.5, 34.], [0., 0.], [52.5, 0.], [-52.5, 34.]]])
+    for attack_direction in (1, -1):
+        expected = [ept.get_xT_at_location(p, xT, attack_direction) for p in positions]
+        np.testing.assert_array_equal(surface.values_at(positions, attack_direction), expected)
+        assert [surface.value_at(p, attack_direction) for p in positions] == expected
+
+
+def test_failing_batch_only_costs_the_failing_event(game, xT, monkeypatch):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    passes = events.loc[events['type_name'] == 'Pass'].iloc[:6]
+    expected = ept.calculate_action_values_for_events(passes, tracking_home, tracking_away, GK_numbers, xT, params, include_max_target=False, n_workers=1)
+    bad_event = passes.index[2]
+    calculate_action_values_added = ept.calculate_action_values_added
+    def failing(event_ids, *args, **kwargs):
+        # an error the batch does not catch per event
+        if bad_event in list(event_ids):
+            raise RuntimeError('bad frame')
+        return calculate_action_values_added(event_ids, *args, **kwargs)
+    monkeypatch.setattr(ept, 'calculate_action_values_added', failing)
+    values = ept.calculate_action_values_for_events(passes, tracking_home, tracking_away, GK_numbers, xT, params, include_max_target=False, n_workers=1)
+    assert values.loc[bad_event, 'error'] == 'RuntimeError: bad frame'
+    assert np.isnan(values.loc[bad_event, 'action_value_added'])
+    others = passes.index.drop(bad_event)
+    np.testing.assert_allclose(values.loc[others, ['action_value_added', 'xT_difference']].to_numpy(dtype=float),
+                               expected.loc[others, ['action_value_added', 'xT_difference']].to_numpy(dtype=float))
+    assert values.loc[others, 'error'].isna().all() and expected['error'].isna().all()
+
+
+def test_pass_options_equal_the_point_model_along_the_path(game, xT):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    passes = events.loc[events['type_name'] == 'Pass'].iloc[:3]
+    n_path_points = 4
+    options = ept.evaluate_pass_options_for_events(passes, tracking_home, tracking_away, GK_numbers, xT, params, run_on_seconds=1., n_path_points=n_path_points, backend='numpy')
+    home_attack_direction = IO.find_playing_direction(tracking_home, 'Team_A')
+    fractions = np.arange(1, n_path_points+1)/(n_path_points+1.)
+    for event_id, event in passes.iterrows():
+        start = np.array([event['start_x'], event['start_y']])
+        direction, attacking, defending = ept.initialise_pass_players(event['Team'], event['start_frameID'], start, tracking_home, tracking_away, GK_numbers, params, home_attack_direction)
+        att_players, def_players = attacking.players(params), defending.players(params)
+        event_options = options.loc[[event_id]]
+        # every teammate on the pitch but the passer, at their position and run-on point
+        receivers = [p for p in attacking.ids[attacking.inframe] if '%s_%s' % (event['Team'], p) != event['FullName']]
+        assert len(receivers) == attacking.inframe.sum() - 1
+        assert sorted(event_options['player']) == sorted(receivers*2)
+        value_start = pc.calculate_pitch_control_at_target(start, att_players, def_players, start, params)[0]*ept.get_xT_at_location(start, xT, direction)
+        for _, option in event_options.iterrows():
+            target = np.array([option['target_x'], option['target_y']])
+            PPCFatt, _ = pc.calculate_pitch_control_at_target(target, att_players, def_players, start, params)
+            assert option['pitch_control'] == pytest.approx(PPCFatt, abs=1e-12)
+            assert option['xT'] == ept.get_xT_at_location(target, xT, direction)
+            assert option['value_added'] == pytest.approx(PPCFatt*option['xT'] - value_start, abs=1e-12)
+            risk = max(pc.calculate_pitch_control_at_target(start + (target-start)*f, att_players, def_players, start, params)[1] for f in fractions)
+            assert option['interception_risk'] == pytest.approx(risk, abs=1e-12)
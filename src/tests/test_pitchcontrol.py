@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import pitchcontrol as pc
+
+
+@pytest.fixture(scope='module')
+def passes(game):
+    # (ball start, attacking TeamState, defending TeamState) at the first passes of the synthetic match
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    states = []
+    for event_id in events.loc[events['type_name'] == 'Pass'].index[:6]:
+        event = events.loc[event_id]
+        start = np.array([event['start_x'], event['start_y']])
+        attacking, defending = pc.initialise_event_players(event['Team'], event['start_frameID'], start, tracking_home, tracking_away, params, GK_numbers)
+        states.append((event_id, start, attacking, defending))
+    return states
+
+
+def test_vectorized_surface_equals_reference(game, passes):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    for event_id, _, _, _ in passes[:2]:
+        PPCF, xgrid, ygrid = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, n_grid_cells_x=20, verbose=False)
+        # the reference implementation must not be served from the surface cache filled by the call above
+        hits = pc.surface_cache.hits_memory
+        PPCFref, xref, yref = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, n_grid_cells_x=20, verbose=False, vectorized=False)
+        assert pc.surface_cache.hits_memory == hits
+        np.testing.assert_allclose(PPCF, PPCFref, atol=1e-12)
+        np.testing.assert_array_equal(xgrid, xref)
+        np.testing.assert_array_equal(ygrid, yref)
+
+
+def test_surface_cache_returns_the_computed_surface(game, passes):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    event_id = passes[0][0]
+    pc.surface_cache.clear()
+    hits = pc.surface_cache.hits_memory
+    computed = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, n_grid_cells_x=20, verbose=False)
+    cached = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, n_grid_cells_x=20, verbose=False)
+    assert pc.surface_cache.hits_memory == hits + 1
+    for a, b in zip(computed, cached):
+        np.testing.assert_array_equal(a, b)
+
+
+def query_inputs(passes, n_targets=20, seed=0):
+    rng = np.random.default_rng(seed)
+    targets, starts, attacking, defending = [], [], [], []
+    for _, start, att, dfn in passes:
+        for target in np.column_stack([rng.uniform(-52.5, 52.5, n_targets), rng.uniform(-34, 34, n_targets)]):
+            targets.append(target)
+            starts.append(start)
+            attacking.append(pc.players_to_arrays(att, attacking=True))
+            defending.append(pc.players_to_arrays(dfn, attacking=False))
+    return np.array(targets), np.array(starts), attacking, defending
+
+
+def test_queries_equal_the_point_model(passes):
+    params = pc.default_model_params()
+    targets, starts, attacking, defending = query_inputs(passes)
+    PPCFatt, PPCFdef = pc.calculate_pitch_control_for_queries(targets, starts, attacking, defending, params, backend='numpy')
+    q = 0
+    for _, start, att, dfn in passes:
+        att_players, def_players = att.players(params), dfn.players(params)
+        for _ in range(len(targets)//len(passes)):
+            expected = pc.calculate_pitch_control_at_target(targets[q], att_players, def_players, start, params)
+            assert (PPCFatt[q], PPCFdef[q]) == pytest.approx(expected, abs=1e-12)
+            q += 1
+
+
+def test_numba_backend_equals_numpy(passes):
+    pytest.importorskip('numba')
+    params = pc.default_model_params()
+    targets, starts, attacking, defending = query_inputs(passes)
+    numpy_result = pc.calculate_pitch_control_for_queries(targets, starts, attacking, defending, params, backend='numpy')
+    numba_result = pc.calculate_pitch_control_for_queries(targets, starts, attacking, defending, params, backend='numba')
+    for a, b in zip(numpy_result, numba_result):
+        np.testing.assert_allclose(a, b, atol=1e-12)
+
+
+def test_adaptive_surface_equals_uniform_when_every_cell_is_refined(game, passes):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    event_id = passes[0][0]
+    # every control value lies within these bounds, so every cell is refined
+    PPCF, xgrid, ygrid, stats = pc.generate_adaptive_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers,
+                                                                           n_grid_cells_x=10, refine_factor=3, refine_bounds=(-1., 2.), use_cache=False, return_stats=True)
+    uniform, xref, yref = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers,
+                                                              n_grid_cells_x=30, n_grid_cells_y=PPCF.shape[0], verbose=False, use_cache=False)
+    assert stats['refined_cells'] == stats['uniform_cells'] == uniform.size
+    np.testing.assert_allclose(PPCF, uniform, atol=1e-12)
+    np.testing.assert_allclose(xgrid, xref)
+    np.testing.assert_allclose(ygrid, yref)
+
+
+def test_adaptive_surface_is_close_to_uniform(game, passes):
+    events, tracking_home, tracking_away, GK_numbers = game
+    params = pc.default_model_params()
+    for event_id, _, _, _ in passes[:3]:
+        PPCF, _, _, stats = pc.generate_adaptive_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers,
+                                                                         n_grid_cells_x=12, refine_factor=4, use_cache=False, return_stats=True)
+        uniform, _, _ = pc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers,
+                                                            n_grid_cells_x=48, n_grid_cells_y=PPCF.shape[0], verbose=False, use_cache=False)
+        assert stats['cells_evaluated'] < stats['uniform_cells']
+        # the cells that kept their coarse value were controlled to within refine_bounds=(0.01, 0.99)
+        np.testing.assert_allclose(PPCF, uniform, atol=0.02)
+        assert np.abs(PPCF - uniform).mean() < 1e-3
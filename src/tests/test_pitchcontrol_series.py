@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import pitchcontrol as pc
+import pitchcontrol_series as pcs
+
+
+def test_warm_start_equals_cold_start(store):
+    params = pc.default_model_params()
+    frame_range = (store.frame_ids[200], store.frame_ids[259])
+    warm = list(pcs.generate_pitch_control_series(store, params, frame_range=frame_range, n_grid_cells_x=30, warm_start=True))
+    cold = list(pcs.generate_pitch_control_series(store, params, frame_range=frame_range, n_grid_cells_x=30, warm_start=False))
+    assert len(warm) == len(cold) == 60
+    for (frame_warm, PPCF_warm, stats_warm), (frame_cold, PPCF_cold, stats_cold) in zip(warm, cold):
+        assert frame_warm == frame_cold
+        np.testing.assert_allclose(PPCF_warm, PPCF_cold, atol=1e-12)
+        for key in ('attacking_area', 'defending_area', 'attacking_final_third_area', 'defending_final_third_area'):
+            assert stats_warm[key] == pytest.approx(stats_cold[key])
+    # the first frame is computed in full either way, the later frames reuse the short-cut decisions of the previous one
+    cells_warm = np.array([stats['cells_computed'] for _, _, stats in warm])
+    cells_cold = np.array([stats['cells_computed'] for _, _, stats in cold])
+    assert cells_warm[0] == cells_cold[0]
+    assert np.all(cells_warm <= cells_cold)
+    assert cells_warm.sum() < cells_cold.sum()
+
+
+def test_write_pitch_control_series(store, tmp_path):
+    params = pc.default_model_params()
+    frame_range = (store.frame_ids[100], store.frame_ids[149])
+    summary = pcs.write_pitch_control_series(store, str(tmp_path), params, step=5, frame_range=frame_range, n_grid_cells_x=30, flush_every=4)
+    series = list(pcs.generate_pitch_control_series(store, params, step=5, frame_range=frame_range, n_grid_cells_x=30))
+    surfaces = np.load(os.path.join(str(tmp_path), 'PPCFa.npy'))
+    xgrid, ygrid = pc.grid_cell_centres((105., 68.), 30, 19)
+    assert surfaces.shape == (10, 19, 30) and surfaces.dtype == np.float32
+    np.testing.assert_allclose(surfaces, np.array([PPCFa for _, PPCFa, _ in series]), atol=1e-6)
+    np.testing.assert_array_equal(np.load(os.path.join(str(tmp_path), 'frame_ids.npy')), [frame_id for frame_id, _, _ in series])
+    np.testing.assert_array_equal(np.load(os.path.join(str(tmp_path), 'xgrid.npy')), xgrid)
+    np.testing.assert_array_equal(np.load(os.path.join(str(tmp_path), 'ygrid.npy')), ygrid)
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(str(tmp_path), 'summary.csv')), summary, check_dtype=False)
+    pd.testing.assert_frame_equal(summary, pd.DataFrame([stats for _, _, stats in series]))
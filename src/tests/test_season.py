@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+import benchmark
+import data_in_out as IO
+import season
+
+
+def test_concurrent_cold_reads_build_the_cache_once(tmp_path):
+    benchmark.make_synthetic_match(str(tmp_path), 1, n_frames=300, n_events=10)
+    ball = os.path.join(str(tmp_path), 'Game 1', 'Players', 'Ball.csv')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: IO.read_csv_cached(ball), range(16)))
+    expected = pd.read_csv(ball)
+    for result in results:
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    # one complete cache, no temporary folders left behind
+    assert os.listdir(os.path.dirname(IO.csv_cache_path(ball))) == ['Ball']
+    assert IO.csv_cache_valid(ball)
+
+
+def test_threaded_cold_load_matches_sequential_load(tmp_path):
+    benchmark.make_synthetic_match(str(tmp_path), 1, n_frames=300, n_events=10)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        threaded = season.load_game(str(tmp_path), 1, executor=executor)
+    sequential = season.load_game(str(tmp_path), 1, use_cache=False)
+    pd.testing.assert_frame_equal(threaded.tracking_home, sequential.tracking_home, check_dtype=False)
+    pd.testing.assert_frame_equal(threaded.tracking_away, sequential.tracking_away, check_dtype=False)
+    pd.testing.assert_frame_equal(threaded.events, sequential.events, check_dtype=False)
+    assert threaded.GK_numbers == sequential.GK_numbers
+
+
+def test_concurrent_requests_load_a_game_once(tmp_path, monkeypatch):
+    benchmark.make_synthetic_match(str(tmp_path), 1, n_frames=300, n_events=10)
+    loads = []
+    load_game = season.load_game
+    def slow_load_game(*args, **kwargs):
+        loads.append(args[1])
+        time.sleep(0.2)
+        return load_game(*args, **kwargs)
+    monkeypatch.setattr(season, 'load_game', slow_load_game)
+    with season.Season(str(tmp_path), n_workers=1) as games:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: games.game(1), range(8)))
+        assert loads == [1]
+        assert all(result is results[0] for result in results)
+        # a failed load is not kept: the next request tries again instead of waiting for it
+        for _ in range(2):
+            with pytest.raises(FileNotFoundError):
+                games.game(2)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import pitchcontrol as pc
+import pitchcontrol_series as pcs
+import space_creation as sc
+
+
+def subset(players, keep):
+    return pc.PlayerArrays(*[values[keep] for values in players])
+
+
+@pytest.fixture(scope='module')
+def frame(store):
+    # player arrays and targets of a frame, as space_creation_series builds them
+    params = pc.default_model_params()
+    row = 400
+    xgrid, ygrid = pc.grid_cell_centres((105., 68.), 24, 15)
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    targets = np.column_stack([xx.ravel(), yy.ravel()])
+    gk = {team: store.goalkeepers(team)[row] for team in ('Team_A', 'Team_B')}
+    attack_ids, attack = pcs.frame_player_arrays(store, row, store.team_players('Team_A'), gk['Team_A'], params, attacking=True)
+    defend_ids, defend = pcs.frame_player_arrays(store, row, store.team_players('Team_B'), gk['Team_B'], params, attacking=False)
+    ball = np.asarray(store.ball[row], dtype=float)
+    return params, row, targets, attack_ids, attack, defend_ids, defend, ball
+
+
+def arrival_times(players, targets):
+    return pc.simple_time_to_intercept_array(players.positions, players.velocities, players.vmax, players.reaction_time, targets)
+
+
+def test_leave_one_out_equals_recomputing_without_the_player(frame):
+    params, _, targets, _, attack, _, defend, ball = frame
+    ball_travel_time = np.linalg.norm(targets - ball, axis=1)/params['average_ball_speed']
+    att_contribution, def_contribution = sc.leave_one_out_control(arrival_times(attack, targets), arrival_times(defend, targets), ball_travel_time, attack, defend, params)
+    PPCFatt, PPCFdef = pc.calculate_pitch_control_from_arrays(targets, attack, defend, ball, params)
+    for i in range(len(attack.positions)):
+        without, _ = pc.calculate_pitch_control_from_arrays(targets, subset(attack, np.arange(len(attack.positions)) != i), defend, ball, params)
+        np.testing.assert_allclose(att_contribution[i], PPCFatt - without, atol=1e-12)
+    for i in range(len(defend.positions)):
+        _, without = pc.calculate_pitch_control_from_arrays(targets, attack, subset(defend, np.arange(len(defend.positions)) != i), ball, params)
+        np.testing.assert_allclose(def_contribution[i], PPCFdef - without, atol=1e-12)
+    # only the targets a player can reach in time are evaluated: most contributions are exactly zero
+    assert np.mean(att_contribution == 0.) > 0.5
+
+
+def test_frozen_player_equals_recomputing_with_the_frozen_position(store, frame):
+    params, row, targets, attack_ids, attack, defend_ids, defend, ball = frame
+    ball_travel_time = np.linalg.norm(targets - ball, axis=1)/params['average_ball_speed']
+    earlier = row - 25
+    att_contribution, _ = sc.leave_one_out_control(arrival_times(attack, targets), arrival_times(defend, targets), ball_travel_time, attack, defend, params,
+                                                   att_replacement=sc.frozen_time_to_intercept(store, earlier, attack_ids, attack, targets),
+                                                   def_replacement=sc.frozen_time_to_intercept(store, earlier, defend_ids, defend, targets))
+    PPCFatt, _ = pc.calculate_pitch_control_from_arrays(targets, attack, defend, ball, params)
+    for i in range(len(attack.positions)):
+        positions, velocities = attack.positions.copy(), attack.velocities.copy()
+        positions[i], velocities[i] = store.positions[earlier, attack_ids[i]], 0.
+        frozen, _ = pc.calculate_pitch_control_from_arrays(targets, attack._replace(positions=positions, velocities=velocities), defend, ball, params)
+        np.testing.assert_allclose(att_contribution[i], PPCFatt - frozen, atol=1e-6)
+
+
+def test_series_space_is_the_summed_contribution(store, game):
+    events, _, _, _ = game
+    params = pc.default_model_params()
+    frames = sc.space_creation_series(store, events, params, step=25, n_grid_cells_x=24)
+    table = next(frames)
+    row = store.row(table['frameID'].iloc[0])
+    attacking_team = table['Team'].iloc[0]
+    defending_team = 'Team_B' if attacking_team == 'Team_A' else 'Team_A'
+    xgrid, ygrid = pc.grid_cell_centres((105., 68.), 24, 15)
+    xx, yy = np.meshgrid(xgrid, ygrid)
+    targets = np.column_stack([xx.ravel(), yy.ravel()])
+    _, attack = pcs.frame_player_arrays(store, row, store.team_players(attacking_team), store.goalkeepers(attacking_team)[row], params, attacking=True)
+    _, defend = pcs.frame_player_arrays(store, row, store.team_players(defending_team), store.goalkeepers(defending_team)[row], params, attacking=False)
+    ball = np.asarray(store.ball[row], dtype=float)
+    PPCFatt, _ = pc.calculate_pitch_control_from_arrays(targets, attack, defend, ball, params)
+    cell_area = (105./24)*(68./15)
+    attackers = table.loc[table['in_possession']]
+    assert len(attackers) == len(attack.positions)
+    for i, space in enumerate(attackers['space']):
+        without, _ = pc.calculate_pitch_control_from_arrays(targets, subset(attack, np.arange(len(attack.positions)) != i), defend, ball, params)
+        assert space == pytest.approx(np.sum(PPCFatt - without)*cell_area, abs=1e-9)
+    assert attackers['xT_space'].isna().all()
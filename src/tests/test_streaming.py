@@ -0,0 +1,68 @@
+import asyncio
+import os
+import numpy as np
+import ept
+import pitchcontrol as pc
+import pitchcontrol_series as pcs
+import streaming
+
+XT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'xT.csv')
+
+
+class StoreVelocities(object):
+    # stands in for vl.RollingVelocities: returns the (centred) velocities of the store, as pitchcontrol_series uses
+    def __init__(self, store, rows):
+        self.velocities = iter([np.asarray(store.velocities[row], dtype=float) for row in rows])
+
+    def update(self, time, period, positions):
+        return next(self.velocities)
+
+
+def test_streaming_matches_the_series_on_the_same_frames(fc_twente_folder, game, store):
+    _, _, _, GK_numbers = game
+    params = pc.default_model_params()
+    frame_range = (store.frame_ids[300], store.frame_ids[359])
+    series = list(pcs.generate_pitch_control_series(store, params, frame_range=frame_range, n_grid_cells_x=30))
+    source = streaming.ReplaySource(fc_twente_folder, 1, frame_range=frame_range, speed=None)
+    xT = ept.load_xT_grid(XT_FILE)
+    model = streaming.StreamingPitchControl(params, GK_numbers=GK_numbers, xT=xT, n_grid_cells_x=30, latency_budget=60.)
+    model.velocities = StoreVelocities(store, range(source.start, source.stop))
+    results = list(streaming.run_stream(source, model))
+    assert len(results) == len(series) == 60
+    for result, (frame_id, PPCFa, stats) in zip(results, series):
+        assert result.frame_id == frame_id
+        np.testing.assert_allclose(result.PPCFa, PPCFa, atol=1e-12)
+        assert {key: result.stats[key] for key in stats} == stats
+        direction = model.period_direction[stats['Period']]
+        assert result.stats['xT_controlled'] == np.sum(PPCFa.ravel()*model.xT.values_at(model.target_positions, direction))
+    assert model.latency.summary()['frames'] == 60
+
+
+def test_stale_frames_are_skipped(fc_twente_folder, store):
+    params = pc.default_model_params()
+    frame_range = (store.frame_ids[0], store.frame_ids[19])
+    source = streaming.ReplaySource(fc_twente_folder, 1, frame_range=frame_range, speed=None, batch_size=5)
+    # every frame is over a zero budget: only the newest frame of each batch is computed
+    model = streaming.StreamingPitchControl(params, n_grid_cells_x=20, latency_budget=0.)
+    results = list(streaming.run_stream(source, model))
+    assert [result.frame_id for result in results] == [int(store.frame_ids[row]) for row in (4, 9, 14, 19)]
+    assert model.latency.skipped == 16
+    assert model.latency.summary()['frames'] == 4
+
+
+def test_queue_consumer_processes_the_feed(fc_twente_folder, store):
+    params = pc.default_model_params()
+    frame_range = (store.frame_ids[0], store.frame_ids[9])
+    source = streaming.ReplaySource(fc_twente_folder, 1, frame_range=frame_range, speed=None)
+    model = streaming.StreamingPitchControl(params, n_grid_cells_x=20, latency_budget=60.)
+    results = []
+
+    async def replay():
+        queue = asyncio.Queue()
+        feed = asyncio.ensure_future(source.feed(queue))
+        summary = await streaming.run_queue(queue, model, results.append)
+        await feed
+        return summary
+    summary = asyncio.run(replay())
+    assert summary['frames'] == 10 and summary['skipped'] == 0
+    assert [result.frame_id for result in results] == [int(f) for f in store.frame_ids[:10]]
@@ -0,0 +1,25 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import benchmark
+import data_in_out as IO
+import tracking
+
+
+def test_concurrent_rebuilds_leave_one_complete_store(tmp_path):
+    benchmark.make_synthetic_match(str(tmp_path), 1, n_frames=300, n_events=10)
+    reference = tracking.MatchTracking.from_game(str(tmp_path), 1)
+    positions = np.array(reference.positions)
+    manifest = IO.read_cache_manifest(reference.store_path)
+    players_folder = os.path.join(str(tmp_path), 'Game 1', 'Players')
+    cache_folder = os.path.dirname(reference.store_path)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        # concurrent writers of the same store (as separate processes would be) ...
+        list(executor.map(lambda _: tracking.build_match_tracking(players_folder, reference.store_path, manifest['sources']), range(8)))
+        # ... and threads opening it
+        stores = list(executor.map(lambda _: tracking.MatchTracking.from_game(str(tmp_path), 1, rebuild=True), range(8)))
+    for store in stores:
+        np.testing.assert_array_equal(np.array(store.positions), positions)
+    # the store was replaced in one piece and no temporary folders are left behind
+    assert sorted(f for f in os.listdir(cache_folder) if f.startswith('MatchTracking')) == ['MatchTracking']
+    np.testing.assert_array_equal(np.array(tracking.MatchTracking(reference.store_path).positions), positions)
@@ -0,0 +1,64 @@
+import numpy as np
+import velocities as vl
+
+
+def test_moving_average_keeps_constant_velocity_at_the_edges():
+    values = np.ones( (50, 3) )
+    np.testing.assert_allclose( vl.smooth(values, 'moving average', window=7), values )
+
+
+def test_moving_average_keeps_missing_samples_local():
+    values = np.ones( (50, 3) )
+    values[20, 1] = np.nan
+    smoothed = vl.smooth(values, 'moving average', window=7)
+    assert np.isnan(smoothed).sum() == 1 and np.isnan(smoothed[20, 1])
+    np.testing.assert_allclose( smoothed[~np.isnan(values)], 1. )
+
+
+def test_savitzky_golay_keeps_missing_samples_local():
+    # a linear signal is fitted exactly by the (polyorder 1) filter, also next to a gap
+    values = np.column_stack( [np.arange(50.), np.ones(50), np.full(50, np.nan)] )
+    values[20, 0] = np.nan
+    values[30:33, 1] = np.nan
+    smoothed = vl.smooth(values, 'Savitzky-Golay', window=7)
+    np.testing.assert_array_equal( np.isnan(smoothed), np.isnan(values) )
+    # away from the 'nearest' edges
+    inner = ~np.isnan(values[3:-3])
+    np.testing.assert_allclose( smoothed[3:-3][inner], values[3:-3][inner] )
+
+
+def test_constant_motion_has_no_acceleration_at_period_boundaries():
+    time = np.arange(100) / 25.
+    period = np.where( np.arange(100) < 50, 1, 2 )
+    x = np.column_stack( [time*2., time*-3.] )
+    y = np.zeros_like(x)
+    for filter_ in ('Savitzky-Golay', 'moving average'):
+        vx, vy, ax, ay = vl.calc_velocity_arrays(x, y, time, period, filter_=filter_)
+        np.testing.assert_allclose( vx[~np.isnan(vx[:,0])], np.tile([2., -3.], (98, 1)) )
+        np.testing.assert_allclose( ax[~np.isnan(ax[:,0])], 0., atol=1e-9 )
+
+
+def test_rolling_velocities_match_the_last_frame_of_a_period(game):
+    _, tracking_home, _, _ = game
+    first_half = tracking_home.loc[tracking_home['Period'] == tracking_home['Period'].iloc[0]].iloc[:20]
+    schema = vl.IO.tracking_schema(first_half)
+    x = first_half.iloc[:, schema.positions('x')].to_numpy(dtype=float)
+    y = first_half.iloc[:, schema.positions('y')].to_numpy(dtype=float)
+    rolling = vl.RollingVelocities()
+    for t, px, py in zip(first_half['Time [s]'], x, y):
+        v = rolling.update(t, 1, np.column_stack([px, py]))
+    # the causal filter differs from the centred one, but both must follow the smooth synthetic motion closely
+    vx = first_half.iloc[-1, schema.positions('vx')].to_numpy(dtype=float)
+    np.testing.assert_allclose( v[:,0], vx, atol=0.5 )
+
+
+def test_rolling_velocities_keep_missing_samples_local():
+    time = np.arange(30) / 25.
+    positions = np.stack( [np.column_stack( [time*2., time*0.] )]*2, axis=1 )
+    positions[15, 1] = np.nan
+    rolling = vl.RollingVelocities()
+    velocities = np.array( [rolling.update(t, 1, p) for t, p in zip(time, positions)] )
+    # the missing position makes the two velocities that use it missing, not the whole window after it
+    assert np.isnan(velocities[:, 1, 0]).tolist() == [i in (0, 15, 16) for i in range(30)]
+    np.testing.assert_allclose( velocities[1:, 0, 0], 2. )
+    np.testing.assert_allclose( velocities[~np.isnan(velocities[:, 1, 0]), 1, 0], 2. )
@@ -0,0 +1,153 @@
+import os
+import shutil
+import subprocess
+import numpy as np
+import pytest
+import data_in_out as IO
+import visualization as vis
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(vis.plt.rcParams['animation.ffmpeg_path']) is None, reason='ffmpeg is not installed')
+
+
+def read_video(fname, n_frames):
+    # decoded RGB frames of a video written at dpi=40 (12x8 inch pitch: 480x320 pixels)
+    frames = subprocess.run([vis.plt.rcParams['animation.ffmpeg_path'], '-loglevel', 'error', '-i', fname, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                            capture_output=True, check=True).stdout
+    frames = np.frombuffer(frames, dtype=np.uint8)
+    assert frames.size == n_frames*320*480*3
+    return frames.reshape(n_frames, 320, 480, 3).astype(int)
+
+
+@pytest.fixture(scope='module')
+def video_data(fc_twente_folder, game):
+    _, tracking_home, tracking_away, _ = game
+    ball = IO.to_metric_coordinates(IO.load_fc_twente_data(fc_twente_folder, 1, mode='load-ball-data')).set_index('frameID')
+    return tracking_home.iloc[100:120], tracking_away.iloc[100:120], ball
+
+
+def test_plot_frame_accepts_frame_views(game, store):
+    _, tracking_home, tracking_away, _ = game
+    frame = tracking_home.index[100]
+    fig, ax = vis.plot_frame(store.frame(frame, 'Team_A'), store.frame(frame, 'Team_B'), store.frame(frame).ball,
+                             include_player_velocities=True)
+    # the players are drawn at the same positions as from the tracking DataFrames
+    fig_ref, ax_ref = vis.plot_frame(tracking_home.loc[frame], tracking_away.loc[frame], {'X': tracking_home.loc[frame, 'Ball_x'], 'Y': tracking_home.loc[frame, 'Ball_y']},
+                                     include_player_velocities=True)
+    for line, line_ref in zip(ax.lines, ax_ref.lines):
+        np.testing.assert_allclose(line.get_xydata(), line_ref.get_xydata(), atol=1e-4)
+    assert len(ax.texts) == len(ax_ref.texts)
+    vis.plt.close(fig)
+    vis.plt.close(fig_ref)
+
+
+@needs_ffmpeg
+def test_blitted_video_equals_the_reference_renderer(video_data, tmp_path):
+    home, away, ball = video_data
+    vis.generate_video(home, away, ball, path=str(tmp_path), file_name='blit', field_dimen=(105., 68.), dpi=40)
+    vis.generate_video(home, away, ball, path=str(tmp_path), file_name='reference', field_dimen=(105., 68.), dpi=40, blit=False)
+    blit = read_video(str(tmp_path / 'blit.mp4'), 20)
+    np.testing.assert_array_equal(blit, read_video(str(tmp_path / 'reference.mp4'), 20))
+    # the players move: the frames differ
+    assert np.abs(blit[0] - blit[-1]).max() > 100
+
+
+@needs_ffmpeg
+def test_segmented_video_equals_the_single_process_video(video_data, tmp_path):
+    home, away, ball = video_data
+    vis.generate_video(home, away, ball, path=str(tmp_path), file_name='single', field_dimen=(105., 68.), dpi=40)
+    vis.generate_video(home, away, ball, path=str(tmp_path), file_name='segments', field_dimen=(105., 68.), dpi=40, n_workers=2, segment_frames=8)
+    # the segments are encoded separately, so the frames differ only by the encoding
+    difference = np.abs(read_video(str(tmp_path / 'single.mp4'), 20) - read_video(str(tmp_path / 'segments.mp4'), 20))
+    assert difference.mean(axis=(1, 2, 3)).max() < 3.
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['segments.mp4', 'single.mp4']
+
+
+@needs_ffmpeg
+def test_pitch_control_video_is_the_same_with_a_process_pool(game, video_data, tmp_path):
+    _, _, _, GK_numbers = game
+    home, away, ball = video_data
+    params = vis.pc.default_model_params()
+    for name, n_workers in (('serial', 1), ('pool', 2)):
+        vis.generate_pitchcontrol_video(home, away, ball, params, GK_numbers, path=str(tmp_path), file_name=name, n_grid_cells_x=20, n_workers=n_workers, chunk_frames=8, dpi=40)
+    serial = read_video(str(tmp_path / 'serial.mp4'), 20)
+    np.testing.assert_array_equal(serial, read_video(str(tmp_path / 'pool.mp4'), 20))
+    # the overlay is drawn: the pitch is not left white
+    assert (serial[0] != 255).any(axis=2).mean() > 0.5
+
+
+def test_pitch_control_surfaces_equal_the_frame_model(game, video_data):
+    _, _, _, GK_numbers = game
+    home, away, ball = video_data
+    home, away = home.iloc[:5], away.iloc[:5]
+    params = vis.pc.default_model_params()
+    arrays = vis.video_frame_arrays(home, away, ball, True)
+    ball_xy = np.column_stack([arrays['ball_x'], arrays['ball_y']])
+    surfaces = vis._pitch_control_surfaces(home, away, ball_xy, 'Team_B', params, GK_numbers, (105., 68.), 20)
+    assert surfaces.shape[0] == 5 and surfaces.dtype == np.float32
+    for i in range(5):
+        PPCFa, _, _ = vis.pc.generate_pitch_control_for_frame(home.iloc[i], away.iloc[i], ball_xy[i], 'Team_B', params, GK_numbers, n_grid_cells_x=20, use_cache=False)
+        np.testing.assert_allclose(surfaces[i], PPCFa, atol=1e-6)
+
+
+def test_plot_events_draws_one_scatter_and_one_quiver(game):
+    events = game[0].iloc[:10].copy()
+    events.iloc[0, events.columns.get_loc('end_x')] = np.nan
+    fig, ax = vis.pitch_figures.get()
+    try:
+        n_collections = len(ax.collections)
+        vis.plot_events(events, figax=(fig, ax))
+        scatter, quiver = ax.collections[n_collections:]
+        np.testing.assert_allclose(scatter.get_offsets(), events[['start_x', 'start_y']].to_numpy(dtype=float))
+        # the arrow of the event without an end location is left out
+        assert len(quiver.U) == 9
+        np.testing.assert_allclose(quiver.X, events['start_x'].to_numpy(dtype=float)[1:])
+        np.testing.assert_allclose(quiver.U, (events['end_x'] - events['start_x']).to_numpy(dtype=float)[1:])
+        np.testing.assert_allclose(quiver.V, (events['end_y'] - events['start_y']).to_numpy(dtype=float)[1:])
+    finally:
+        vis.pitch_figures.release(fig)
+
+
+@pytest.mark.parametrize('by, column', [('player', 'FullName'), ('team', 'Team')])
+def test_export_event_maps_writes_one_map_per_group(fc_twente_folder, game, tmp_path, monkeypatch, by, column):
+    events = game[0]
+    fnames = vis.export_event_maps([1], str(tmp_path), by=by, fc_twente_folder=fc_twente_folder, dpi=20, n_workers=1)
+    names = sorted(events.loc[events['type_name'] == 'Pass', column].unique())
+    assert fnames == [str(tmp_path / 'Game 1' / f'{name}.png') for name in names]
+    assert all(os.path.getsize(fname) > 0 for fname in fnames)
+    # the maps drawn on reused pool figures equal the maps drawn on new figures (a pool that keeps no figures)
+    monkeypatch.setattr(vis, 'pitch_figures', vis.PitchFigurePool(max_figures=0))
+    again = vis.export_event_maps([1], str(tmp_path / 'again'), by=by, fc_twente_folder=fc_twente_folder, dpi=20, n_workers=1)
+    for fname, fname_again in zip(fnames, again):
+        np.testing.assert_array_equal(vis.plt.imread(fname), vis.plt.imread(fname_again))
+
+
+def test_pitch_markings_are_computed_once_per_pitch():
+    vis.pitch_markings.cache_clear()
+    first = vis.pitch_markings((105.0, 68.0), 'white', 2, 20)
+    assert vis.pitch_markings((105.0, 68.0), 'white', 2, 20) is first
+    assert vis.pitch_markings((100.0, 64.0), 'white', 2, 20) is not first
+    assert vis.pitch_markings.cache_info().hits == 1 and vis.pitch_markings.cache_info().misses == 2
+
+
+def test_pitch_figure_pool_gives_back_a_bare_pitch():
+    pool = vis.PitchFigurePool(max_figures=1)
+    fig, ax = pool.get(field_color='white')
+    children, position, aspect = set(ax.get_children()), ax.get_position().bounds, ax.get_aspect()
+    xlim, ylim, dpi = ax.get_xlim(), ax.get_ylim(), fig.get_dpi()
+    # draw on it as the renderers do: a surface, players, a colorbar axes, a title text and another dpi
+    image = ax.imshow(np.zeros((32, 50)), extent=(-52.5, 52.5, -34., 34.))
+    ax.plot([0, 1], [0, 1], 'ro')
+    fig.colorbar(image, ax=ax)
+    fig.suptitle('frame')
+    fig.set_dpi(40)
+    pool.release(fig)
+    assert pool.get(field_color='white') == (fig, ax)
+    assert set(ax.get_children()) == children and fig.axes == [ax] and not fig.texts
+    assert ax.get_position().bounds == pytest.approx(position) and ax.get_aspect() == aspect
+    assert ax.get_xlim() == xlim and ax.get_ylim() == ylim and fig.get_dpi() == dpi
+    # another pitch setting gets its own figure, and at most max_figures figures are kept per setting
+    assert pool.get(field_color='green')[0] is not fig
+    other, _ = pool.get(field_color='white')
+    pool.release(fig)
+    pool.release(other)
+    assert pool.get(field_color='white')[0] is fig and pool.get(field_color='white')[0] not in (fig, other)
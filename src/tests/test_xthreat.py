@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import ept
+import xthreat
+
+
+def small_game(team='Team_A', mirror=False):
+    # events on a 10x10 field, all in the upper row of a 2x2 grid of zones (x<5: zone 0, x>=5: zone 1), attacking
+    # left->right (mirror: right->left)
+    rows = [
+        # type_name, start_x, end_x, outcome
+        ('Pass', 2., 7., True),
+        ('Pass', 3., 8., True),
+        ('Pass', 1., 4., True),
+        ('Pass', 2., 9., False),    # lost ball
+        ('Miss', 4., np.nan, False),
+        ('Pass', 6., 3., True),
+        ('Goal', 8., np.nan, True),
+        ('Miss', 9., np.nan, False),
+        ('Attempt saved', 7., np.nan, False),
+    ]
+    events = pd.DataFrame(rows, columns=['type_name', 'start_x', 'end_x', 'outcome'])
+    if mirror:
+        events['start_x'] = 10. - events['start_x']
+        events['end_x'] = 10. - events['end_x']
+    events['start_y'] = 5.
+    events['end_y'] = np.where(events['end_x'].notna(), 5., np.nan)
+    events['Team'] = team
+    events['period_id'] = 1
+    return events
+
+
+def test_solves_a_hand_computed_grid():
+    # zone 0: P(move) = 4/5, P(shot) = 1/5, no goals; successful moves go to zone 1 (2 of 4) and zone 0 (1 of 4)
+    # zone 1: P(move) = 1/4 (to zone 0), P(shot) = 3/4, P(goal|shot) = 1/3
+    # xT0 = 4/5 * (1/4 xT0 + 1/2 xT1), xT1 = 3/4 * 1/3 + 1/4 * xT0  =>  xT = (1/7, 2/7)
+    builder = xthreat.XTBuilder(bins=(2, 2), field_dimen=(10., 10.), attack_direction=None)
+    assert builder.add_game(small_game(), game_id=1)
+    np.testing.assert_allclose(builder.solve(tol=1e-14), [[0., 0.], [1/7., 2/7.]], atol=1e-12)
+    # the lost ball counts as a move to zone 1 when every move counts: xT = (3/13, 4/13)
+    every_move = xthreat.XTBuilder(bins=(2, 2), field_dimen=(10., 10.), attack_direction=None, successful_moves_only=False)
+    every_move.add_game(small_game())
+    np.testing.assert_allclose(every_move.solve(tol=1e-14), [[0., 0.], [3/13., 4/13.]], atol=1e-12)
+
+
+def test_orients_teams_by_their_shots():
+    # a team attacking right->left gives the same grid once its events are mirrored
+    builder = xthreat.XTBuilder(bins=(2, 2), field_dimen=(10., 10.))
+    builder.add_game(small_game(team='Team_B', mirror=True))
+    np.testing.assert_allclose(builder.solve(tol=1e-14), [[0., 0.], [1/7., 2/7.]], atol=1e-12)
+    assert xthreat.playing_directions(small_game(team='Team_B', mirror=True), (10., 10.)) == {('Team_B', 1): -1}
+
+
+def test_saved_state_adds_games_incrementally(tmp_path):
+    builder = xthreat.XTBuilder(bins=(2, 2), field_dimen=(10., 10.), attack_direction=None)
+    builder.add_game(small_game(), game_id=1)
+    builder.save(str(tmp_path / 'state.npz'))
+    loaded = xthreat.XTBuilder.load(str(tmp_path / 'state.npz'))
+    # a game that was already added is skipped, a new game adds its counts
+    assert not loaded.add_game(small_game(), game_id=1)
+    assert loaded.add_game(small_game(), game_id=2)
+    twice = xthreat.XTBuilder(bins=(2, 2), field_dimen=(10., 10.), attack_direction=None)
+    twice.add_game(pd.concat([small_game(), small_game()], ignore_index=True))
+    assert loaded.game_ids == [1, 2]
+    np.testing.assert_array_equal(loaded.transition_counts.toarray(), twice.transition_counts.toarray())
+    np.testing.assert_allclose(loaded.solve(), twice.solve())
+    # the written grid is read back by ept
+    xT = loaded.write(str(tmp_path / 'xT.csv'))
+    np.testing.assert_allclose(ept.load_xT_grid(str(tmp_path / 'xT.csv')), xT)
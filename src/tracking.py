@@ -0,0 +1,228 @@
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import data_in_out as IO
+import pitchcontrol as pc
+import velocities as vl
+
+# bump when the content of the store changes, so that stores written by older code are rebuilt
+STORE_VERSION = 2
+
+class MatchTracking(object):
+    '''
+    Array backed tracking data of one game.
+
+    Positions and velocities of all players are stored in dense (frames, players, 2) float32 arrays in a folder on
+    disk and opened with np.memmap, so several matches can be open at once without being loaded into RAM. Positions
+    are in metric coordinates (see IO.to_metric_coordinates). The player table 'player_ids' gives the column name
+    prefix of every player (e.g. 'Team_A_Player_1') and 'teams' the team of every player.
+
+    Build the store of a game with MatchTracking.from_game(), which reuses the store on disk as long as the csv files
+    have not changed.
+    '''
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.player_ids = np.array(manifest["player_ids"])
+        self.teams = np.array([p[:6] for p in self.player_ids])
+        self.positions = np.load(os.path.join(store_path, "positions.npy"), mmap_mode="r")
+        self.velocities = np.load(os.path.join(store_path, "velocities.npy"), mmap_mode="r")
+        self.ball = np.load(os.path.join(store_path, "ball.npy"), mmap_mode="r")
+        self.frame_ids = np.load(os.path.join(store_path, "frame_ids.npy"), mmap_mode="r")
+        self.period = np.load(os.path.join(store_path, "period.npy"), mmap_mode="r")
+        self.time = np.load(os.path.join(store_path, "time.npy"), mmap_mode="r")
+        # frameID -> row lookup. Frames are normally consecutive, in which case the row is just an offset
+        self.first_frame = int(self.frame_ids[0]) if len(self.frame_ids) else 0
+        if np.array_equal(self.frame_ids, np.arange(self.first_frame, self.first_frame + len(self.frame_ids))):
+            self._frame_rows = None
+        else:
+            self._frame_rows = {int(f): i for i, f in enumerate(self.frame_ids)}
+        self._columns = {}
+        self._goalkeepers = {}
+
+    @classmethod
+    def from_game(cls, fc_twente_folder=IO.FC_TWENTE_FOLDER, game_id=1, field_dimen=(105.0, 68.0), rebuild=False):
+        '''
+        Open the tracking store of a game, (re)building it from the Players csv files when needed
+        '''
+        players_folder = os.path.join(fc_twente_folder, f"Game {game_id}", "Players")
+        store_path = os.path.join(players_folder, IO.CACHE_FOLDER_NAME, "MatchTracking")
+        csv_files = sorted(f for f in os.listdir(players_folder) if f.endswith(".csv") and "checkpoint" not in f)
+        sources = {f: IO.csv_source_key(os.path.join(players_folder, f)) for f in csv_files}
+        def valid(manifest):
+            return (manifest is not None and manifest["sources"] == sources and manifest["field_dimen"] == list(field_dimen)
+                    and manifest.get("version") == STORE_VERSION)
+        if rebuild or not valid(IO.read_cache_manifest(store_path)):
+            # threads opening the same store wait for one build instead of swapping stores under each other
+            with IO.cache_lock(store_path):
+                if rebuild or not valid(IO.read_cache_manifest(store_path)):
+                    build_match_tracking(players_folder, store_path, sources, field_dimen)
+                return cls(store_path)
+        return cls(store_path)
+
+    @property
+    def n_frames(self):
+        return self.positions.shape[0]
+
+    def row(self, frame_id):
+        # O(1) frameID -> row lookup
+        if self._frame_rows is None:
+            row = int(frame_id) - self.first_frame
+            if row < 0 or row >= self.n_frames:
+                raise KeyError(frame_id)
+            return row
+        return self._frame_rows[int(frame_id)]
+
+    def team_players(self, teamname):
+        return np.flatnonzero(self.teams == teamname)
+
+    def frame(self, frame_id, teamname=None):
+        '''
+        Lightweight view of a single frame, restricted to one team if teamname ('Team_A' or 'Team_B') is given.
+        The view can be used in place of a row of the team tracking DataFrame (e.g. tracking_home.loc[frame])
+        '''
+        players = self.team_players(teamname) if teamname is not None else np.arange(len(self.player_ids))
+        return FrameView(self, self.row(frame_id), players, self.column_index(teamname))
+
+    def goalkeepers(self, teamname):
+        '''
+        Player (index into player_ids) in goal for a team in every frame, -1 in frames without players. Computed once
+        for the whole match with IO.goalkeeper_indices, so missing positions and substitutions are handled
+        '''
+        if teamname not in self._goalkeepers:
+            players = self.team_players(teamname)
+            goalkeepers = IO.goalkeeper_indices(self.positions[:, players, 0])
+            self._goalkeepers[teamname] = np.where(goalkeepers >= 0, players[np.maximum(goalkeepers, 0)], -1)
+        return self._goalkeepers[teamname]
+
+    def team_state(self, frame_id, teamname, params, GKid):
+        '''
+        pitch control TeamState (see pc.TeamState) of a team at a frame, built straight from the position and velocity arrays
+        '''
+        row = self.row(frame_id)
+        players = self.team_players(teamname)
+        ids = [p[len(teamname) + 1:] for p in self.player_ids[players]]
+        return pc.TeamState(teamname, ids, self.positions[row, players], self.velocities[row, players], params, GKid)
+
+    def column_index(self, teamname=None):
+        # column name -> (array, player, component) for the columns of a team DataFrame, shared by all frame views
+        if teamname not in self._columns:
+            players = self.team_players(teamname) if teamname is not None else np.arange(len(self.player_ids))
+            columns = {}
+            for p in players:
+                name = self.player_ids[p]
+                columns[name + "_x"] = ("positions", p, 0)
+                columns[name + "_y"] = ("positions", p, 1)
+                columns[name + "_vx"] = ("velocities", p, 0)
+                columns[name + "_vy"] = ("velocities", p, 1)
+            columns["Ball_x"] = ("ball", None, 0)
+            columns["Ball_y"] = ("ball", None, 1)
+            columns["Period"] = ("period", None, None)
+            columns["Time [s]"] = ("time", None, None)
+            self._columns[teamname] = columns
+        return self._columns[teamname]
+
+
+class FrameView(object):
+    '''
+    A single frame of a MatchTracking store. It behaves like a row of the team tracking DataFrame (keys() returns
+    the column names and view[column] or view[list_of_columns] returns the values) but reads straight from the arrays
+    '''
+    __slots__ = ("store", "row", "players", "columns")
+
+    def __init__(self, store, row, players, columns):
+        self.store = store
+        self.row = row
+        self.players = players
+        self.columns = columns
+
+    @property
+    def frame_id(self):
+        return int(self.store.frame_ids[self.row])
+
+    @property
+    def player_ids(self):
+        return self.store.player_ids[self.players]
+
+    @property
+    def positions(self):
+        return np.asarray(self.store.positions[self.row, self.players], dtype=float)
+
+    @property
+    def velocities(self):
+        return np.asarray(self.store.velocities[self.row, self.players], dtype=float)
+
+    @property
+    def ball(self):
+        # ball position with the keys of the ball DataFrame
+        x, y = self.store.ball[self.row]
+        return {"X": float(x), "Y": float(y)}
+
+    def keys(self):
+        return list(self.columns.keys())
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __getitem__(self, column):
+        if isinstance(column, (list, tuple, np.ndarray, pd.Index)):
+            return np.array([self[c] for c in column])
+        array, player, component = self.columns[column]
+        values = getattr(self.store, array)
+        if player is not None:
+            return float(values[self.row, player, component])
+        if component is not None:
+            return float(values[self.row, component])
+        return values[self.row].item()
+
+
+def build_match_tracking(players_folder, store_path, sources, field_dimen=(105.0, 68.0)):
+    '''
+    Write the MatchTracking store of a game. The arrays are filled one player at a time through np.memmap, so the
+    whole match is never held in memory at once
+    '''
+    ball = IO.read_csv_cached(os.path.join(players_folder, "Ball.csv"), usecols=["frameID", "Period", "Time [s]", "X", "Y"])
+    ball = ball.drop_duplicates("frameID").sort_values("frameID")
+    frame_ids = pd.to_numeric(ball["frameID"], downcast="integer").to_numpy()
+    time = pd.to_numeric(ball["Time [s]"]).to_numpy(dtype=float)
+    player_files = sorted((f for f in sources if f.startswith("Team_")),
+                          key=lambda f: (f.split("_")[1], int(f.split("_")[3].split(".")[0])))
+    player_ids = [os.path.splitext(f)[0] for f in player_files]
+    n_frames, n_players = len(frame_ids), len(player_ids)
+
+    # write into a temporary folder unique to this call, so that threads and processes building the same store at the
+    # same time do not write into each other's files
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(store_path) + ".tmp-", dir=os.path.dirname(store_path))
+    positions = np.lib.format.open_memmap(os.path.join(tmp_path, "positions.npy"), mode="w+",
+                                          dtype=np.float32, shape=(n_frames, n_players, 2))
+    velocities = np.lib.format.open_memmap(os.path.join(tmp_path, "velocities.npy"), mode="w+",
+                                           dtype=np.float32, shape=(n_frames, n_players, 2))
+    period = pd.to_numeric(ball["Period"]).to_numpy()
+    for p, player_file in enumerate(player_files):
+        data = IO.read_csv_cached(os.path.join(players_folder, player_file), usecols=["frameID", "X", "Y"])
+        data = data.drop_duplicates("frameID").set_index("frameID").reindex(frame_ids)
+        x = pd.to_numeric(data["X"]).to_numpy(dtype=float) - 0.5 * field_dimen[0]
+        y = pd.to_numeric(data["Y"]).to_numpy(dtype=float) - 0.5 * field_dimen[1]
+        positions[:, p, 0] = x
+        positions[:, p, 1] = y
+        vx, vy, _, _ = vl.calc_velocity_arrays(x[:, None], y[:, None], time, period)
+        velocities[:, p, 0] = vx[:, 0]
+        velocities[:, p, 1] = vy[:, 0]
+    positions.flush()
+    velocities.flush()
+    del positions, velocities
+
+    ball_xy = np.column_stack([pd.to_numeric(ball["X"]).to_numpy(dtype=float) - 0.5 * field_dimen[0],
+                               pd.to_numeric(ball["Y"]).to_numpy(dtype=float) - 0.5 * field_dimen[1]])
+    np.save(os.path.join(tmp_path, "ball.npy"), ball_xy.astype(np.float32))
+    np.save(os.path.join(tmp_path, "frame_ids.npy"), frame_ids)
+    np.save(os.path.join(tmp_path, "period.npy"), period)
+    np.save(os.path.join(tmp_path, "time.npy"), time)
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump({"version": STORE_VERSION, "sources": sources, "field_dimen": list(field_dimen), "player_ids": player_ids}, f)
+    IO.replace_folder(tmp_path, store_path)
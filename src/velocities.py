@@ -1,30 +1,143 @@
+from collections import deque
 import numpy as np
+import scipy.ndimage as ndimage
 import scipy.signal as signal
 import pandas as pd
 import data_in_out as IO
 
-def calc_player_velocities(team_tracking_data, smoothing=True, window=7, maxspeed=12):
+def calc_player_velocities(team_tracking_data, smoothing=True, filter_='Savitzky-Golay', window=7, polyorder=1, maxspeed=12):
+    # velocity (_vx, _vy), acceleration (_ax, _ay), speed (_speed, m/s) and acceleration magnitude (_acceleration, m/s/s)
+    # of every player, computed for all players at once from the (frames x players) position arrays
     team_tracking_data = remove_player_velocities(team_tracking_data)
-    players_ids = np.unique([ c[:-2] for c in team_tracking_data.columns if c[:6] in ['Team_A', 'Team_B'] and "speed" not in c[7:-2] ])
-    dt = team_tracking_data['Time [s]'].diff()
-    # second_half_idx = team_tracking_data.Period.idxmax(2)
-    for player in players_ids:
-        vx = team_tracking_data[player + '_x'].diff() / dt
-        vy = team_tracking_data[player + '_y'].diff() / dt
+    schema = IO.tracking_schema(team_tracking_data)
+    players_ids = schema.player_names
+    x = team_tracking_data.iloc[:, schema.positions('x')].to_numpy(dtype=float)
+    y = team_tracking_data.iloc[:, schema.positions('y')].to_numpy(dtype=float)
+    time = team_tracking_data['Time [s]'].to_numpy(dtype=float)
+    period = team_tracking_data['Period'].to_numpy() if 'Period' in team_tracking_data.columns else None
+    vx, vy, ax, ay = calc_velocity_arrays(x, y, time, period, smoothing=smoothing, filter_=filter_, window=window, polyorder=polyorder, maxspeed=maxspeed)
 
+    # build all new columns at once instead of inserting them one by one
+    values = np.stack( [vx, vy, ax, ay, np.hypot(vx, vy), np.hypot(ax, ay)], axis=2 ).reshape(len(team_tracking_data), -1)
+    columns = [ player + suffix for player in players_ids for suffix in ['_vx','_vy','_ax','_ay','_speed','_acceleration'] ]
+    new_columns = pd.DataFrame( values, index=team_tracking_data.index, columns=columns )
+    return pd.concat( [team_tracking_data, new_columns], axis=1 )
+
+def calc_velocity_arrays(x, y, time, period=None, smoothing=True, filter_='Savitzky-Golay', window=7, polyorder=1, maxspeed=12):
+    # x, y: (frames x players) position arrays, time: (frames,) time in seconds, period: (frames,) match period.
+    # Each period is differentiated (and smoothed) separately so that nothing is computed across half time.
+    vx = np.full( x.shape, np.nan )
+    vy = np.full( x.shape, np.nan )
+    ax = np.full( x.shape, np.nan )
+    ay = np.full( x.shape, np.nan )
+    if period is None:
+        boundaries = np.array( [0, len(time)] )
+    else:
+        boundaries = np.r_[ 0, np.flatnonzero( period[1:] != period[:-1] ) + 1, len(time) ]
+    for start, stop in zip( boundaries[:-1], boundaries[1:] ):
+        dt = np.diff( time[start:stop] )[:,None]
+        period_vx = np.diff( x[start:stop], axis=0 ) / dt
+        period_vy = np.diff( y[start:stop], axis=0 ) / dt
         # speed > maxspeed is likely error recording
-        # if maxspeed > 0:
-        #     raw_speed = team_tracking_data[player + "_speedKmh"]
-        #     vx.values[raw_speed > maxspeed] = np.nan
-        #     vy.values[raw_speed > maxspeed] = np.nan
-        
-        # TODO: Smoothing
-        team_tracking_data[player + "_vx"] = pd.to_numeric(vx)
-        team_tracking_data[player + "_vy"] = pd.to_numeric(vy)
-    return team_tracking_data
+        if maxspeed > 0:
+            too_fast = np.hypot( period_vx, period_vy ) > maxspeed
+            period_vx[too_fast] = np.nan
+            period_vy[too_fast] = np.nan
+        if smoothing:
+            period_vx = smooth(period_vx, filter_, window, polyorder)
+            period_vy = smooth(period_vy, filter_, window, polyorder)
+        vx[start+1:stop] = period_vx
+        vy[start+1:stop] = period_vy
+        # acceleration from the (smoothed) velocities
+        period_ax = np.diff( period_vx, axis=0 ) / dt[1:]
+        period_ay = np.diff( period_vy, axis=0 ) / dt[1:]
+        if smoothing:
+            period_ax = smooth(period_ax, filter_, window, polyorder)
+            period_ay = smooth(period_ay, filter_, window, polyorder)
+        ax[start+2:stop] = period_ax
+        ay[start+2:stop] = period_ay
+    return vx, vy, ax, ay
+
+def smooth(values, filter_='Savitzky-Golay', window=7, polyorder=1):
+    # smooth every column of 'values' along the frame axis
+    if values.shape[0] < window:
+        return values
+    if filter_ == 'Savitzky-Golay':
+        # a missing sample (NaN) would spread over the whole window of the fit: fit over the gaps filled in by linear
+        # interpolation instead, and put the missing samples back afterwards. 'nearest' edge mode so that the fit does
+        # not extrapolate past the first and last frames
+        valid = np.isfinite( values )
+        smoothed = signal.savgol_filter( fill_gaps(values, valid), window_length=window, polyorder=polyorder, axis=0, mode='nearest' )
+        return np.where( valid, smoothed, np.nan )
+    elif filter_ == 'moving average':
+        # mean of the valid samples in the window, with the same 'nearest' edges. Missing samples stay missing and
+        # are left out of the mean of their neighbours
+        valid = np.isfinite( values )
+        sums = ndimage.uniform_filter1d( np.where( valid, values, 0. ), window, axis=0, mode='nearest' )
+        counts = ndimage.uniform_filter1d( valid.astype(float), window, axis=0, mode='nearest' )
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where( valid, sums/counts, np.nan )
+    else:
+        assert False, "Unknown smoothing filter '%s' (use 'Savitzky-Golay' or 'moving average')" % filter_
+
+def fill_gaps(values, valid):
+    # copy of 'values' with the invalid samples of every column linearly interpolated from the valid ones (the first and
+    # last valid sample are carried to the edges). Columns without any valid sample are left as they are
+    filled = np.array( values, dtype=float )
+    for column in np.flatnonzero( ~valid.all(axis=0) & valid.any(axis=0) ):
+        rows = np.flatnonzero( valid[:,column] )
+        filled[:,column] = np.interp( np.arange(len(filled)), rows, filled[rows,column] )
+    return filled
+
+class RollingVelocities(object):
+    '''
+    Incremental player velocities for a live feed: update() takes the (players, 2) positions of one new frame and
+    returns the smoothed (players, 2) velocities at that frame, computed from a rolling window of the last 'window'+1
+    frames only. Velocities are computed as in calc_velocity_arrays (differences of consecutive frames, speeds above
+    'maxspeed' are dropped, smoothed with the same filter and window), except that the filter is evaluated at the
+    newest frame of the window instead of its centre, as later frames are not known yet. The window is reset when
+    the period or the players change. Velocities are NaN until two frames have been seen.
+    '''
+
+    def __init__(self, filter_='Savitzky-Golay', window=7, polyorder=1, maxspeed=12):
+        self.window = window
+        self.maxspeed = maxspeed
+        if filter_ == 'Savitzky-Golay':
+            # weights of the polynomial fit of the window, evaluated at its last sample
+            self.weights = signal.savgol_coeffs( window, polyorder, pos=window-1, use='dot' )
+        elif filter_ == 'moving average':
+            self.weights = np.ones( window ) / window
+        else:
+            assert False, "Unknown smoothing filter '%s' (use 'Savitzky-Golay' or 'moving average')" % filter_
+        self.reset()
+
+    def reset(self, period=None):
+        self.period = period
+        self.times = deque( maxlen=self.window+1 )
+        self.positions = deque( maxlen=self.window+1 )
+
+    def update(self, time, period, positions):
+        positions = np.asarray( positions, dtype=float )
+        if period != self.period or (self.positions and self.positions[-1].shape != positions.shape):
+            self.reset(period)
+        self.times.append( float(time) )
+        self.positions.append( positions )
+        if len(self.times) < 2:
+            return np.full( positions.shape, np.nan )
+        dt = np.diff( self.times )[:,None,None]
+        v = np.diff( np.array(self.positions), axis=0 ) / dt
+        if self.maxspeed > 0:
+            # speed > maxspeed is likely error recording
+            v[ np.hypot( v[...,0], v[...,1] ) > self.maxspeed ] = np.nan
+        if len(v) < self.window:
+            # not enough frames to smooth yet (calc_velocity_arrays does not smooth periods shorter than the window either)
+            return v[-1]
+        # missing samples are filled in for the fit as in smooth(), so that they do not spread over the whole window
+        filled = fill_gaps( v.reshape( len(v), -1 ), np.isfinite( v ).reshape( len(v), -1 ) ).reshape( v.shape )
+        return np.where( np.isfinite(v[-1]), np.tensordot( self.weights, filled, axes=(0,0) ), np.nan )
 
 def remove_player_velocities(team):
     # remove player velocoties and acceleeration measures that are already in the 'team' dataframe
-    columns = [c for c in team.columns if c.split('_')[-1] in ['vx','vy','ax','ay','speed','acceleration']] # Get the player ids
+    columns = team.columns[ IO.tracking_schema(team).velocity_columns ]
     team = team.drop(columns=columns)
-    return team
\ No newline at end of file
+    return team
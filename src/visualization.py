@@ -1,8 +1,19 @@
+import os
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 import data_in_out as IO
+import pitchcontrol as pc
 import matplotlib.pyplot as plt
 import scipy.signal as signal
 import numpy as np
 import matplotlib.animation as animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 
 
 def plot_frame(
@@ -20,21 +31,27 @@ def plot_frame(
     else:  # overlay on a previously generated pitch
         fig, ax = figax  # unpack tuple
     for team, color in zip([hometeam, awayteam], team_colors):
-        # print(team)
-        x_columns = [c for c in team.keys() if c[-2:].lower() == "_x" and c != "Ball_x"]
-        y_columns = [c for c in team.keys() if c[-2:].lower() == "_y" and c != "Ball_y"]
-        ax.plot(team[x_columns], team[y_columns], color + "o", alpha=0.7)
+        # player positions (and velocities) from their column positions, see IO.TrackingSchema
+        schema = IO.tracking_schema(team)
+        values = team_values(team, schema, ['x','y','vx','vy'] if include_player_velocities else ['x','y'])
+        ax.plot(values['x'], values['y'], color + "o", alpha=0.7)
         if include_player_velocities:
-            vx_columns = ['{}_vx'.format(c[:-2]) for c in x_columns] # column header for player x positions
-            vy_columns = ['{}_vy'.format(c[:-2]) for c in y_columns] # column header for player y positions
-            # print(vx_columns)
-            ax.quiver( team[x_columns], team[y_columns], team[vx_columns], team[vy_columns], color=color, scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,alpha=0.7)
+            ax.quiver( values['x'], values['y'], values['vx'], values['vy'], color=color, scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,alpha=0.7)
         if annotate:
-            [ ax.text( team[x]+0.5, team[y]+0.5, x.split('_')[3], fontsize=10, color=color  ) for x,y in zip(x_columns,y_columns) if not ( np.isnan(team[x]) or np.isnan(team[y]) ) ]
+            [ ax.text( x+0.5, y+0.5, label, fontsize=10, color=color  ) for x,y,label in zip(values['x'],values['y'],schema.labels) if not ( np.isnan(x) or np.isnan(y) ) ]
     ax.plot( ball['X'], ball['Y'], 'ko', alpha=1.0)
     return fig, ax
 
 
+def team_values(team, schema, fields):
+    # values of 'fields' (e.g. 'x', 'y') of every player, from a row or a DataFrame of tracking data, as float arrays.
+    # Other frames with keys() (e.g. a MatchTracking FrameView) are read by column name
+    if not hasattr(team, 'to_numpy'):
+        return { field: np.asarray( team[schema.names(field)], dtype=float ) for field in fields }
+    values = team.to_numpy()
+    return { field: np.asarray( values[..., schema.positions(field)], dtype=float ) for field in fields }
+
+
 def plot_pitch(
     field_dimen=(105.0, 68.0),
     field_color="green",
@@ -42,14 +59,48 @@ def plot_pitch(
     markersize=20,
 ):
     fig, ax = plt.subplots(figsize=(12, 8))  # create a figure
+    draw_pitch(ax, field_dimen=field_dimen, field_color=field_color, linewidth=linewidth, markersize=markersize)
+    return fig, ax
+
+
+def draw_pitch(ax, field_dimen=(105.0, 68.0), field_color="green", linewidth=2, markersize=20):
+    # draw the (cached) pitch markings on 'ax': one LineCollection for all lines, one scatter for the spots and one for the goal posts
+    markings = pitch_markings(tuple(float(d) for d in field_dimen), field_color, linewidth, markersize)
+    if markings.facecolor is not None:
+        ax.set_facecolor(markings.facecolor)
+    ax.add_collection( LineCollection(markings.lines, colors=markings.line_colors, linewidths=linewidth, zorder=2,
+                                      capstyle=plt.rcParams["lines.solid_capstyle"], joinstyle=plt.rcParams["lines.solid_joinstyle"]), autolim=False )
+    ax.scatter(markings.spots[:,0], markings.spots[:,1], marker="o", facecolor=markings.line_color, linewidth=0, s=markersize)
+    ax.scatter(markings.posts[:,0], markings.posts[:,1], marker="s", color=markings.spot_color, s=(6 * markersize / 20.0)**2, zorder=2)
+    # remove axis labels and ticks
+    ax.set_xticklabels([])
+    ax.set_yticklabels([])
+    ax.set_xticks([])
+    ax.set_yticks([])
+    # set axis limits
+    ax.set_xlim([-markings.xmax, markings.xmax])
+    ax.set_ylim([-markings.ymax, markings.ymax])
+    ax.set_axisbelow(True)
+    return ax
+
+
+# geometry and colors of the pitch markings of plot_pitch
+PitchMarkings = namedtuple("PitchMarkings", ["facecolor", "line_color", "spot_color", "lines", "line_colors", "spots", "posts", "xmax", "ymax"])
+
+@lru_cache(maxsize=None)
+def pitch_markings(field_dimen=(105.0, 68.0), field_color="green", linewidth=2, markersize=20):
+    # PitchMarkings for a pitch of 'field_dimen', computed once per (field_dimen, field_color, linewidth, markersize)
     # decide what color we want the field to be. Default is green, but can also choose white
     if field_color == "green":
-        ax.set_facecolor("mediumseagreen")
+        facecolor = "mediumseagreen"
         lc = "whitesmoke"  # line color
         pc = "w"  # 'spot' colors
     elif field_color == "white":
+        facecolor = None
         lc = "k"
         pc = "k"
+    else:
+        assert False, "Unknown field color '%s' (use 'green' or 'white')" % field_color
     # ALL DIMENSIONS IN m
     border_dimen = (3, 3)  # include a border arround of the field of width 3m
     meters_per_yard = 0.9144  # unit conversion from yards to meters
@@ -68,136 +119,164 @@ def plot_pitch(
     D_radius = 10 * meters_per_yard
     D_pos = 12 * meters_per_yard
     centre_circle_radius = 10 * meters_per_yard
-    # plot half way line # center circle
-    ax.plot([0, 0], [-half_pitch_width, half_pitch_width], lc, linewidth=linewidth)
-    ax.scatter(0.0, 0.0, marker="o", facecolor=lc, linewidth=0, s=markersize)
+    lines = []
+    # half way line # center circle
+    lines.append(np.array([[0, -half_pitch_width], [0, half_pitch_width]]))
+    spots = [(0.0, 0.0)]
     y = np.linspace(-1, 1, 50) * centre_circle_radius
     x = np.sqrt(centre_circle_radius**2 - y**2)
-    ax.plot(x, y, lc, linewidth=linewidth)
-    ax.plot(-x, y, lc, linewidth=linewidth)
-    for s in signs:  # plots each line seperately
-        # plot pitch boundary
-        ax.plot(
-            [-half_pitch_length, half_pitch_length],
-            [s * half_pitch_width, s * half_pitch_width],
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length],
-            [-half_pitch_width, half_pitch_width],
-            lc,
-            linewidth=linewidth,
-        )
-        # goal posts & line
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length],
-            [-goal_line_width / 2.0, goal_line_width / 2.0],
-            pc + "s",
-            markersize=6 * markersize / 20.0,
-            linewidth=linewidth,
-        )
+    lines.append(np.column_stack([x, y]))
+    lines.append(np.column_stack([-x, y]))
+    posts = []
+    for s in signs:  # each line seperately
+        # pitch boundary
+        lines.append(np.array([[-half_pitch_length, s * half_pitch_width], [half_pitch_length, s * half_pitch_width]]))
+        lines.append(np.array([[s * half_pitch_length, -half_pitch_width], [s * half_pitch_length, half_pitch_width]]))
+        # goal posts
+        posts += [(s * half_pitch_length, -goal_line_width / 2.0), (s * half_pitch_length, goal_line_width / 2.0)]
         # 6 yard box
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length - s * box_length],
-            [box_width / 2.0, box_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length - s * box_length],
-            [-box_width / 2.0, -box_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            [
-                s * half_pitch_length - s * box_length,
-                s * half_pitch_length - s * box_length,
-            ],
-            [-box_width / 2.0, box_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
+        lines.append(np.array([[s * half_pitch_length, box_width / 2.0], [s * half_pitch_length - s * box_length, box_width / 2.0]]))
+        lines.append(np.array([[s * half_pitch_length, -box_width / 2.0], [s * half_pitch_length - s * box_length, -box_width / 2.0]]))
+        lines.append(np.array([[s * half_pitch_length - s * box_length, -box_width / 2.0], [s * half_pitch_length - s * box_length, box_width / 2.0]]))
         # penalty area
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length - s * area_length],
-            [area_width / 2.0, area_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            [s * half_pitch_length, s * half_pitch_length - s * area_length],
-            [-area_width / 2.0, -area_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            [
-                s * half_pitch_length - s * area_length,
-                s * half_pitch_length - s * area_length,
-            ],
-            [-area_width / 2.0, area_width / 2.0],
-            lc,
-            linewidth=linewidth,
-        )
+        lines.append(np.array([[s * half_pitch_length, area_width / 2.0], [s * half_pitch_length - s * area_length, area_width / 2.0]]))
+        lines.append(np.array([[s * half_pitch_length, -area_width / 2.0], [s * half_pitch_length - s * area_length, -area_width / 2.0]]))
+        lines.append(np.array([[s * half_pitch_length - s * area_length, -area_width / 2.0], [s * half_pitch_length - s * area_length, area_width / 2.0]]))
         # penalty spot
-        ax.scatter(
-            s * half_pitch_length - s * penalty_spot,
-            0.0,
-            marker="o",
-            facecolor=lc,
-            linewidth=0,
-            s=markersize,
-        )
+        spots.append((s * half_pitch_length - s * penalty_spot, 0.0))
         # corner flags
         y = np.linspace(0, 1, 50) * corner_radius
         x = np.sqrt(corner_radius**2 - y**2)
-        ax.plot(
-            s * half_pitch_length - s * x,
-            -half_pitch_width + y,
-            lc,
-            linewidth=linewidth,
-        )
-        ax.plot(
-            s * half_pitch_length - s * x, half_pitch_width - y, lc, linewidth=linewidth
-        )
-        # draw the D
-        y = (
-            np.linspace(-1, 1, 50) * D_length
-        )  # D_length is the chord of the circle that defines the D
+        lines.append(np.column_stack([s * half_pitch_length - s * x, -half_pitch_width + y]))
+        lines.append(np.column_stack([s * half_pitch_length - s * x, half_pitch_width - y]))
+        # the D
+        y = np.linspace(-1, 1, 50) * D_length  # D_length is the chord of the circle that defines the D
         x = np.sqrt(D_radius**2 - y**2) + D_pos
-        ax.plot(s * half_pitch_length - s * x, y, lc, linewidth=linewidth)
+        lines.append(np.column_stack([s * half_pitch_length - s * x, y]))
+    return PitchMarkings(facecolor, lc, pc, tuple(lines), lc, np.array(spots), np.array(posts),
+                         field_dimen[0] / 2.0 + border_dimen[0], field_dimen[1] / 2.0 + border_dimen[1])
 
-    # remove axis labels and ticks
-    ax.set_xticklabels([])
-    ax.set_yticklabels([])
-    ax.set_xticks([])
-    ax.set_yticks([])
-    # set axis limits
-    xmax = field_dimen[0] / 2.0 + border_dimen[0]
-    ymax = field_dimen[1] / 2.0 + border_dimen[1]
-    ax.set_xlim([-xmax, xmax])
-    ax.set_ylim([-ymax, ymax])
-    ax.set_axisbelow(True)
-    return fig, ax
+
+class PitchFigurePool(object):
+    '''
+    Pitch figures for batch rendering. get() hands out a figure with a bare pitch: a figure that was given back with
+    release() for the same pitch settings (its extra artists removed and its layout restored) or a new one. Pooled
+    figures are not created through pyplot, so they are never shown and do not need plt.close: give them back with
+    release() or use them through figure(). At most 'max_figures' released figures are kept per pitch setting.
+    '''
+
+    def __init__(self, max_figures=4):
+        self.max_figures = max_figures
+        self._free = {}
+        self._state = {}
+
+    def get(self, field_dimen=(105.0, 68.0), field_color="green", linewidth=2, markersize=20):
+        key = (tuple(float(d) for d in field_dimen), field_color, linewidth, markersize)
+        if self._free.get(key):
+            return self._free[key].pop()
+        fig = Figure(figsize=(12, 8))
+        FigureCanvasAgg(fig)
+        ax = draw_pitch(fig.add_subplot(), *key)
+        self._state[fig] = (key, set(ax.get_children()), ax.get_position(), ax.get_aspect(), fig.get_dpi())
+        return fig, ax
+
+    def release(self, fig):
+        key, pitch_artists, position, aspect, dpi = self._state[fig]
+        ax = fig.axes[0]
+        # other axes first: removing a colorbar axes needs its image to still be on the pitch axes
+        for other in fig.axes[1:]:
+            other.remove()
+        for artist in ax.get_children():
+            if artist not in pitch_artists:
+                artist.remove()
+        fig.texts.clear()
+        ax.set_position(position)
+        ax.set_aspect(aspect)  # imshow sets an equal aspect
+        ax.set_xlim([-pitch_markings(*key).xmax, pitch_markings(*key).xmax])
+        ax.set_ylim([-pitch_markings(*key).ymax, pitch_markings(*key).ymax])
+        fig.set_dpi(dpi)
+        free = self._free.setdefault(key, [])
+        if len(free) < self.max_figures:
+            free.append((fig, ax))
+        else:
+            del self._state[fig]
+
+    @contextmanager
+    def figure(self, **pitch):
+        # with pitch_figures.figure(field_dimen=...) as (fig, ax): ... (the figure is released afterwards)
+        fig, ax = self.get(**pitch)
+        try:
+            yield fig, ax
+        finally:
+            self.release(fig)
+
+# pitch figures of the current process (each worker process of a pool has its own)
+pitch_figures = PitchFigurePool()
 
 def plot_events(events, figax=None, field_dimen = (105.0,68), indicators = ['Marker','Arrow'], color='r', marker_style = 'o', alpha = 0.5, annotate=False):
+    # all markers are drawn with a single scatter and all arrows with a single quiver, so the number of artists does
+    # not grow with the number of events
     if figax is None: # create new pitch 
         fig,ax = plot_pitch( field_dimen = field_dimen )
     else: # overlay on a previously generated pitch
         fig,ax = figax 
-    for i,row in events.iterrows():
-        if 'Marker' in indicators:
-            ax.plot(  row['start_x'], row['start_y'], color+marker_style, alpha=alpha )
-        if 'Arrow' in indicators:
-            ax.annotate("", xy=row[['end_x','end_y']], xytext=row[['start_x','start_y']], alpha=alpha, arrowprops=dict(alpha=alpha,width=0.5,headlength=4.0,headwidth=4.0,color=color),annotation_clip=False)
-        if annotate:
-            textstring = row['type_name'] + ': ' + row['FullName']
-            ax.text( row['start_x'], row['start_y'], textstring, fontsize=10, color=color)
+    start_x = events['start_x'].to_numpy(dtype=float)
+    start_y = events['start_y'].to_numpy(dtype=float)
+    if 'Marker' in indicators and len(events):
+        ax.scatter( start_x, start_y, s=plt.rcParams['lines.markersize']**2, c=color, edgecolors=color, marker=marker_style, alpha=alpha )
+    if 'Arrow' in indicators and len(events):
+        dx = events['end_x'].to_numpy(dtype=float) - start_x
+        dy = events['end_y'].to_numpy(dtype=float) - start_y
+        valid = np.isfinite(start_x) & np.isfinite(start_y) & np.isfinite(dx) & np.isfinite(dy)
+        if valid.any():
+            # arrows in data coordinates from start to end location, sized like the annotate arrows (0.5pt shaft and 4pt head, plus their 1pt edge)
+            ax.quiver( start_x[valid], start_y[valid], dx[valid], dy[valid], angles='xy', scale_units='xy', scale=1, units='inches',
+                       width=1.5/72., headwidth=3.5, headlength=3.5, headaxislength=3., color=color, alpha=alpha )
+    if annotate:
+        for x, y, type_name, name in zip(start_x, start_y, events['type_name'], events['FullName']):
+            textstring = type_name + ': ' + name
+            ax.text( x, y, textstring, fontsize=10, color=color)
     return fig,ax
 
-def plot_pitchcontrol_for_event(eid, events, home_data, away_data, ball, PPCF, alpha = 0.7, include_player_velocities=True, annotate=False, field_dimen = (105.0,68)):
+def export_event_maps(game_ids, out_folder, by='player', event_types=('Pass',), fc_twente_folder=IO.FC_TWENTE_FOLDER, fmt='png', field_dimen=(105.0,68), color='r', alpha=0.5, dpi=100, n_workers=None):
+    '''
+    Render an event map (plot_events) of every player (by='player') or team (by='team') in every game of 'game_ids' to
+    '<out_folder>/Game <id>/<player or team>.<fmt>' (fmt 'png' or 'svg'). Games are rendered in a process pool of
+    n_workers processes (default is the number of cpus); each process reuses its pitch figures (pitch_figures) for all
+    its maps. Returns the file names that were written.
+    '''
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    tasks = [ (fc_twente_folder, game_id, out_folder, by, event_types, fmt, field_dimen, color, alpha, dpi) for game_id in game_ids ]
+    if n_workers<=1 or len(tasks)<=1:
+        results = [_export_game_event_maps(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_export_game_event_maps, *zip(*tasks)))
+    return [fname for result in results for fname in result]
+
+def _export_game_event_maps(fc_twente_folder, game_id, out_folder, by, event_types, fmt, field_dimen, color, alpha, dpi):
+    # process pool task of export_event_maps: the event maps of one game, drawn on the pooled pitch figures of this process
+    events = IO.to_metric_coordinates(IO.load_fc_twente_data(fc_twente_folder, game_id, mode="load-event"), field_dimen)
+    if event_types is not None:
+        events = events.loc[events['type_name'].isin(event_types)]
+    group_column = {'player': 'FullName', 'team': 'Team'}[by]
+    game_folder = os.path.join(out_folder, f"Game {game_id}")
+    os.makedirs(game_folder, exist_ok=True)
+    fnames = []
+    for name, group in events.groupby(group_column, sort=True):
+        with pitch_figures.figure(field_dimen=field_dimen) as (fig,ax):
+            plot_events(group, figax=(fig,ax), color=color, alpha=alpha)
+            fname = os.path.join(game_folder, "%s.%s" % (name, fmt))
+            fig.savefig(fname, format=fmt, dpi=dpi)
+        fnames.append(fname)
+    return fnames
+
+def plot_pitchcontrol_for_event(eid, events, home_data, away_data, ball, PPCF=None, alpha = 0.7, include_player_velocities=True, annotate=False, field_dimen = (105.0,68), params=None, GK_numbers=None):
+    if PPCF is None:
+        # compute the surface (or take it from the pitch control cache if it was already generated for this event)
+        assert params is not None and GK_numbers is not None, "params and GK_numbers are needed to generate the pitch control surface"
+        PPCF,_,_ = pc.generate_pitch_control_for_event(eid, events, home_data, away_data, params, GK_numbers, field_dimen = field_dimen, verbose=False)
     start_frame = events.loc[eid]['start_frameID']
     team_performed = events.loc[eid].Team
 
@@ -216,18 +295,152 @@ def plot_pitchcontrol_for_event(eid, events, home_data, away_data, ball, PPCF, a
     return fig, ax
 
 
-def generate_video(home, away, ball, path="", file_name="video_out", fps=25, figax=None, team_colors=("r", "b"), field_dimen=(106.0, 68.0), include_player_velocities=False, annotate = True,):
+def generate_video(home, away, ball, path="", file_name="video_out", fps=25, figax=None, team_colors=("r", "b"), field_dimen=(106.0, 68.0), include_player_velocities=False, annotate = True, blit=True, n_workers=1, segment_frames=1500, dpi=100):
+    # Render the frames of home/away (tracking DataFrames with the same index) and ball (indexed by frameID) to
+    # path/file_name.mp4. With blit=True the pitch is drawn once and only the player, ball and clock artists are
+    # redrawn for each frame, from NumPy arrays extracted up front; frames are piped straight to ffmpeg. With
+    # n_workers>1 the frames are split into segments of 'segment_frames' frames that are rendered in a process pool and
+    # joined with ffmpeg. blit=False uses the original frame by frame implementation (for comparison).
     assert np.all( home.index==away.index)
+    fname = path + '/' +  file_name + '.mp4'
+    start = time.perf_counter()
+    if not blit:
+        generate_video_reference(home, away, ball, fname, fps=fps, figax=figax, team_colors=team_colors, field_dimen=field_dimen, include_player_velocities=include_player_velocities, dpi=dpi)
+    else:
+        arrays = video_frame_arrays(home, away, ball, include_player_velocities)
+        n_frames = len(home.index)
+        n_segments = int(np.ceil(n_frames/float(segment_frames))) if n_frames else 0
+        if n_workers<=1 or n_segments<=1 or figax is not None:
+            if figax is None:
+                fig,ax = pitch_figures.get(field_dimen=field_dimen)
+            else:
+                fig,ax = figax
+            render_video_frames(fig, ax, arrays, fname, fps=fps, team_colors=team_colors, field_dimen=field_dimen, dpi=dpi)
+            if figax is None:
+                pitch_figures.release(fig)
+        else:
+            segments = np.array_split(np.arange(n_frames), n_segments)
+            segment_fnames = ['%s/%s_part%03d.mp4' % (path, file_name, k) for k in range(n_segments)]
+            tasks = [ ({key: value[segment] for key,value in arrays.items()}, segment_fname) for segment,segment_fname in zip(segments,segment_fnames) ]
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(_render_video_segment, [t[0] for t in tasks], [t[1] for t in tasks], [fps]*n_segments, [team_colors]*n_segments, [field_dimen]*n_segments, [dpi]*n_segments))
+            concatenate_videos(segment_fnames, fname)
+    elapsed = time.perf_counter()-start
+    print("done: %d frames in %1.1f s (%1.1f frames/s)" % (len(home.index), elapsed, len(home.index)/elapsed if elapsed>0 else np.inf))
+
+
+def video_frame_arrays(home, away, ball, include_player_velocities=False):
+    # extract everything that is drawn in a video into (frames x players) NumPy arrays, once
+    arrays = {}
+    for key,team in zip(['home','away'],[home,away]):
+        schema = IO.tracking_schema(team)
+        for field in (['x','y','vx','vy'] if include_player_velocities else ['x','y']):
+            arrays[key+'_'+field] = team.iloc[:, schema.positions(field)].to_numpy(dtype=float)
+    ball = ball.reindex(home.index)
+    arrays['ball_x'] = ball['X'].to_numpy(dtype=float)
+    arrays['ball_y'] = ball['Y'].to_numpy(dtype=float)
+    arrays['time'] = home['Time [s]'].to_numpy(dtype=float)
+    return arrays
+
+
+def render_video_frames(fig, ax, arrays, fname, fps=25, team_colors=("r", "b"), field_dimen=(106.0, 68.0), dpi=100, overlay=None, surfaces=None):
+    # blitting renderer used by generate_video: the static figure is drawn once and saved as background, and for each
+    # frame the background is restored and only the persistent (animated) artists are updated and redrawn.
+    # 'overlay' is an optional image artist (e.g. a pitch control imshow) that is updated with set_data from the next
+    # item of 'surfaces' (an iterable with one 2D array per frame) before the frame is drawn.
+    fig.set_dpi(dpi)
+    fig.tight_layout()
+    artists = []
+    teams = []
+    for key,color in zip(['home','away'],team_colors):
+        points, = ax.plot([], [], color + "o", alpha=0.7, animated=True)
+        arrows = None
+        if key+'_vx' in arrays:
+            n_players = arrays[key+'_x'].shape[1]
+            arrows = ax.quiver( np.zeros(n_players), np.zeros(n_players), np.zeros(n_players), np.zeros(n_players), color=color, scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,alpha=0.7, animated=True)
+            artists.append(arrows)
+        teams.append( (key, points, arrows) )
+        artists.append(points)
+    ball_point, = ax.plot([], [], 'ko', alpha=1.0, animated=True)
+    clock = ax.text(-2.5,field_dimen[1]/2.+1., "", fontsize=14, animated=True)
+    artists += [ball_point, clock]
+    if overlay is not None:
+        overlay.set_animated(True)
+        artists.insert(0, overlay)
+        surfaces = iter(surfaces)
+
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    width, height = fig.canvas.get_width_height(physical=True)
+    proc = open_ffmpeg_pipe(fname, width, height, fps)
+    try:
+        for i in range(len(arrays['time'])):
+            fig.canvas.restore_region(background)
+            if overlay is not None:
+                overlay.set_data( next(surfaces) )
+            for key,points,arrows in teams:
+                points.set_data( arrays[key+'_x'][i], arrays[key+'_y'][i] )
+                if arrows is not None:
+                    arrows.set_offsets( np.column_stack([arrays[key+'_x'][i], arrays[key+'_y'][i]]) )
+                    arrows.set_UVC( arrays[key+'_vx'][i], arrays[key+'_vy'][i] )
+            ball_point.set_data( [arrays['ball_x'][i]], [arrays['ball_y'][i]] )
+            frame_minute =  int( arrays['time'][i]/60. )
+            frame_second =  ( arrays['time'][i]/60. - frame_minute ) * 60.
+            clock.set_text( "%d:%1.2f" % ( frame_minute, frame_second  ) )
+            for artist in artists:
+                ax.draw_artist(artist)
+            proc.stdin.write( fig.canvas.buffer_rgba() )
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    for artist in artists:
+        if artist is not overlay:
+            artist.remove()
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg failed to write %s" % fname)
+
+
+def open_ffmpeg_pipe(fname, width, height, fps):
+    # ffmpeg process that encodes raw RGBA frames written to its stdin into an mp4 file
+    command = [plt.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+               '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', fname]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+def concatenate_videos(segment_fnames, fname):
+    # join mp4 segments (encoded with the same settings) into one file without re-encoding, and remove the segments
+    list_fname = fname + '.segments.txt'
+    with open(list_fname, 'w') as f:
+        for segment_fname in segment_fnames:
+            f.write("file '%s'\n" % os.path.abspath(segment_fname).replace("'", "'\\''"))
+    try:
+        subprocess.run([plt.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_fname, '-c', 'copy', fname], check=True)
+    finally:
+        os.remove(list_fname)
+        for segment_fname in segment_fnames:
+            if os.path.exists(segment_fname):
+                os.remove(segment_fname)
+
+
+def _render_video_segment(arrays, fname, fps, team_colors, field_dimen, dpi):
+    # process pool task of generate_video: render one segment of frames on a pooled pitch of this process
+    with pitch_figures.figure(field_dimen=field_dimen) as (fig,ax):
+        render_video_frames(fig, ax, arrays, fname, fps=fps, team_colors=team_colors, field_dimen=field_dimen, dpi=dpi)
+    return fname
+
+
+def generate_video_reference(home, away, ball, fname, fps=25, figax=None, team_colors=("r", "b"), field_dimen=(106.0, 68.0), include_player_velocities=False, dpi=100):
+    # original implementation of generate_video: new artists for every frame, rendered with a full redraw of the figure
     index = home.index
     FFMPEGWriter = animation.writers['ffmpeg']
     writer = FFMPEGWriter(fps=fps)
-    fname = path + '/' +  file_name + '.mp4'
     if figax is None:
-        fig,ax = vis.plot_pitch(field_dimen=field_dimen)
+        fig,ax = plot_pitch(field_dimen=field_dimen)
     else:
         fig,ax = figax
     fig.set_tight_layout(True)
-    with writer.saving(fig, fname, 100):
+    with writer.saving(fig, fname, dpi):
         for i in index:
             figobjs = []
             for team,color in zip( [home.loc[i],away.loc[i]], team_colors) :
@@ -238,7 +451,6 @@ def generate_video(home, away, ball, path="", file_name="video_out", fps=25, fig
                 if include_player_velocities:
                     vx_columns = ['{}_vx'.format(c[:-2]) for c in x_columns] # column header for player x positions
                     vy_columns = ['{}_vy'.format(c[:-2]) for c in y_columns] # column header for player y positions
-                    # print(vx_columns)
                     objs = ax.quiver( team[x_columns], team[y_columns], team[vx_columns], team[vy_columns], color=color, scale_units='inches', scale=10.,width=0.0015,headlength=5,headwidth=3,alpha=0.7)
                     figobjs.append(objs)
             objs,  = ax.plot( ball['X'].loc[i], ball['Y'].loc[i], 'ko', alpha=1.0)
@@ -253,6 +465,51 @@ def generate_video(home, away, ball, path="", file_name="video_out", fps=25, fig
 
             for figobj in figobjs:
                 figobj.remove()
-    print("done")
-    # plt.clf()
-    # plt.close(fig)    
\ No newline at end of file
+
+
+def generate_pitchcontrol_video(home, away, ball, params, GK_numbers, frame_range=None, attacking_team='Team_A', path="", file_name="pitchcontrol_video", fps=25, team_colors=("r", "b"), field_dimen=(105.0, 68.0), n_grid_cells_x=50, include_player_velocities=True, n_workers=None, chunk_frames=25, dpi=100, interpolation='bilinear'):
+    # Video of the pitch control of 'attacking_team' over a range of frames (frame_range=(first frameID, last frameID),
+    # all frames of home/away by default), drawn under the players. The surfaces are computed in chunks of 'chunk_frames'
+    # frames in a process pool while the frames are being encoded: the renderer takes the surfaces in order as soon as
+    # their chunk is done, so computing and encoding overlap. One imshow artist is created and updated with set_data
+    # ('bilinear' interpolation is used by default: 'spline36' as in plot_pitchcontrol_for_event is ~2x slower to draw).
+    if frame_range is not None:
+        home = home.loc[frame_range[0]:frame_range[1]]
+        away = away.loc[frame_range[0]:frame_range[1]]
+    assert np.all( home.index==away.index)
+    fname = path + '/' +  file_name + '.mp4'
+    start = time.perf_counter()
+    arrays = video_frame_arrays(home, away, ball, include_player_velocities)
+    ball_xy = np.column_stack( [arrays['ball_x'], arrays['ball_y']] )
+    chunks = [ slice(i, i+chunk_frames) for i in range(0, len(home.index), chunk_frames) ]
+    tasks = [ (home.iloc[c], away.iloc[c], ball_xy[c]) for c in chunks ]
+    options = (attacking_team, params, GK_numbers, field_dimen, n_grid_cells_x)
+
+    fig,ax = pitch_figures.get(field_color='white', field_dimen=field_dimen)
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    cmap = 'bwr' if attacking_team=='Team_A' else 'bwr_r' # colour of the attacking team where it has control
+    overlay = ax.imshow(np.full((n_grid_cells_y, n_grid_cells_x), 0.5), extent=(-field_dimen[0]/2., field_dimen[0]/2., -field_dimen[1]/2., field_dimen[1]/2.),interpolation=interpolation,vmin=0.0,vmax=1.0,cmap=cmap,alpha=0.5)
+    try:
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        if n_workers<=1 or len(tasks)<=1:
+            chunk_surfaces = ( _pitch_control_surfaces(*task, *options) for task in tasks )
+            render_video_frames(fig, ax, arrays, fname, fps=fps, team_colors=team_colors, field_dimen=field_dimen, dpi=dpi, overlay=overlay, surfaces=( np.flipud(s) for chunk in chunk_surfaces for s in chunk ))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                # executor.map submits all chunks up front and yields their results in order
+                chunk_surfaces = executor.map(_pitch_control_surfaces, *zip(*[ task+options for task in tasks ]))
+                render_video_frames(fig, ax, arrays, fname, fps=fps, team_colors=team_colors, field_dimen=field_dimen, dpi=dpi, overlay=overlay, surfaces=( np.flipud(s) for chunk in chunk_surfaces for s in chunk ))
+    finally:
+        pitch_figures.release(fig)
+    elapsed = time.perf_counter()-start
+    print("done: %d frames in %1.1f s (%1.1f frames/s)" % (len(home.index), elapsed, len(home.index)/elapsed if elapsed>0 else np.inf))
+
+
+def _pitch_control_surfaces(home, away, ball_xy, attacking_team, params, GK_numbers, field_dimen, n_grid_cells_x):
+    # process pool task of generate_pitchcontrol_video: pitch control surfaces of a chunk of frames
+    surfaces = []
+    for i in range(len(home.index)):
+        PPCFa,_,_ = pc.generate_pitch_control_for_frame(home.iloc[i], away.iloc[i], ball_xy[i], attacking_team, params, GK_numbers, field_dimen=field_dimen, n_grid_cells_x=n_grid_cells_x, use_cache=False)
+        surfaces.append(PPCFa.astype(np.float32))
+    return np.array(surfaces)
@@ -0,0 +1,206 @@
+import os
+import numpy as np
+import scipy.sparse as sparse
+import data_in_out as IO
+import season
+
+# event types ('type_name') of the xT model, as in xThreat_model.ipynb
+MOVE_TYPES = ('Pass', 'Take on')
+SHOT_TYPES = ('Attempt saved', 'Goal', 'Miss')
+GOAL_TYPES = ('Goal',)
+
+
+class XTBuilder(object):
+    '''
+    Expected threat (xT) grid built from our own event data, by value iteration over a grid of bins=(nx, ny) zones.
+
+    Events are added one game at a time (add_game / add_games): moves (passes and take ons), shots and goals are
+    binned by their start (and end) location and accumulated in count arrays and a sparse (zones x zones) matrix of move
+    transitions. The counts are all the state there is, so a new game is added to a saved builder (save / load) without
+    going over the other games again. solve() then iterates the xT fixed point
+        xT = P(shot)*P(goal|shot) + P(move) * T @ xT
+    with T the move transition probabilities, and write() saves the grid for ept.load_xT_grid.
+
+    Event coordinates are the raw coordinates of events.csv ((0,0) to field_dimen). Events are oriented so that every
+    team attacks left->right (the orientation of the grid, see ept.get_xT_at_location): the direction of play of a team
+    in a period is taken from the side of the pitch where its shots are taken (attack_direction='shots'), or the events
+    are used as they are (attack_direction=None, as xThreat_model.ipynb does). With successful_moves_only=True (default)
+    only completed moves count as transitions, so a lost ball is worth nothing; with False every move does (as the notebook).
+    '''
+
+    def __init__(self, bins=(16, 12), field_dimen=(105., 68.), attack_direction='shots', successful_moves_only=True):
+        self.bins = tuple(int(b) for b in bins)
+        self.field_dimen = tuple(float(d) for d in field_dimen)
+        self.attack_direction = attack_direction
+        self.successful_moves_only = successful_moves_only
+        n_zones = self.bins[0]*self.bins[1]
+        self.move_counts = np.zeros(n_zones)
+        self.shot_counts = np.zeros(n_zones)
+        self.goal_counts = np.zeros(n_zones)
+        self.transition_counts = sparse.csr_matrix((n_zones, n_zones))
+        self.game_ids = []
+
+    def zones(self, x, y):
+        # zone (flat index of the (ny, nx) grid) of every position, -1 for missing positions. Positions on or beyond
+        # the edge of the field are put in the outer zones
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        nx, ny = self.bins
+        valid = np.isfinite(x) & np.isfinite(y)
+        ix = np.clip( np.floor( np.nan_to_num(x)/self.field_dimen[0]*nx ), 0, nx-1 ).astype(int)
+        iy = np.clip( np.floor( np.nan_to_num(y)/self.field_dimen[1]*ny ), 0, ny-1 ).astype(int)
+        return np.where( valid, iy*nx + ix, -1 )
+
+    def add_game(self, events, game_id=None):
+        '''
+        Add the events of a game (raw events.csv coordinates). A game_id that was already added is skipped. Returns
+        True if the game was added
+        '''
+        if game_id is not None:
+            if game_id in self.game_ids:
+                return False
+            self.game_ids.append(game_id)
+        events = self.oriented(events)
+        n_zones = len(self.move_counts)
+        moves = events.loc[events['type_name'].isin(MOVE_TYPES)]
+        move_start = self.zones(moves['start_x'], moves['start_y'])
+        move_end = self.zones(moves['end_x'], moves['end_y'])
+        self.move_counts += np.bincount( move_start[move_start>=0], minlength=n_zones )
+        transitions = (move_start>=0) & (move_end>=0)
+        if self.successful_moves_only:
+            transitions &= moves['outcome'].fillna(False).astype(bool).to_numpy()
+        self.transition_counts = self.transition_counts + sparse.csr_matrix(
+            (np.ones(transitions.sum()), (move_start[transitions], move_end[transitions])), shape=(n_zones, n_zones))
+        shots = events.loc[events['type_name'].isin(SHOT_TYPES)]
+        shot_zones = self.zones(shots['start_x'], shots['start_y'])
+        self.shot_counts += np.bincount( shot_zones[shot_zones>=0], minlength=n_zones )
+        goal_zones = shot_zones[ shots['type_name'].isin(GOAL_TYPES).to_numpy() ]
+        self.goal_counts += np.bincount( goal_zones[goal_zones>=0], minlength=n_zones )
+        return True
+
+    def oriented(self, events):
+        # events with the x coordinates of the teams attacking right->left mirrored, so that every team attacks left->right
+        if self.attack_direction is None:
+            return events
+        assert self.attack_direction == 'shots', "Unknown attack_direction '%s' (use 'shots' or None)" % self.attack_direction
+        directions = playing_directions(events, self.field_dimen)
+        flip = np.array( [directions.get((team, period), 1) == -1 for team, period in zip(events['Team'], events['period_id'])], dtype=bool )
+        if not flip.any():
+            return events
+        events = events.copy()
+        for column in ('start_x', 'end_x'):
+            events.loc[flip, column] = self.field_dimen[0] - events.loc[flip, column]
+        return events
+
+    def add_games(self, game_ids=None, fc_twente_folder=IO.FC_TWENTE_FOLDER, use_cache=True):
+        '''
+        Add the events of every 'Game N' folder (all games by default) that has not been added yet, one game at a time.
+        Returns the ids of the games that were added
+        '''
+        game_ids = season.find_games(fc_twente_folder) if game_ids is None else list(game_ids)
+        added = []
+        for game_id in game_ids:
+            if game_id in self.game_ids:
+                continue
+            events = IO.load_fc_twente_data(fc_twente_folder, game_id, mode="load-event", use_cache=use_cache)
+            if self.add_game(events, game_id):
+                added.append(game_id)
+        return added
+
+    def probabilities(self):
+        # P(move), P(shot), P(goal|shot) per zone and the sparse move transition probabilities T (rows: start zone)
+        actions = self.move_counts + self.shot_counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            move_probability = np.where( actions>0, self.move_counts/actions, 0. )
+            shot_probability = np.where( actions>0, self.shot_counts/actions, 0. )
+            goal_probability = np.where( self.shot_counts>0, self.goal_counts/self.shot_counts, 0. )
+            row_scale = np.where( self.move_counts>0, 1./self.move_counts, 0. )
+        transitions = sparse.diags(row_scale) @ self.transition_counts
+        return move_probability, shot_probability, goal_probability, transitions.tocsr()
+
+    def solve(self, tol=1e-8, max_iter=1000):
+        '''
+        xT grid ((ny, nx) array, row 0 at y=0) from the counts, by iterating the xT fixed point until the largest change
+        of a zone is below tol (or max_iter iterations)
+        '''
+        move_probability, shot_probability, goal_probability, transitions = self.probabilities()
+        shot_payoff = shot_probability*goal_probability
+        # fold P(move) into the transition matrix so that each iteration is a single sparse matrix-vector product
+        moves = sparse.diags(move_probability) @ transitions
+        xT = np.zeros(len(shot_payoff))
+        for i in range(max_iter):
+            updated = shot_payoff + moves @ xT
+            converged = np.max( np.abs(updated-xT), initial=0. ) < tol
+            xT = updated
+            if converged:
+                break
+        return xT.reshape(self.bins[1], self.bins[0])
+
+    def write(self, fname='xT.csv', tol=1e-8, max_iter=1000):
+        # solve and save the grid in the format of ept.load_xT_grid
+        xT = self.solve(tol=tol, max_iter=max_iter)
+        np.savetxt(fname, xT, delimiter=",")
+        return xT
+
+    def save(self, fname):
+        # save the counts (the builder state) to a .npz file
+        transitions = self.transition_counts.tocoo()
+        np.savez(fname, bins=self.bins, field_dimen=self.field_dimen, attack_direction=str(self.attack_direction),
+                 successful_moves_only=self.successful_moves_only, move_counts=self.move_counts, shot_counts=self.shot_counts,
+                 goal_counts=self.goal_counts, transition_rows=transitions.row, transition_cols=transitions.col,
+                 transition_counts=transitions.data, game_ids=np.array(self.game_ids))
+
+    @classmethod
+    def load(cls, fname):
+        state = np.load(fname, allow_pickle=False)
+        attack_direction = str(state['attack_direction'])
+        builder = cls(tuple(state['bins']), tuple(state['field_dimen']), None if attack_direction=='None' else attack_direction,
+                      bool(state['successful_moves_only']))
+        builder.move_counts = state['move_counts']
+        builder.shot_counts = state['shot_counts']
+        builder.goal_counts = state['goal_counts']
+        n_zones = len(builder.move_counts)
+        builder.transition_counts = sparse.csr_matrix((state['transition_counts'], (state['transition_rows'], state['transition_cols'])), shape=(n_zones, n_zones))
+        builder.game_ids = state['game_ids'].tolist()
+        return builder
+
+
+def playing_directions(events, field_dimen=(105., 68.)):
+    '''
+    Direction of play (1: left->right, -1: right->left) of every (team, period) of a game, from the side of the pitch
+    where the team takes its shots. A team without shots in a period plays the opposite way of the other team (or of
+    itself in the other period); (team, period) pairs that cannot be decided are left out
+    '''
+    shots = events.loc[events['type_name'].isin(SHOT_TYPES)]
+    mean_x = shots.groupby(['Team', 'period_id'])['start_x'].mean()
+    directions = {key: (1 if x > field_dimen[0]/2. else -1) for key, x in mean_x.items()}
+    teams = events['Team'].dropna().unique()
+    periods = events['period_id'].dropna().unique()
+    for team in teams:
+        for period in periods:
+            if (team, period) in directions:
+                continue
+            others = [directions[(other, period)] for other in teams if other != team and (other, period) in directions]
+            own = [directions[(team, other)] for other in periods if other != period and (team, other) in directions]
+            if others:
+                directions[(team, period)] = -others[0]
+            elif own:
+                directions[(team, period)] = -own[0]
+    return directions
+
+
+def build_xT_grid(fc_twente_folder=IO.FC_TWENTE_FOLDER, game_ids=None, bins=(16, 12), out_file='xT.csv', state_file=None, **kwargs):
+    '''
+    Build (or update) the xT grid from the events of all 'Game N' folders (or game_ids) and write it to out_file for
+    ept.load_xT_grid. With state_file, the counts are kept in that file: a later call only reads the games that were
+    not added yet. Returns the (ny, nx) grid
+    '''
+    if state_file is not None and os.path.exists(state_file):
+        builder = XTBuilder.load(state_file)
+        assert builder.bins == tuple(bins), "state_file was built with bins=%s" % (builder.bins,)
+    else:
+        builder = XTBuilder(bins, **kwargs)
+    added = builder.add_games(game_ids, fc_twente_folder)
+    if state_file is not None and added:
+        builder.save(state_file)
+    return builder.write(out_file) if out_file is not None else builder.solve()